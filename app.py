@@ -1,12 +1,26 @@
+import os
 import streamlit as st
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
 from datetime import datetime, timedelta
-import sqlparse
 from bigquery_client import BigQueryClient
-from text2sql import Text2SQLGenerator
+from text2sql import Text2SQLGenerator, REPAIR_STATS
+from result_cache import ResultCache, SCHEMA_CACHE
+from pipeline import QueryPipeline, FAILED, EXECUTING
+from rollups import RollupStore, RollupRouter
+from bigquery_client import format_bytes
+from singleflight import singleflight_stats
+from llm_router import provider_stats
+from scheduler import current_user_id, scheduler_stats
 from config import Config
+from exporter import EXPORT_FORMATS, export_query
+from schema_catalog import CatalogIndex
+from incremental import refresh_saved_query
+from prewarm import PREWARMER
+from rerun_profile import checkpoint, current_profiler, profiled
+from dashboard import cached_result, is_stale, pinned_queries, run_tiles, staleness_label, tile_sql
+from usage import USAGE, usage_context
+from sampling import sample_query
+from sql_rewriter import limits_rows, reduces_scan
 
 # Page configuration
 st.set_page_config(
@@ -236,13 +250,27 @@ def initialize_session_state():
         st.session_state.bq_client = BigQueryClient()
     
     if 'text2sql' not in st.session_state:
-        st.session_state.text2sql = Text2SQLGenerator(use_vertex_ai=True)
+        st.session_state.text2sql = Text2SQLGenerator(use_vertex_ai=Config.LLM_PROVIDER != 'openai')
     
     if 'query_history' not in st.session_state:
         st.session_state.query_history = []
     
     if 'table_schemas' not in st.session_state:
         st.session_state.table_schemas = {}
+    
+    if 'catalog_index' not in st.session_state:
+        st.session_state.catalog_index = CatalogIndex(st.session_state.table_schemas)
+    
+    if 'pipeline' not in st.session_state:
+        st.session_state.pipeline = QueryPipeline()
+    
+    if 'result_cache' not in st.session_state:
+        st.session_state.result_cache = ResultCache()
+    
+    if 'rollup_router' not in st.session_state:
+        st.session_state.rollup_router = RollupRouter(
+            RollupStore(st.session_state.bq_client, st.session_state.table_schemas)
+        )
 
 def load_table_schemas():
     """Load table schemas from BigQuery"""
@@ -250,13 +278,326 @@ def load_table_schemas():
         return
     
     with st.spinner("Loading table schemas..."):
-        tables = st.session_state.bq_client.get_all_tables()
+        # Schemas another session or replica loaded recently are reused
+        cache_key = (st.session_state.bq_client.project_id, st.session_state.bq_client.dataset_id)
+        cached = SCHEMA_CACHE.get(cache_key)
+        if cached:
+            st.session_state.table_schemas.update(cached)
+        else:
+            tables = st.session_state.bq_client.get_all_tables()
+            
+            for table in tables:
+                table_name = table['table_id']
+                schema_info = st.session_state.bq_client.get_table_schema(table_name)
+                if schema_info:
+                    st.session_state.table_schemas[table_name] = schema_info
+            
+            if st.session_state.table_schemas:
+                SCHEMA_CACHE.set(cache_key, dict(st.session_state.table_schemas), ttl=Config.SCHEMA_CACHE_TTL_MINUTES * 60)
         
-        for table in tables:
-            table_name = table['table_id']
-            schema_info = st.session_state.bq_client.get_table_schema(table_name)
-            if schema_info:
-                st.session_state.table_schemas[table_name] = schema_info
+        # The browser searches this index instead of scanning every table on each rerun
+        st.session_state.catalog_index = CatalogIndex(st.session_state.table_schemas)
+    
+    # The pre-warmer runs with its own clients, independent of any session
+    PREWARMER.start(st.session_state.table_schemas, client_factory=_prewarm_clients)
+
+def _prewarm_clients():
+    """BigQuery and LLM clients for the background pre-warmer"""
+    # Quiet: there is no page to show messages on from the background thread
+    bq_client = BigQueryClient(quiet=True)
+    bq_client.project_id = Config.GOOGLE_CLOUD_PROJECT
+    bq_client.dataset_id = Config.BIGQUERY_DATASET
+    if not bq_client.initialize_client():
+        raise RuntimeError(bq_client.last_message)
+    return bq_client, Text2SQLGenerator(use_vertex_ai=Config.LLM_PROVIDER != 'openai', quiet=True)
+
+def render_catalog(key, page_size=None):
+    """Searchable, paginated table list; column details render only for tables that are opened"""
+    page_size = page_size or Config.CATALOG_PAGE_SIZE
+    index = st.session_state.catalog_index
+    
+    search_term = st.text_input("🔍 Search tables", placeholder="Table or column name...", key=f"{key}_search")
+    results = index.search(search_term)
+    pages = max(1, -(-len(results) // page_size))
+    
+    # A new search starts again from the first page
+    if st.session_state.get(f"{key}_last_search") != search_term:
+        st.session_state[f"{key}_last_search"] = search_term
+        st.session_state[f"{key}_page"] = 0
+    page = min(st.session_state.get(f"{key}_page", 0), pages - 1)
+    
+    if pages > 1:
+        col1, col2, col3 = st.columns([1, 2, 1])
+        with col1:
+            if st.button("◀", key=f"{key}_prev", disabled=page == 0):
+                page -= 1
+        with col3:
+            if st.button("▶", key=f"{key}_next", disabled=page >= pages - 1):
+                page += 1
+        with col2:
+            st.caption(f"Page {page + 1} of {pages}")
+        st.session_state[f"{key}_page"] = page
+    st.caption(f"{len(results)} of {len(index)} tables")
+    
+    for table_name, matched_columns in results[page * page_size:(page + 1) * page_size]:
+        label = f"📊 {table_name}"
+        if matched_columns:
+            label += f" — {', '.join(matched_columns[:3])}{'…' if len(matched_columns) > 3 else ''}"
+        # An expander would build its contents on every rerun even when collapsed
+        if st.checkbox(label, key=f"{key}_open_{table_name}"):
+            schema = st.session_state.table_schemas.get(table_name, {})
+            st.markdown(f"**Description:** {schema.get('description', 'No description')}")
+            col_data = [{"Column": col, "Type": dtype} for col, dtype in schema.get('columns', {}).items()]
+            if col_data:
+                st.dataframe(pd.DataFrame(col_data), use_container_width=True, hide_index=True)
+
+# Sidebar sample questions by category
+SAMPLE_QUESTIONS = {
+    "All": [
+        "Show me the top 10 campaigns by revenue",
+        "What is the average conversion rate by month?",
+        "Which campaigns have the highest ROAS?",
+        "Show customer acquisition trends over time",
+        "What is the total spend by campaign type?"
+    ],
+    "Campaign Performance": [
+        "Show me the top 10 campaigns by revenue",
+        "Which campaigns have the highest ROAS?",
+        "What is the average conversion rate by campaign?",
+        "Show campaign performance by channel"
+    ],
+    "Customer Metrics": [
+        "Show customer acquisition trends over time",
+        "What is the average customer lifetime value?",
+        "Show churn rate by month",
+        "Which channels bring the highest value customers?"
+    ],
+    "Financial Analysis": [
+        "What is the total spend by campaign type?",
+        "Show revenue vs spend by month",
+        "Which campaigns are most cost-effective?",
+        "Calculate ROI by campaign"
+    ],
+    "Trends & Insights": [
+        "Show monthly performance trends",
+        "Compare this quarter vs last quarter",
+        "Identify top performing time periods",
+        "Show seasonal patterns in the data"
+    ]
+}
+
+VIEW_ASK = "💬 Ask"
+VIEW_DASHBOARD = "📌 Dashboard"
+
+def render_tile(saved, result, status=None):
+    """Compact view of one dashboard tile: a metric, a small chart or a short table"""
+    import plotly.express as px
+    
+    st.markdown(f"**{saved.get('name', 'Saved query')}**")
+    st.caption(saved['question'])
+    if result is None:
+        st.info(status or "⏳ Loading...")
+        return
+    if 'error' in result:
+        st.error(f"❌ {result['error']}")
+        return
+    
+    st.caption(staleness_label(result['fetched_at']) + (f" · {status}" if status else ""))
+    df = result['df']
+    numeric_cols = df.select_dtypes(include=['number']).columns.tolist()
+    other_cols = [col for col in df.columns if col not in numeric_cols]
+    if df.empty:
+        st.warning("No rows")
+    elif len(df) == 1 and numeric_cols:
+        for col in numeric_cols[:2]:
+            st.metric(col, f"{df[col].iloc[0]:,.2f}")
+    elif numeric_cols and other_cols:
+        x_col = other_cols[0]
+        is_time = pd.api.types.is_datetime64_any_dtype(df[x_col]) or hasattr(df[x_col].iloc[0], "isoformat")
+        chart = px.line if is_time else px.bar
+        fig = chart(df.head(50), x=x_col, y=numeric_cols[0])
+        fig.update_layout(height=250, margin=dict(l=0, r=0, t=10, b=0))
+        st.plotly_chart(fig, use_container_width=True)
+    else:
+        st.dataframe(df, use_container_width=True, height=200)
+
+def _attach_script_context():
+    """Function that lets worker threads act for this session (scheduler fairness, usage attribution)"""
+    try:
+        from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+    except ImportError:
+        return None
+    ctx = get_script_run_ctx()
+    return lambda thread: add_script_run_ctx(thread, ctx)
+
+def render_dashboard():
+    """Pinned saved queries as tiles: cached results first, stale tiles re-run concurrently"""
+    st.subheader("📌 KPI Dashboard")
+    pinned = pinned_queries(st.session_state.get('saved_queries', []))
+    if not pinned:
+        st.info("No pinned queries yet. Pin saved queries with 📌 in the Saved Queries tab.")
+        return
+    
+    refresh_all = st.button("🔄 Refresh all")
+    slots = {}
+    for row_start in range(0, len(pinned), Config.DASHBOARD_COLUMNS):
+        columns = st.columns(Config.DASHBOARD_COLUMNS)
+        for column, (index, saved) in zip(columns, pinned[row_start:row_start + Config.DASHBOARD_COLUMNS]):
+            with column:
+                slots[index] = st.empty()
+                if st.button("🔎 Open", key=f"open_tile_{index}", disabled=saved.get('result') is None):
+                    st.session_state.pipeline.load_result(
+                        saved['question'], saved['sql'], saved['result'],
+                        {'source': 'dashboard', 'fetched_at': saved['refreshed_at']}
+                    )
+                    st.session_state.switch_to_ask = True
+                    st.rerun()
+    
+    # Whatever is at hand renders at once; missing or stale tiles are then re-run together
+    pending = []
+    for index, saved in pinned:
+        sql = tile_sql(saved, st.session_state.table_schemas)
+        if sql is None:
+            with slots[index].container():
+                render_tile(saved, {'error': "Query failed local checks"})
+            continue
+        cached = cached_result(saved, sql)
+        stale = refresh_all or is_stale(cached)
+        with slots[index].container():
+            render_tile(saved, cached, "⏳ Refreshing..." if stale else None)
+        if stale:
+            pending.append((index, saved, sql))
+    
+    saved_by_index = dict(pinned)
+    for index, result in run_tiles(pending, st.session_state.bq_client, thread_setup=_attach_script_context()):
+        with slots[index].container():
+            render_tile(saved_by_index[index], result)
+
+# Derived data for the result view is memoized on the DataFrame's contents, so a
+# widget change elsewhere on the page does not recompute it
+@st.cache_data(max_entries=Config.VIZ_CACHE_ENTRIES, show_spinner=False)
+def summarize_result(df, numeric_cols):
+    """Statistics shown in the Summary tab"""
+    missing = df.isnull().sum()
+    return {
+        'memory_kb': df.memory_usage(deep=True).sum() / 1024,
+        'describe': df[numeric_cols].describe() if numeric_cols else None,
+        'missing': missing[missing > 0],
+        'duplicates': int(df.duplicated().sum())
+    }
+
+@st.cache_data(max_entries=Config.VIZ_CACHE_ENTRIES, show_spinner=False)
+def correlation_analysis(df, numeric_cols):
+    """Pairs of numeric columns with their correlation, strongest first"""
+    corr_matrix = df[numeric_cols].corr()
+    corr_pairs = []
+    for i in range(len(corr_matrix.columns)):
+        for j in range(i+1, len(corr_matrix.columns)):
+            corr_val = corr_matrix.iloc[i, j]
+            if not pd.isna(corr_val):
+                corr_pairs.append({
+                    'Variable 1': corr_matrix.columns[i],
+                    'Variable 2': corr_matrix.columns[j],
+                    'Correlation': corr_val,
+                    'Strength': 'Strong' if abs(corr_val) > 0.7 else 'Moderate' if abs(corr_val) > 0.3 else 'Weak'
+                })
+    corr_df = pd.DataFrame(corr_pairs)
+    if not corr_df.empty:
+        corr_df = corr_df.sort_values('Correlation', key=abs, ascending=False)
+    return corr_df
+
+@st.cache_data(max_entries=Config.VIZ_CACHE_ENTRIES, show_spinner=False)
+def build_chart(df, chart_type, x_col=None, y_col=None, color_col=None, group=False):
+    """Plotly figure for the Charts tab; only a changed chart is rebuilt"""
+    import plotly.express as px
+    
+    if chart_type == "Scatter Plot":
+        fig = px.scatter(df, x=x_col, y=y_col, color=color_col,
+                       title=f"{y_col} vs {x_col}",
+                       hover_data=df.columns.tolist())
+    elif chart_type == "Line Chart":
+        fig = px.line(df, x=x_col, y=y_col, title=f"{y_col} over time")
+    elif chart_type == "Bar Chart":
+        # Group by x_col and aggregate y_col
+        data = df.groupby(x_col)[y_col].sum().reset_index() if group else df
+        fig = px.bar(data, x=x_col, y=y_col, title=f"{y_col} by {x_col}")
+    elif chart_type == "Histogram":
+        fig = px.histogram(df, x=x_col, title=f"Distribution of {x_col}")
+    elif chart_type == "Box Plot":
+        fig = px.box(df, y=x_col, title=f"Box Plot of {x_col}")
+    else:
+        corr_matrix = df.corr(numeric_only=True)
+        fig = px.imshow(corr_matrix,
+                      text_auto=True,
+                      aspect="auto",
+                      title="Correlation Matrix",
+                      color_continuous_scale="RdBu")
+    fig.update_layout(height=500)
+    return fig
+
+def render_rerun_profile():
+    """Sidebar panel with the time each section of the page takes per rerun"""
+    profiler = current_profiler()
+    with st.expander("⏱️ Rerun Profile", expanded=False):
+        rows = profiler.summary()
+        if not rows:
+            st.caption("No completed reruns yet.")
+            return
+        st.caption(f"Last rerun: {profiler.last_total() * 1000:.0f} ms · averaged over {len(profiler.reruns)} reruns")
+        st.dataframe(
+            pd.DataFrame(rows).rename(columns={
+                'section': 'Section', 'mean_ms': 'Mean (ms)', 'max_ms': 'Max (ms)', 'share': 'Share'
+            }).round({'Mean (ms)': 1, 'Max (ms)': 1, 'Share': 3}),
+            use_container_width=True, hide_index=True
+        )
+
+USAGE_PERIODS = {"Today": 0, "Last 7 days": 7, "All time": None}
+
+def render_usage():
+    """Sidebar panel with token and BigQuery usage per user, session or question, and today's quotas"""
+    with st.expander("💰 Usage & Quotas", expanded=False):
+        totals = USAGE.totals(current_user_id())
+        if Config.QUOTA_DAILY_TOKENS:
+            st.progress(
+                min(1.0, totals['tokens'] / Config.QUOTA_DAILY_TOKENS),
+                text=f"Tokens today: {totals['tokens']:,} of {Config.QUOTA_DAILY_TOKENS:,}"
+            )
+        else:
+            st.caption(f"Tokens today: {totals['tokens']:,}")
+        if Config.QUOTA_DAILY_BYTES_BILLED:
+            st.progress(
+                min(1.0, totals['bytes_billed'] / Config.QUOTA_DAILY_BYTES_BILLED),
+                text=f"Billed today: {format_bytes(totals['bytes_billed'])} of {format_bytes(Config.QUOTA_DAILY_BYTES_BILLED)}"
+            )
+        else:
+            st.caption(f"Billed today: {format_bytes(totals['bytes_billed'])}")
+
+        group_by = st.radio("Group by", ["user", "session", "pattern"], horizontal=True, key="usage_group_by")
+        period = st.selectbox("Period", list(USAGE_PERIODS), key="usage_period")
+        days = USAGE_PERIODS[period]
+        since = None
+        if days is not None:
+            since = datetime.combine(datetime.now().date(), datetime.min.time()) - timedelta(days=days)
+        rows = USAGE.summary(group_by, since)
+        if not rows:
+            st.caption("No usage recorded yet.")
+            return
+        summary = pd.DataFrame(rows)
+        summary['bytes_billed'] = summary['bytes_billed'].map(format_bytes)
+        summary['bytes_processed'] = summary['bytes_processed'].map(format_bytes)
+        st.dataframe(summary, use_container_width=True, hide_index=True)
+        # The CSV holds every record of the period, so it is only built on request
+        if st.button("📄 Prepare CSV export", key="usage_export_prepare"):
+            st.session_state.usage_export = (period, USAGE.export_csv(since))
+        prepared = st.session_state.get('usage_export')
+        if prepared and prepared[0] == period:
+            st.download_button(
+                "⬇️ Export CSV",
+                data=prepared[1],
+                file_name=f"usage_{datetime.now().strftime('%Y%m%d')}.csv",
+                mime="text/csv",
+                key="usage_export_download"
+            )
 
 def display_query_results(df, query):
     """Display query results with visualizations"""
@@ -271,17 +612,22 @@ def display_query_results(df, query):
     with col2:
         st.metric("Columns", len(df.columns))
     with col3:
-        st.metric("Memory Usage", f"{df.memory_usage(deep=True).sum() / 1024:.1f} KB")
+        numeric_cols = df.select_dtypes(include=['number']).columns.tolist()
+        st.metric("Memory Usage", f"{summarize_result(df, numeric_cols)['memory_kb']:.1f} KB")
     
     # Display data
     st.subheader("📊 Query Results")
     st.dataframe(df, use_container_width=True)
+    checkpoint("results table")
     
     # Auto-generate visualizations based on data types
     generate_visualizations(df)
 
 def generate_visualizations(df):
     """Auto-generate relevant visualizations with enhanced interactivity"""
+    # Plotly is only needed once there is something to chart
+    import plotly.express as px
+    
     st.subheader("📈 Interactive Visualizations")
     
     # Get numeric columns
@@ -309,28 +655,29 @@ def generate_visualizations(df):
                 st.metric("Text Columns", len(string_cols))
             
             # Summary statistics with better formatting
+            summary = summarize_result(df, numeric_cols)
             st.subheader("Statistical Summary")
-            summary_df = df[numeric_cols].describe()
-            st.dataframe(summary_df, use_container_width=True)
+            st.dataframe(summary['describe'], use_container_width=True)
             
             # Data quality insights
             st.subheader("🔍 Data Quality Insights")
             quality_col1, quality_col2 = st.columns(2)
             
             with quality_col1:
-                missing_data = df.isnull().sum()
+                missing_data = summary['missing']
                 if missing_data.sum() > 0:
-                    st.warning(f"⚠️ Missing values detected in {missing_data[missing_data > 0].count()} columns")
-                    st.dataframe(missing_data[missing_data > 0].to_frame("Missing Values"))
+                    st.warning(f"⚠️ Missing values detected in {missing_data.count()} columns")
+                    st.dataframe(missing_data.to_frame("Missing Values"))
                 else:
                     st.success("✅ No missing values found")
             
             with quality_col2:
-                duplicate_rows = df.duplicated().sum()
+                duplicate_rows = summary['duplicates']
                 if duplicate_rows > 0:
                     st.warning(f"⚠️ {duplicate_rows} duplicate rows found")
                 else:
                     st.success("✅ No duplicate rows found")
+        checkpoint("viz: summary")
         
         with tab2:
             st.subheader("📈 Interactive Charts")
@@ -352,11 +699,7 @@ def generate_visualizations(df):
                 
                 if x_col != y_col:
                     color_param = None if color_col == "None" else color_col
-                    fig = px.scatter(df, x=x_col, y=y_col, color=color_param, 
-                                   title=f"{y_col} vs {x_col}", 
-                                   hover_data=df.columns.tolist())
-                    fig.update_layout(height=500)
-                    st.plotly_chart(fig, use_container_width=True)
+                    st.plotly_chart(build_chart(df, chart_type, x_col, y_col, color_param), use_container_width=True)
             
             elif chart_type == "Line Chart" and len(numeric_cols) > 0:
                 col1, col2 = st.columns(2)
@@ -368,9 +711,7 @@ def generate_visualizations(df):
                 with col2:
                     y_col = st.selectbox("Y-axis", numeric_cols, key="line_y")
                 
-                fig = px.line(df, x=x_col, y=y_col, title=f"{y_col} over time")
-                fig.update_layout(height=500)
-                st.plotly_chart(fig, use_container_width=True)
+                st.plotly_chart(build_chart(df, chart_type, x_col, y_col), use_container_width=True)
             
             elif chart_type == "Bar Chart" and len(numeric_cols) > 0:
                 col1, col2 = st.columns(2)
@@ -379,38 +720,21 @@ def generate_visualizations(df):
                 with col2:
                     y_col = st.selectbox("Y-axis", numeric_cols, key="bar_y")
                 
-                # Group by x_col and aggregate y_col
-                if x_col in string_cols:
-                    bar_data = df.groupby(x_col)[y_col].sum().reset_index()
-                    fig = px.bar(bar_data, x=x_col, y=y_col, title=f"{y_col} by {x_col}")
-                else:
-                    fig = px.bar(df, x=x_col, y=y_col, title=f"{y_col} by {x_col}")
-                
-                fig.update_layout(height=500)
+                fig = build_chart(df, chart_type, x_col, y_col, group=x_col in string_cols)
                 st.plotly_chart(fig, use_container_width=True)
             
             elif chart_type == "Histogram" and len(numeric_cols) > 0:
                 col = st.selectbox("Select Column", numeric_cols, key="hist_col")
-                fig = px.histogram(df, x=col, title=f"Distribution of {col}")
-                fig.update_layout(height=500)
-                st.plotly_chart(fig, use_container_width=True)
+                st.plotly_chart(build_chart(df, chart_type, col), use_container_width=True)
             
             elif chart_type == "Box Plot" and len(numeric_cols) > 0:
                 col = st.selectbox("Select Column", numeric_cols, key="box_col")
-                fig = px.box(df, y=col, title=f"Box Plot of {col}")
-                fig.update_layout(height=500)
-                st.plotly_chart(fig, use_container_width=True)
+                st.plotly_chart(build_chart(df, chart_type, col), use_container_width=True)
             
             elif chart_type == "Heatmap" and len(numeric_cols) > 1:
                 st.subheader("Correlation Heatmap")
-                corr_matrix = df[numeric_cols].corr()
-                fig = px.imshow(corr_matrix, 
-                              text_auto=True, 
-                              aspect="auto",
-                              title="Correlation Matrix",
-                              color_continuous_scale="RdBu")
-                fig.update_layout(height=500)
-                st.plotly_chart(fig, use_container_width=True)
+                st.plotly_chart(build_chart(df[numeric_cols], chart_type), use_container_width=True)
+        checkpoint("viz: charts")
         
         with tab3:
             st.subheader("🔍 Advanced Analysis")
@@ -418,22 +742,8 @@ def generate_visualizations(df):
             # Correlation analysis
             if len(numeric_cols) > 1:
                 st.subheader("Correlation Analysis")
-                corr_matrix = df[numeric_cols].corr()
-                
-                # Find strongest correlations
-                corr_pairs = []
-                for i in range(len(corr_matrix.columns)):
-                    for j in range(i+1, len(corr_matrix.columns)):
-                        corr_val = corr_matrix.iloc[i, j]
-                        if not pd.isna(corr_val):
-                            corr_pairs.append({
-                                'Variable 1': corr_matrix.columns[i],
-                                'Variable 2': corr_matrix.columns[j],
-                                'Correlation': corr_val,
-                                'Strength': 'Strong' if abs(corr_val) > 0.7 else 'Moderate' if abs(corr_val) > 0.3 else 'Weak'
-                            })
-                
-                corr_df = pd.DataFrame(corr_pairs).sort_values('Correlation', key=abs, ascending=False)
+                # Strongest correlations first
+                corr_df = correlation_analysis(df, numeric_cols)
                 st.dataframe(corr_df, use_container_width=True)
             
             # Top values analysis
@@ -451,6 +761,7 @@ def generate_visualizations(df):
                     st.subheader("Bottom 10 Values")
                     bottom_values = df.nsmallest(10, col)[[col] + (string_cols[:2] if string_cols else [])]
                     st.dataframe(bottom_values, use_container_width=True)
+        checkpoint("viz: analysis")
         
         with tab4:
             st.subheader("🎨 Custom Visualization")
@@ -494,6 +805,7 @@ def generate_visualizations(df):
                         
                         fig.update_layout(height=500)
                         st.plotly_chart(fig, use_container_width=True)
+        checkpoint("viz: custom")
 
 def main():
     """Main application function"""
@@ -510,8 +822,15 @@ def main():
         if st.session_state.bq_client.initialize_client():
             load_table_schemas()
     
+    checkpoint("startup & connection check")
+    
     # Sidebar for configuration
     with st.sidebar:
+        # Opening a dashboard tile switches back to the question view
+        if st.session_state.pop('switch_to_ask', False):
+            st.session_state.view_mode = VIEW_ASK
+        st.radio("View", [VIEW_ASK, VIEW_DASHBOARD], key="view_mode", horizontal=True)
+        
         st.markdown('<div class="sidebar-section">', unsafe_allow_html=True)
         st.header("⚙️ Configuration")
         
@@ -545,6 +864,9 @@ def main():
                 progress_bar.progress(25)
                 
                 if st.session_state.bq_client.initialize_client():
+                    # Cached results and SQL belong to the previous dataset
+                    st.session_state.result_cache.clear()
+                    st.session_state.pipeline.reset()
                     status_text.text("🔄 Loading table schemas...")
                     progress_bar.progress(75)
                     load_table_schemas()
@@ -559,37 +881,46 @@ def main():
         
         st.markdown('</div>', unsafe_allow_html=True)
         
+        checkpoint("sidebar: settings")
+        
         # Display available tables with enhanced UI
         if st.session_state.table_schemas:
             st.markdown('<div class="sidebar-section">', unsafe_allow_html=True)
             st.subheader("📋 Available Tables")
             
-            # Search functionality
-            search_term = st.text_input("🔍 Search tables", placeholder="Type to filter tables...")
+            render_catalog("sidebar")
             
-            filtered_tables = {}
-            if search_term:
-                for table_name, schema in st.session_state.table_schemas.items():
-                    if search_term.lower() in table_name.lower() or search_term.lower() in schema.get('description', '').lower():
-                        filtered_tables[table_name] = schema
-            else:
-                filtered_tables = st.session_state.table_schemas
+            st.markdown('</div>', unsafe_allow_html=True)
+        
+        checkpoint("sidebar: table listing")
+        
+        # KPI rollups
+        if st.session_state.bq_client.client:
+            st.markdown('<div class="sidebar-section">', unsafe_allow_html=True)
+            st.subheader("🧮 KPI Rollups")
             
-            for table_name, schema in filtered_tables.items():
-                with st.expander(f"📊 {table_name}", expanded=False):
-                    st.markdown(f"**Description:** {schema.get('description', 'No description')}")
-                    st.markdown("**Columns:**")
-                    
-                    # Display columns in a more organized way
-                    col_data = []
-                    for col, dtype in schema.get('columns', {}).items():
-                        col_data.append({"Column": col, "Type": dtype})
-                    
-                    if col_data:
-                        st.dataframe(pd.DataFrame(col_data), use_container_width=True, hide_index=True)
+            router = st.session_state.rollup_router
+            for base_table in Config.ROLLUP_DEFINITIONS:
+                if base_table not in st.session_state.table_schemas:
+                    continue
+                col1, col2 = st.columns(2)
+                with col1:
+                    if st.button("Build", key=f"rollup_build_{base_table}", help=f"Rebuild daily rollup of {base_table}", use_container_width=True):
+                        with st.spinner(f"Building rollup for {base_table}..."):
+                            if router.store.build(base_table):
+                                st.success(f"✅ Rollup for {base_table} built")
+                with col2:
+                    if st.button("Refresh", key=f"rollup_refresh_{base_table}", help=f"Add new days to the rollup of {base_table}", use_container_width=True):
+                        with st.spinner(f"Refreshing rollup for {base_table}..."):
+                            if router.store.refresh(base_table):
+                                st.success(f"✅ Rollup for {base_table} refreshed")
+                st.caption(f"📊 {base_table}")
             
+            st.caption(f"Queries routed: {router.stats['routed']} · Bytes saved: {format_bytes(router.stats['bytes_saved'])}")
             st.markdown('</div>', unsafe_allow_html=True)
         
+        checkpoint("sidebar: rollups")
+        
         # Enhanced sample queries
         st.markdown('<div class="sidebar-section">', unsafe_allow_html=True)
         st.subheader("💡 Sample Queries")
@@ -597,44 +928,10 @@ def main():
         # Query categories
         query_category = st.selectbox(
             "Choose category:",
-            ["All", "Campaign Performance", "Customer Metrics", "Financial Analysis", "Trends & Insights"]
+            list(SAMPLE_QUESTIONS)
         )
         
-        sample_queries = {
-            "All": [
-                "Show me the top 10 campaigns by revenue",
-                "What is the average conversion rate by month?",
-                "Which campaigns have the highest ROAS?",
-                "Show customer acquisition trends over time",
-                "What is the total spend by campaign type?"
-            ],
-            "Campaign Performance": [
-                "Show me the top 10 campaigns by revenue",
-                "Which campaigns have the highest ROAS?",
-                "What is the average conversion rate by campaign?",
-                "Show campaign performance by channel"
-            ],
-            "Customer Metrics": [
-                "Show customer acquisition trends over time",
-                "What is the average customer lifetime value?",
-                "Show churn rate by month",
-                "Which channels bring the highest value customers?"
-            ],
-            "Financial Analysis": [
-                "What is the total spend by campaign type?",
-                "Show revenue vs spend by month",
-                "Which campaigns are most cost-effective?",
-                "Calculate ROI by campaign"
-            ],
-            "Trends & Insights": [
-                "Show monthly performance trends",
-                "Compare this quarter vs last quarter",
-                "Identify top performing time periods",
-                "Show seasonal patterns in the data"
-            ]
-        }
-        
-        queries_to_show = sample_queries.get(query_category, sample_queries["All"])
+        queries_to_show = SAMPLE_QUESTIONS.get(query_category, SAMPLE_QUESTIONS["All"])
         
         for i, query in enumerate(queries_to_show):
             if st.button(f"💬 {query}", key=f"sample_{i}", use_container_width=True):
@@ -642,6 +939,65 @@ def main():
                 st.rerun()
         
         st.markdown('</div>', unsafe_allow_html=True)
+        
+        checkpoint("sidebar: sample questions")
+        
+        # Process-wide runtime counters
+        with st.expander("📈 Runtime Stats", expanded=False):
+            for group, stats in singleflight_stats().items():
+                st.caption(
+                    f"**{group}** · requests: {stats['requests']} · executed: {stats['executed']} · "
+                    f"coalesced: {stats['coalesced']} · in flight: {stats['in_flight']}"
+                )
+            for name, stats in scheduler_stats().items():
+                queued = ", ".join(f"{kind}: {count}" for kind, count in stats['queued_by_priority'].items()) or "none"
+                st.caption(
+                    f"**{name} scheduler** · active: {stats['active']} · queued: {stats['queued']} ({queued}) · "
+                    f"max depth: {stats['max_depth']} · avg wait: {stats['avg_wait']:.2f}s · rejected: {stats['rejected']}"
+                )
+            for provider, stats in provider_stats().items():
+                p50 = f"{stats['p50']:.2f}s" if stats['p50'] is not None else "n/a"
+                p95 = f"{stats['p95']:.2f}s" if stats['p95'] is not None else "n/a"
+                st.caption(
+                    f"**LLM {provider}** · p50: {p50} · p95: {p95} · ok: {stats['successes']} · "
+                    f"failed: {stats['failures']} (timeouts {stats['timeouts']}) · "
+                    f"hedges won: {stats['hedges_won']} · circuit: {stats['circuit']}"
+                )
+            repairs = REPAIR_STATS.snapshot()
+            st.caption(
+                f"**SQL repair** · loops: {repairs['loops']} · repaired: {repairs['repaired']} "
+                f"({repairs['success_rate']:.0%}) · avg attempts: {repairs['avg_attempts']:.1f} · "
+                f"avg added latency: {repairs['avg_added_latency']:.2f}s"
+            )
+            prewarm = PREWARMER.status()
+            last_run = prewarm['last_run']
+            next_window = prewarm['next_window'].strftime('%Y-%m-%d %H:%M') if prewarm['next_window'] else "none"
+            if not Config.ENABLE_PREWARM:
+                st.caption("**Pre-warm** · off (set ENABLE_PREWARM=true to warm saved and popular queries)")
+            elif last_run:
+                st.caption(
+                    f"**Pre-warm** · last run: {last_run['started_at'].strftime('%Y-%m-%d %H:%M')} · "
+                    f"warmed: {last_run['warmed']} · failed: {last_run['failed']} · skipped: {last_run['skipped']} · "
+                    f"LLM calls: {last_run['llm_calls']} · scanned: {format_bytes(last_run['bytes'])} · next: {next_window}"
+                )
+            else:
+                st.caption(
+                    f"**Pre-warm** · {'running' if prewarm['running'] else 'not started'} · "
+                    f"queries tracked: {prewarm['candidates']} · next: {next_window}"
+                )
+            if prewarm['last_error']:
+                st.caption(
+                    f"⚠️ Pre-warm run failed at {prewarm['last_error']['at'].strftime('%Y-%m-%d %H:%M')}: "
+                    f"{prewarm['last_error']['error']}"
+                )
+    
+        checkpoint("sidebar: runtime stats")
+        
+        render_usage()
+        checkpoint("sidebar: usage")
+        
+        if Config.RERUN_PROFILER:
+            render_rerun_profile()
     
     # Welcome section for new users
     if not st.session_state.bq_client.client:
@@ -700,6 +1056,11 @@ def main():
         st.info("👈 Please configure your GCP settings in the sidebar and connect to BigQuery to get started.")
         return
     
+    if st.session_state.get('view_mode') == VIEW_DASHBOARD:
+        render_dashboard()
+        checkpoint("dashboard")
+        return
+    
     # Dashboard overview for connected users
     st.subheader("📊 Dashboard Overview")
     
@@ -734,24 +1095,20 @@ def main():
         if st.button("💾 Saved Queries", use_container_width=True):
             st.session_state.show_saved = True
     
+    checkpoint("overview")
+    
     # Show tables if requested
     if st.session_state.get('show_tables', False):
         st.subheader("📋 Available Tables")
-        for table_name, schema in st.session_state.table_schemas.items():
-            with st.expander(f"📊 {table_name}", expanded=False):
-                st.write(f"**Description:** {schema.get('description', 'No description')}")
-                st.write("**Columns:**")
-                col_data = []
-                for col, dtype in schema.get('columns', {}).items():
-                    col_data.append({"Column": col, "Type": dtype})
-                if col_data:
-                    st.dataframe(pd.DataFrame(col_data), use_container_width=True, hide_index=True)
+        render_catalog("browse")
     
     # Show samples if requested
     if st.session_state.get('show_samples', False):
         st.subheader("📝 Sample Queries")
         st.code(st.session_state.text2sql.get_sample_queries(), language="sql")
     
+    checkpoint("table browser & samples")
+    
     # Enhanced Query input section
     st.markdown('<div class="query-box">', unsafe_allow_html=True)
     st.subheader("💬 Ask a Question")
@@ -780,7 +1137,10 @@ def main():
     with col3:
         clear_query = st.button("🗑️ Clear", use_container_width=True)
     
+    pipeline = st.session_state.pipeline
+    
     if clear_query:
+        pipeline.reset()
         st.rerun()
     
     if show_sample_queries:
@@ -789,109 +1149,270 @@ def main():
     
     st.markdown('</div>', unsafe_allow_html=True)
     
+    checkpoint("question input")
+    
     if generate_sql and user_question:
-        # Enhanced progress tracking
-        progress_container = st.container()
-        with progress_container:
-            progress_bar = st.progress(0)
-            status_text = st.empty()
-        
-        # Step 1: Generate SQL
-        status_text.text("🤖 Generating SQL query...")
-        progress_bar.progress(20)
-        
-        sql_query = st.session_state.text2sql.generate_sql(
-            user_question, 
-            st.session_state.table_schemas,
-            st.session_state.text2sql.get_sample_queries()
-        )
+        # SQL is only regenerated when the question or the schemas changed
+        if pipeline.set_question(user_question):
+            PREWARMER.record_question(pipeline.question)
+        with st.spinner("🤖 Generating SQL query..."):
+            pipeline.generate(
+                st.session_state.text2sql,
+                st.session_state.table_schemas,
+                st.session_state.text2sql.get_sample_queries(pipeline.question)
+            )
+    
+    checkpoint("sql generation")
+    
+    # The generated SQL lives in the pipeline state, so it survives the reruns
+    # triggered by the action buttons below
+    if pipeline.sql:
+        st.markdown('<div class="query-box">', unsafe_allow_html=True)
+        st.subheader("🔍 Generated SQL Query")
+        st.caption(f"For: {pipeline.question}")
+        if pipeline.template:
+            st.info(
+                f"🧩 Filled in the query template learned from “{pipeline.template['question']}” — "
+                f"no LLM call was needed. It runs with {len(pipeline.template['parameters'])} query parameter(s)."
+            )
         
-        if sql_query:
-            progress_bar.progress(40)
-            status_text.text("✅ SQL query generated successfully!")
-            
-            st.markdown('<div class="query-box">', unsafe_allow_html=True)
-            st.subheader("🔍 Generated SQL Query")
+        # Enhanced SQL display with copy functionality
+        col1, col2 = st.columns([4, 1])
+        with col1:
+            st.code(pipeline.sql, language="sql")
+        with col2:
+            if st.button("📋 Copy SQL", help="Copy SQL to clipboard"):
+                st.write("SQL copied! (Use Ctrl+V to paste)")
+            if st.button("🔁 Regenerate", help="Ask the model for a new query"):
+                with st.spinner("🤖 Generating SQL query..."):
+                    pipeline.generate(
+                        st.session_state.text2sql,
+                        st.session_state.table_schemas,
+                        st.session_state.text2sql.get_sample_queries(pipeline.question),
+                        force=True
+                    )
+                st.rerun()
+        
+        st.markdown('</div>', unsafe_allow_html=True)
+        
+        # Enhanced query validation and execution
+        st.subheader("⚡ Query Actions")
+        
+        col1, col2, col3, col4 = st.columns([1, 1, 1, 1])
+        
+        with col1:
+            if st.button("✅ Validate Query", type="secondary", use_container_width=True):
+                with st.spinner("🔍 Validating query syntax..."):
+                    pipeline.validate(
+                        st.session_state.bq_client,
+                        st.session_state.table_schemas,
+                        st.session_state.text2sql
+                    )
+        
+        with col2:
+            # "Run exact" under a preview reruns the page and executes here
+            run_exact = st.session_state.pop('run_exact', False)
+            run_execute = st.button("🚀 Execute Query", type="primary", use_container_width=True) or run_exact
+        
+        with col3:
+            if st.button(
+                f"🔎 Preview ({Config.SAMPLE_PERCENT:g}%)", type="secondary", use_container_width=True,
+                disabled=sample_query(pipeline.sql) is None,
+                help=f"Run on a {Config.SAMPLE_PERCENT:g}% sample of the table for a quick, approximate answer"
+            ):
+                with st.spinner("🔎 Running sampled preview..."):
+                    pipeline.execute(
+                        st.session_state.bq_client,
+                        st.session_state.result_cache,
+                        st.session_state.rollup_router,
+                        st.session_state.table_schemas,
+                        st.session_state.text2sql,
+                        sample_percent=Config.SAMPLE_PERCENT
+                    )
+        
+        with col4:
+            if st.button("💾 Save Query", type="secondary", use_container_width=True):
+                if 'saved_queries' not in st.session_state:
+                    st.session_state.saved_queries = []
+                
+                st.session_state.saved_queries.append({
+                    'name': f"Query {len(st.session_state.saved_queries) + 1}",
+                    'question': pipeline.question,
+                    'sql': pipeline.sql,
+                    'timestamp': datetime.now(),
+                    # Kept so later refreshes only need to fetch newer dates (never an approximate preview)
+                    'result': pipeline.result if pipeline.result_sql == pipeline.sql and not pipeline.is_preview else None,
+                    'refreshed_at': datetime.now() if pipeline.result_sql == pipeline.sql and not pipeline.is_preview else None
+                })
+                PREWARMER.register_saved(pipeline.question, pipeline.sql)
+                st.success("💾 Query saved!")
+        
+        executed = False
+        if run_execute:
+            # Filled while the job runs: elapsed time, a cancel button and, for large scans, sampled first rows
+            status_slot = st.empty()
+            cancel_slot = st.empty()
+            preview_slot = st.empty()
+            # Clicking reruns the script; the rerun interrupts the wait and cancels the jobs
+            cancel_slot.button("⏹ Cancel query", key="cancel_query")
             
-            # Enhanced SQL display with copy functionality
-            col1, col2 = st.columns([4, 1])
-            with col1:
-                st.code(sql_query, language="sql")
-            with col2:
-                if st.button("📋 Copy SQL", help="Copy SQL to clipboard"):
-                    st.write("SQL copied! (Use Ctrl+V to paste)")
+            def show_preview(df):
+                with preview_slot.container():
+                    st.caption("⏳ First rows from a sample — the full result is still running…")
+                    st.dataframe(df, use_container_width=True)
             
-            st.markdown('</div>', unsafe_allow_html=True)
+            def show_wait(seconds):
+                status_slot.caption(f"🚀 Running on BigQuery… {seconds:.0f}s")
             
-            # Enhanced query validation and execution
-            st.subheader("⚡ Query Actions")
+            with st.spinner("🚀 Executing query..."):
+                executed = pipeline.execute(
+                    st.session_state.bq_client,
+                    st.session_state.result_cache,
+                    st.session_state.rollup_router,
+                    st.session_state.table_schemas,
+                    st.session_state.text2sql,
+                    on_preview=show_preview,
+                    on_wait=show_wait
+                )
+            # The full result below replaces the preview
+            status_slot.empty()
+            cancel_slot.empty()
+            preview_slot.empty()
             
-            col1, col2, col3 = st.columns([1, 1, 1])
+            if executed:
+                # Add to query history
+                st.session_state.query_history.append({
+                    'question': pipeline.question,
+                    'sql': pipeline.sql,
+                    'timestamp': datetime.now(),
+                    'rows': len(pipeline.result),
+                    'job': pipeline.execution_info.get('job')
+                })
+        
+        if pipeline.repair_info:
+            st.info(f"🔧 The query was repaired automatically after this error: {pipeline.repair_info['error']}")
+            with st.expander("Original SQL"):
+                st.code(pipeline.repair_info['original_sql'], language="sql")
+        
+        if pipeline.validation is not None:
+            is_valid, message = pipeline.validation
+            if is_valid:
+                st.success("✅ Query is valid and ready to execute!")
+            else:
+                st.error(f"❌ {message}")
+        
+        if pipeline.stage == FAILED and pipeline.failed_stage == EXECUTING:
+            st.markdown('<div class="error-box">', unsafe_allow_html=True)
+            st.error("Query execution failed. Please check your query and try again.")
+            st.markdown('</div>', unsafe_allow_html=True)
+        
+        if pipeline.result is not None:
+            info = pipeline.execution_info
+            if info.get('source') == 'local':
+                st.info("⚡ Answered from a cached earlier result — no BigQuery job was run.")
+            elif info.get('source') == 'job':
+                st.info(f"♻️ Loaded the stored result of BigQuery job `{info['job']['job_id']}` — no new query was run.")
+            elif info.get('source') == 'dashboard':
+                st.info(f"📌 Dashboard tile result fetched at {info['fetched_at'].strftime('%Y-%m-%d %H:%M')}.")
+            elif info.get('source') == 'shared':
+                st.info(f"🌅 Served from results fetched at {info['fetched_at'].strftime('%Y-%m-%d %H:%M')} — no new query was run.")
+            elif info.get('source') == 'sample':
+                sample = info['sample']
+                scanned = (info.get('job') or {}).get('bytes_processed')
+                summary = f"🔎 Approximate preview on a {sample['percent']:g}% sample of `{sample['table']}`"
+                if scanned is not None and sample.get('full_bytes'):
+                    summary += f" — scanned {format_bytes(scanned)} instead of {format_bytes(sample['full_bytes'])}"
+                st.warning(summary)
+                notes = []
+                if sample['scaled']:
+                    notes.append(f"scaled ×{sample['factor']:.4g}: {', '.join(sample['scaled'])}")
+                if sample['unscaled']:
+                    notes.append(f"computed on the sample: {', '.join(sample['unscaled'])}")
+                notes.append("small groups may be missing")
+                st.caption(" · ".join(notes))
+                if st.button("🎯 Run exact", key="run_exact_button"):
+                    st.session_state.run_exact = True
+                    st.rerun()
+            elif info.get('source') == 'rollup':
+                routing = info['routing']
+                st.info(
+                    f"🧮 Routed to rollup `{routing['rollup_table']}` — "
+                    f"scans {format_bytes(routing['rollup_bytes'])} instead of "
+                    f"{format_bytes(routing['original_bytes'])} "
+                    f"(saved {format_bytes(routing['bytes_saved'])})"
+                )
+            if info.get('rewrite'):
+                rewrite = info['rewrite']
+                summary = "✂️ Query rewritten to scan less data" if reduces_scan(rewrite['changes']) \
+                    else f"✂️ Results capped at {Config.MAX_QUERY_RESULTS:,} rows"
+                original_bytes = rewrite.get('original_bytes')
+                rewritten_bytes = rewrite.get('rewritten_bytes')
+                if original_bytes is not None and rewritten_bytes is not None:
+                    summary += (
+                        f" — {format_bytes(rewritten_bytes)} instead of {format_bytes(original_bytes)} "
+                        f"(saved {format_bytes(original_bytes - rewritten_bytes)})"
+                    )
+                st.info(summary)
+                if limits_rows(rewrite['changes']):
+                    st.warning(
+                        f"⚠️ Only the last {Config.PARTITION_FILTER_DAYS} days were read (PARTITION_FILTER_DAYS); "
+                        "totals over older data are not included."
+                    )
+                with st.expander("Rewritten SQL"):
+                    for change in rewrite['changes']:
+                        st.caption(f"• {change}")
+                    st.code(rewrite['sql'], language="sql")
             
-            with col1:
-                if st.button("✅ Validate Query", type="secondary", use_container_width=True):
-                    status_text.text("🔍 Validating query syntax...")
-                    progress_bar.progress(60)
-                    
-                    is_valid, message = st.session_state.bq_client.validate_query(sql_query)
-                    if is_valid:
-                        st.success("✅ Query is valid and ready to execute!")
-                        progress_bar.progress(80)
-                    else:
-                        st.error(f"❌ {message}")
-                        progress_bar.progress(0)
+            checkpoint("sql & execution")
+            st.markdown('<div class="result-box">', unsafe_allow_html=True)
+            display_query_results(pipeline.result, pipeline.sql)
+            st.markdown('</div>', unsafe_allow_html=True)
             
-            with col2:
-                if st.button("🚀 Execute Query", type="primary", use_container_width=True):
-                    status_text.text("🚀 Executing query...")
-                    progress_bar.progress(60)
+            # Full results are streamed to a file instead of being loaded into memory
+            with st.expander("📤 Export full result", expanded=False):
+                export_format = st.radio("Format", list(EXPORT_FORMATS), horizontal=True, key="export_format")
+                full_result = st.checkbox("Ignore the query's LIMIT and export every row", value=True, key="export_full")
+                if st.button("📤 Export", key="export_run"):
+                    progress = st.empty()
                     
-                    df = st.session_state.bq_client.execute_query(sql_query, Config.MAX_QUERY_RESULTS)
+                    def on_progress(rows, total):
+                        progress.caption(f"Written {rows:,} of {total:,} rows" if total else f"Written {rows:,} rows")
                     
-                    if df is not None:
-                        progress_bar.progress(100)
-                        status_text.text("✅ Query executed successfully!")
-                        
-                        st.markdown('<div class="result-box">', unsafe_allow_html=True)
-                        display_query_results(df, sql_query)
-                        st.markdown('</div>', unsafe_allow_html=True)
-                        
-                        # Add to query history
-                        st.session_state.query_history.append({
-                            'question': user_question,
-                            'sql': sql_query,
-                            'timestamp': datetime.now(),
-                            'rows': len(df)
-                        })
-                        
-                        # Success animation
-                        st.balloons()
-                        
+                    try:
+                        with st.spinner("📤 Exporting..."), usage_context(pipeline.question):
+                            st.session_state.last_export = export_query(
+                                st.session_state.bq_client,
+                                pipeline.sql,
+                                export_format,
+                                st.session_state.table_schemas,
+                                full_result,
+                                on_progress
+                            )
+                    except Exception as e:
+                        st.error(f"❌ Export failed: {str(e)}")
+                
+                export = st.session_state.get('last_export')
+                if export and os.path.exists(export['path']):
+                    st.success(
+                        f"✅ Exported {export['rows']:,} rows to {export['format'].upper()} — "
+                        f"{format_bytes(export['bytes'])} in {export['seconds']:.1f}s"
+                    )
+                    if export['bytes'] <= Config.EXPORT_DOWNLOAD_MAX_MB * 1024 * 1024:
+                        with open(export['path'], "rb") as f:
+                            st.download_button(
+                                "⬇️ Download",
+                                f,
+                                file_name=os.path.basename(export['path']),
+                                key="export_download"
+                            )
                     else:
-                        progress_bar.progress(0)
-                        status_text.text("❌ Query execution failed")
-                        st.markdown('<div class="error-box">', unsafe_allow_html=True)
-                        st.error("Query execution failed. Please check your query and try again.")
-                        st.markdown('</div>', unsafe_allow_html=True)
+                        st.info(f"The file is too large to download through the browser. It is on the server at `{export['path']}`")
             
-            with col3:
-                if st.button("💾 Save Query", type="secondary", use_container_width=True):
-                    if 'saved_queries' not in st.session_state:
-                        st.session_state.saved_queries = []
-                    
-                    st.session_state.saved_queries.append({
-                        'name': f"Query {len(st.session_state.saved_queries) + 1}",
-                        'question': user_question,
-                        'sql': sql_query,
-                        'timestamp': datetime.now()
-                    })
-                    st.success("💾 Query saved!")
-            
-            # Clear progress after a delay
-            import time
-            time.sleep(2)
-            progress_bar.empty()
-            status_text.empty()
+            if executed:
+                # Success animation
+                st.balloons()
+    
+    checkpoint("export")
     
     # Enhanced Query history and saved queries
     if st.session_state.query_history or st.session_state.get('saved_queries', []):
@@ -928,6 +1449,25 @@ def main():
                             with col1_1:
                                 if st.button("🔄 Re-run", key=f"rerun_{i}"):
                                     st.session_state.sample_query = history_item['question']
+                                    # Recent results are read back from the job's destination table
+                                    with st.spinner("📥 Loading results..."):
+                                        reopened = pipeline.reopen(
+                                            history_item['question'],
+                                            history_item['sql'],
+                                            history_item.get('job'),
+                                            st.session_state.bq_client,
+                                            st.session_state.result_cache,
+                                            st.session_state.rollup_router,
+                                            st.session_state.table_schemas
+                                        )
+                                    if reopened and pipeline.execution_info.get('source') != 'job':
+                                        st.session_state.query_history.append({
+                                            'question': pipeline.question,
+                                            'sql': pipeline.sql,
+                                            'timestamp': datetime.now(),
+                                            'rows': len(pipeline.result),
+                                            'job': pipeline.execution_info.get('job')
+                                        })
                                     st.rerun()
                             with col1_2:
                                 if st.button("📋 Copy", key=f"copy_{i}"):
@@ -936,12 +1476,15 @@ def main():
                                 if st.button("💾 Save", key=f"save_{i}"):
                                     if 'saved_queries' not in st.session_state:
                                         st.session_state.saved_queries = []
-                                    st.session_state.saved_queries.append(history_item)
+                                    st.session_state.saved_queries.append(dict(history_item))
+                                    PREWARMER.register_saved(history_item['question'], history_item['sql'])
                                     st.success("Query saved!")
                         
                         with col2:
                             st.write(f"**Timestamp:** {history_item['timestamp'].strftime('%Y-%m-%d %H:%M')}")
                             st.write(f"**Rows:** {history_item['rows']}")
+                            if history_item.get('job'):
+                                st.caption(f"Job: {history_item['job']['job_id']}")
                             
                             # Quick stats
                             st.metric("Result Size", f"{history_item['rows']} rows")
@@ -962,7 +1505,7 @@ def main():
                             st.code(saved_query['sql'], language="sql")
                             
                             # Action buttons
-                            col1_1, col1_2, col1_3 = st.columns([1, 1, 1])
+                            col1_1, col1_2, col1_3, col1_4, col1_5 = st.columns([1, 1, 1, 1, 1])
                             with col1_1:
                                 if st.button("🔄 Use", key=f"use_saved_{i}"):
                                     st.session_state.sample_query = saved_query['question']
@@ -972,15 +1515,50 @@ def main():
                                     st.write("SQL copied!")
                             with col1_3:
                                 if st.button("🗑️ Delete", key=f"delete_saved_{i}"):
+                                    PREWARMER.unregister_saved(saved_query['sql'])
                                     st.session_state.saved_queries.pop(i)
                                     st.rerun()
+                            with col1_4:
+                                refresh = st.button("🔁 Refresh", key=f"refresh_saved_{i}")
+                            with col1_5:
+                                pinned = saved_query.get('pinned', False)
+                                if st.button("📍 Unpin" if pinned else "📌 Pin", key=f"pin_saved_{i}"):
+                                    saved_query['pinned'] = not pinned
+                                    st.rerun()
+                            
+                            if refresh:
+                                with st.spinner("Refreshing saved query..."), usage_context(saved_query['question']):
+                                    refresh_info = refresh_saved_query(
+                                        saved_query, st.session_state.bq_client, st.session_state.table_schemas
+                                    )
+                                if refresh_info is None:
+                                    st.error("❌ Refresh failed")
+                                elif refresh_info['mode'] == 'incremental':
+                                    st.success(
+                                        f"✅ Fetched {refresh_info['delta_rows']} row(s) from "
+                                        f"{pd.Timestamp(refresh_info['high_water_mark']):%Y-%m-%d} onwards "
+                                        f"({format_bytes(refresh_info['delta_bytes'])} scanned instead of "
+                                        f"{format_bytes(refresh_info['full_bytes'])})"
+                                    )
+                                else:
+                                    st.success(f"✅ Re-ran the full query ({format_bytes(refresh_info['full_bytes'])} scanned)")
+                            
+                            if saved_query.get('result') is not None:
+                                st.dataframe(saved_query['result'], use_container_width=True)
                         
                         with col2:
                             st.write(f"**Saved:** {saved_query['timestamp'].strftime('%Y-%m-%d %H:%M')}")
+                            if saved_query.get('refreshed_at'):
+                                st.write(f"**Data as of:** {saved_query['refreshed_at'].strftime('%Y-%m-%d %H:%M')}")
+                            warmed_at = PREWARMER.freshness(saved_query['question'])
+                            if warmed_at:
+                                st.caption(f"🌅 Pre-warmed {warmed_at.strftime('%Y-%m-%d %H:%M')}")
                         
                         st.markdown('</div>', unsafe_allow_html=True)
             else:
                 st.info("No saved queries yet. Save queries you want to reuse later!")
+    
+    checkpoint("history")
 
 if __name__ == "__main__":
-    main()
+    profiled(main)
@@ -1,31 +1,154 @@
-import pandas as pd
-from google.cloud import bigquery
-from google.cloud.exceptions import NotFound
+import time
 import streamlit as st
+from datetime import datetime, timedelta
 from config import Config
+from singleflight import QUERY_FLIGHTS, current_flight
+from sampling import preview_query
+from scheduler import BIGQUERY_SCHEDULER, BATCH, INTERACTIVE, scheduled
+from templates import parameter_value
+from tracing import record_dry_run, record_query
+from usage import USAGE, QuotaExceededError
+
+def _bigquery():
+    """Import google-cloud-bigquery on first use"""
+    from google.cloud import bigquery
+    return bigquery
+
+def _not_found():
+    """NotFound exception class, imported lazily with the BigQuery client"""
+    from google.cloud.exceptions import NotFound
+    return NotFound
+
+def _job_config(parameters=None, **options):
+    """QueryJobConfig with options and named query parameters ({'name', 'type', 'value'})"""
+    bigquery = _bigquery()
+    job_config = bigquery.QueryJobConfig(**options)
+    if parameters:
+        job_config.query_parameters = [
+            bigquery.ScalarQueryParameter(p['name'], p['type'], parameter_value(p)) for p in parameters
+        ]
+    return job_config
+
+def format_bytes(num_bytes):
+    """Human readable byte count"""
+    if num_bytes is None:
+        return "unknown"
+    size = float(num_bytes)
+    for unit in ["B", "KB", "MB", "GB", "TB"]:
+        if abs(size) < 1024 or unit == "TB":
+            return f"{size:.1f} {unit}" if unit != "B" else f"{int(size)} B"
+        size /= 1024
+
+class JobWatcher:
+    """Waits for a query job from the calling thread instead of blocking in the client library.
+
+    While waiting it calls on_wait(elapsed seconds), and it runs an optional
+    preview query next to the job and hands its rows to on_preview as soon as
+    they are ready. If the wait is interrupted (the Streamlit script was
+    stopped or rerun from inside a callback), both jobs are cancelled, unless
+    other sessions share the job through QUERY_FLIGHTS: then it is left to
+    finish for them.
+    """
+
+    def __init__(self, client, preview_sql=None, on_preview=None, on_wait=None, parameters=None):
+        self.client = client
+        self.preview_sql = preview_sql
+        self.parameters = parameters
+        self.on_preview = on_preview
+        self.on_wait = on_wait
+        self.preview_job = None
+        self.preview_shown = False
+
+    @staticmethod
+    def _cancel(job):
+        try:
+            if job is not None and not job.done():
+                job.cancel()
+        except Exception:
+            pass
+
+    def _deliver_preview(self):
+        """Hand the preview rows over once its job is done"""
+        if self.preview_job is None or self.preview_shown or not self.preview_job.done():
+            return
+        self.preview_shown = True
+        try:
+            df = self.preview_job.to_dataframe()
+            BigQueryClient._record_usage(self.preview_job)
+        except Exception:
+            # A failed preview only means nothing is shown early
+            return
+        self.on_preview(df)
+
+    def wait(self, job, finish=None):
+        """Return once job is done; the preview job is cancelled if it is still running.
+
+        finish() produces the call's result from the finished job; it is run in
+        the background for the other sessions if the wait is interrupted.
+        """
+        started = time.monotonic()
+        try:
+            if self.preview_sql and self.on_preview is not None:
+                try:
+                    self.preview_job = self.client.query(self.preview_sql, job_config=_job_config(self.parameters))
+                except Exception:
+                    self.preview_job = None
+            while not job.done():
+                self._deliver_preview()
+                if self.on_wait is not None:
+                    self.on_wait(time.monotonic() - started)
+                time.sleep(Config.JOB_POLL_SECONDS)
+        except BaseException:
+            flight = current_flight()
+            if finish is None or flight is None or not flight.detach(finish):
+                # Nobody is waiting for the rows any more
+                self._cancel(job)
+            raise
+        finally:
+            self._cancel(self.preview_job)
 
 class BigQueryClient:
-    def __init__(self):
+    def __init__(self, quiet=False):
         self.client = None
+        # Credentials given to the BigQuery client (None: application default credentials)
+        self.credentials = None
         self.project_id = Config.GOOGLE_CLOUD_PROJECT
         self.dataset_id = Config.BIGQUERY_DATASET
+        # Quiet clients (background threads without a page) keep messages instead of rendering them
+        self.quiet = quiet
+        self.last_message = None
+        # Message of the most recent failed query, used to repair it
+        self.last_error = None
+        # Job ID and destination table of the most recent successful query
+        self.last_job = None
+        # True if the most recent query was refused by the daily bytes-billed quota
+        self.quota_exceeded = False
+    
+    def _report(self, level, message):
+        """Show a status message on the page, or only keep it when quiet"""
+        self.last_message = message
+        if not self.quiet:
+            getattr(st, level)(message)
         
     def initialize_client(self):
         """Initialize BigQuery client with authentication"""
         try:
+            bigquery = _bigquery()
             if Config.GOOGLE_APPLICATION_CREDENTIALS:
-                self.client = bigquery.Client.from_service_account_json(
+                from google.oauth2 import service_account
+                self.credentials = service_account.Credentials.from_service_account_file(
                     Config.GOOGLE_APPLICATION_CREDENTIALS,
-                    project=self.project_id
+                    scopes=["https://www.googleapis.com/auth/cloud-platform"]
                 )
             else:
                 # Use default credentials (e.g., from gcloud auth)
-                self.client = bigquery.Client(project=self.project_id)
+                self.credentials = None
+            self.client = bigquery.Client(project=self.project_id, credentials=self.credentials)
             
-            st.success("✅ BigQuery client initialized successfully!")
+            self._report("success", "✅ BigQuery client initialized successfully!")
             return True
         except Exception as e:
-            st.error(f"❌ Failed to initialize BigQuery client: {str(e)}")
+            self._report("error", f"❌ Failed to initialize BigQuery client: {str(e)}")
             return False
     
     def get_table_schema(self, table_name):
@@ -45,12 +168,26 @@ class BigQueryClient:
             for field in table.schema:
                 schema_info["columns"][field.name] = field.field_type
             
+            # Partitioning and clustering let generated SQL be rewritten to prune data
+            if table.time_partitioning is not None:
+                schema_info["partitioning"] = {
+                    "type": table.time_partitioning.type_,
+                    "field": table.time_partitioning.field
+                }
+            elif table.range_partitioning is not None:
+                schema_info["partitioning"] = {
+                    "type": "RANGE",
+                    "field": table.range_partitioning.field
+                }
+            if table.clustering_fields:
+                schema_info["clustering"] = list(table.clustering_fields)
+            
             return schema_info
-        except NotFound:
-            st.warning(f"Table '{table_name}' not found in dataset '{self.dataset_id}'")
+        except _not_found():
+            self._report("warning", f"Table '{table_name}' not found in dataset '{self.dataset_id}'")
             return None
         except Exception as e:
-            st.error(f"Error getting schema for table '{table_name}': {str(e)}")
+            self._report("error", f"Error getting schema for table '{table_name}': {str(e)}")
             return None
     
     def get_all_tables(self):
@@ -72,45 +209,236 @@ class BigQueryClient:
             
             return table_list
         except Exception as e:
-            st.error(f"Error listing tables: {str(e)}")
+            self._report("error", f"Error listing tables: {str(e)}")
             return []
     
-    def execute_query(self, query, max_results=None):
-        """Execute a SQL query and return results as DataFrame"""
+    def execute_query(self, query, max_results=None, priority=INTERACTIVE, on_preview=None, on_wait=None,
+                      parameters=None):
+        """Execute a SQL query and return results as DataFrame.
+        
+        parameters are the values of the query's named @parameters, as
+        {'name', 'type', 'value'} dicts (see templates.py). on_wait(seconds) is called while the job runs. For queries whose dry run
+        exceeds PROGRESSIVE_PREVIEW_MIN_GB, a sampled LIMIT-ed preview runs next
+        to the job and on_preview(df) receives its rows as soon as they are ready.
+        """
+        self.last_error = None
+        self.last_job = None
+        self.quota_exceeded = False
+        remaining = None
         try:
             if not self.client:
-                st.error("BigQuery client not initialized")
+                self._report("error", "BigQuery client not initialized")
                 return None
             
-            # Set query job configuration
-            job_config = bigquery.QueryJobConfig()
-            if max_results:
-                job_config.maximum_bytes_billed = max_results * 1000  # Rough estimate
-            
-            # Execute query
-            query_job = self.client.query(query, job_config=job_config)
-            
-            # Convert to DataFrame
-            df = query_job.to_dataframe()
+            # BigQuery refuses the job rather than bill more than is left of today's quota
+            remaining = USAGE.check_quota('bigquery')
             
+            # Identical queries already running in another session share that job. The
+            # quota left is not part of the key: it changes after every query, and the
+            # leader's maximum_bytes_billed already keeps the shared job within it.
+            key = (
+                self.project_id, self.dataset_id, query.strip(), max_results,
+                tuple((p['name'], p['type'], p['value']) for p in parameters or ())
+            )
+            watcher = None
+            if on_preview is not None or on_wait is not None:
+                preview_sql = self._progressive_preview(query, parameters) if on_preview is not None else None
+                watcher = JobWatcher(self.client, preview_sql, on_preview, on_wait, parameters)
+            started = time.perf_counter()
+            df, self.last_job = QUERY_FLIGHTS.do(
+                key, lambda: self._scheduled_query(query, max_results, priority, watcher, parameters, remaining)
+            )
+            record_query(query, df, self.last_job, None, time.perf_counter() - started)
             return df
             
         except Exception as e:
-            st.error(f"❌ Query execution failed: {str(e)}")
+            if remaining is not None and "bytes billed" in str(e).lower():
+                e = QuotaExceededError(
+                    f"The query would bill more than the {format_bytes(remaining)} left of today's quota"
+                )
+            self.quota_exceeded = isinstance(e, QuotaExceededError)
+            self.last_error = str(e)
+            record_query(query, None, None, self.last_error, None)
+            self._report("error", f"❌ Query execution failed: {str(e)}")
+            return None
+    
+    def _progressive_preview(self, query, parameters=None):
+        """SQL of the preview to run next to a query, or None if the query is small or cannot be sampled"""
+        if not Config.PROGRESSIVE_PREVIEW:
             return None
+        estimate = self.estimate_query_bytes(query, parameters)
+        if estimate is None or estimate < Config.PROGRESSIVE_PREVIEW_MIN_BYTES:
+            return None
+        return preview_query(query)
+    
+    def _scheduled_query(self, query, max_results, priority, watcher=None, parameters=None, max_bytes_billed=None):
+        """Run the query once admitted by the process-wide BigQuery scheduler"""
+        with scheduled(BIGQUERY_SCHEDULER, priority=priority):
+            return self._run_query(query, max_results, watcher, parameters, max_bytes_billed)
     
-    def validate_query(self, query):
+    def _run_query(self, query, max_results=None, watcher=None, parameters=None, max_bytes_billed=None):
+        """Run a query job; returns the DataFrame and where the job stored its result"""
+        # Set query job configuration
+        job_config = _job_config(parameters)
+        if max_results:
+            job_config.maximum_bytes_billed = max_results * 1000  # Rough estimate
+        if max_bytes_billed is not None:
+            job_config.maximum_bytes_billed = min(job_config.maximum_bytes_billed or max_bytes_billed, max_bytes_billed)
+        
+        # Execute query
+        query_job = self.client.query(query, job_config=job_config)
+        if watcher is not None:
+            watcher.wait(query_job, lambda: self._job_result(query_job))
+        return self._job_result(query_job)
+    
+    def _job_result(self, query_job):
+        """The DataFrame of a query job and where the job stored its result"""
+        # Convert to DataFrame
+        df = query_job.to_dataframe()
+        self._record_usage(query_job)
+        
+        job_info = {
+            'job_id': query_job.job_id,
+            'location': query_job.location,
+            'destination': None,
+            'finished_at': datetime.now(),
+            'bytes_processed': query_job.total_bytes_processed,
+            'bytes_billed': query_job.total_bytes_billed,
+            'slot_ms': query_job.slot_millis
+        }
+        if query_job.destination is not None:
+            destination = query_job.destination
+            job_info['destination'] = f"{destination.project}.{destination.dataset_id}.{destination.table_id}"
+        return df, job_info
+    
+    @staticmethod
+    def _record_usage(query_job):
+        """Account the bytes and slot time of a finished job"""
+        USAGE.record_query(
+            query_job.job_id, query_job.total_bytes_processed, query_job.total_bytes_billed,
+            query_job.slot_millis, query_job.cache_hit
+        )
+    
+    def read_job_result(self, job_info, max_results=None):
+        """Read the rows of a finished query job from its destination table.
+        
+        Returns None when there is no destination table or it has expired,
+        so the caller can run the query as a new job instead.
+        """
+        try:
+            if not self.client or not job_info or not job_info.get('destination'):
+                return None
+            age = datetime.now() - job_info['finished_at']
+            if age > timedelta(hours=Config.JOB_RESULT_TTL_HOURS):
+                return None
+            
+            max_results = max_results or Config.MAX_QUERY_RESULTS
+            table = self.client.get_table(job_info['destination'])
+            if table.num_rows is not None and table.num_rows <= max_results:
+                # Reading the whole table lets to_dataframe use the BigQuery Storage API
+                rows = self.client.list_rows(table, page_size=Config.RESULT_PAGE_SIZE)
+            else:
+                rows = self.client.list_rows(table, max_results=max_results, page_size=Config.RESULT_PAGE_SIZE)
+            return rows.to_dataframe()
+        
+        except _not_found():
+            return None
+        except Exception as e:
+            self._report("warning", f"Could not read the earlier result of job {job_info.get('job_id')}: {str(e)}")
+            return None
+    
+    def _bqstorage_client(self):
+        """BigQuery Storage read client when google-cloud-bigquery-storage is installed, else None"""
+        try:
+            from google.cloud import bigquery_storage
+        except ImportError:
+            return None
+        try:
+            # The same credentials as the BigQuery client (None: application default credentials)
+            return bigquery_storage.BigQueryReadClient(credentials=self.credentials)
+        except Exception:
+            return None
+    
+    def stream_query(self, query, priority=BATCH):
+        """Run a query and yield its result as Arrow record batches.
+        
+        Rows are fetched a page (or Storage API stream block) at a time, so
+        memory use does not grow with the size of the result. The first item
+        yielded is the total row count.
+        """
+        remaining = USAGE.check_quota('bigquery')
+        with scheduled(BIGQUERY_SCHEDULER, priority=priority):
+            query_job = self.client.query(query, job_config=_job_config(maximum_bytes_billed=remaining))
+            rows = query_job.result(page_size=Config.EXPORT_PAGE_SIZE)
+            self._record_usage(query_job)
+            yield rows.total_rows
+            for batch in rows.to_arrow_iterable(bqstorage_client=self._bqstorage_client()):
+                yield batch
+    
+    def validate_query(self, query, parameters=None):
         """Validate SQL query syntax without executing"""
+        started = time.perf_counter()
         try:
             if not self.client:
                 return False, "BigQuery client not initialized"
             
             # Create a dry run query job
-            job_config = bigquery.QueryJobConfig(dry_run=True, use_query_cache=False)
+            job_config = _job_config(parameters, dry_run=True, use_query_cache=False)
             query_job = self.client.query(query, job_config=job_config)
             
+            record_dry_run(query, True, "Query is valid", query_job.total_bytes_processed, time.perf_counter() - started)
             return True, "Query is valid"
             
         except Exception as e:
-            return False, f"Query validation failed: {str(e)}"
-
+            message = f"Query validation failed: {str(e)}"
+            record_dry_run(query, False, message, None, time.perf_counter() - started)
+            return False, message
+    
+    def estimate_query_bytes(self, query, parameters=None):
+        """Return the bytes a query would process according to a dry run, or None"""
+        try:
+            if not self.client:
+                return None
+            
+            job_config = _job_config(parameters, dry_run=True, use_query_cache=False)
+            query_job = self.client.query(query, job_config=job_config)
+            return query_job.total_bytes_processed
+            
+        except Exception:
+            return None
+    
+    def run_statement(self, statement):
+        """Run a DDL/DML statement or script and wait for it to finish"""
+        try:
+            if not self.client:
+                self._report("error", "BigQuery client not initialized")
+                return False
+            
+            remaining = USAGE.check_quota('bigquery')
+            job = self.client.query(statement, job_config=_job_config(maximum_bytes_billed=remaining))
+            job.result()
+            self._record_usage(job)
+            return True
+            
+        except Exception as e:
+            self._report("error", f"❌ Statement failed: {str(e)}")
+            return False
+    
+    def table_modified(self, table_id):
+        """Last modification time of a fully qualified table, or None if it cannot be read"""
+        try:
+            if not self.client:
+                return None
+            return self.client.get_table(table_id).modified
+        except Exception:
+            return None
+    
+    def table_exists(self, table_id):
+        """Check whether a fully qualified table exists"""
+        try:
+            if not self.client:
+                return False
+            self.client.get_table(table_id)
+            return True
+        except Exception:
+            return False
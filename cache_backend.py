@@ -0,0 +1,346 @@
+"""
+Cache storage shared by the schema, generation and result caches.
+
+Three backends implement the same small interface (get, set, delete, values,
+clear):
+
+- MemoryBackend keeps live objects in this process (the default),
+- DiskBackend stores serialized entries under CACHE_DIR, shared by every
+  process on the host,
+- RedisBackend stores them in any Redis-compatible server at REDIS_URL, so
+  every replica behind the load balancer sees the same warm state.
+
+Serialized entries are JSON for plain values (datetimes tagged) followed by
+Arrow IPC streams for any DataFrames, which keeps result sets compact and
+fast to decode.
+"""
+
+import hashlib
+import json
+import os
+import struct
+import threading
+import time
+import warnings
+from collections import OrderedDict
+from datetime import date, datetime
+from config import Config
+
+_MAGIC = b"KC1"
+
+class SerializationError(Exception):
+    """Raised when a value cannot be stored in a shared backend"""
+
+def _frame_to_bytes(df):
+    import pyarrow as pa
+    try:
+        table = pa.Table.from_pandas(df)
+    except (pa.ArrowException, TypeError, ValueError) as e:
+        raise SerializationError(f"DataFrame cannot be converted to Arrow: {e}")
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+def _frame_from_bytes(data):
+    import pyarrow as pa
+    return pa.ipc.open_stream(data).read_all().to_pandas()
+
+def serialize(value):
+    """Encode a value of JSON types, datetimes and DataFrames as bytes"""
+    import pandas as pd
+    frames = []
+
+    def encode(item):
+        if isinstance(item, pd.DataFrame):
+            frames.append(_frame_to_bytes(item))
+            return {"__frame__": len(frames) - 1}
+        if isinstance(item, datetime):
+            return {"__datetime__": item.isoformat()}
+        if isinstance(item, date):
+            return {"__date__": item.isoformat()}
+        if isinstance(item, dict):
+            return {str(key): encode(val) for key, val in item.items()}
+        if isinstance(item, (list, tuple)):
+            return [encode(val) for val in item]
+        return item
+
+    try:
+        header = json.dumps(encode(value), separators=(",", ":")).encode("utf-8")
+    except TypeError as e:
+        raise SerializationError(str(e))
+    parts = [_MAGIC, struct.pack(">II", len(header), len(frames)), header]
+    for frame in frames:
+        parts.append(struct.pack(">Q", len(frame)))
+        parts.append(frame)
+    return b"".join(parts)
+
+def deserialize(data):
+    """Inverse of serialize"""
+    if not data.startswith(_MAGIC):
+        raise SerializationError("Not a cache entry")
+    offset = len(_MAGIC)
+    header_length, frame_count = struct.unpack_from(">II", data, offset)
+    offset += 8
+    header = json.loads(data[offset:offset + header_length].decode("utf-8"))
+    offset += header_length
+    frames = []
+    for _ in range(frame_count):
+        (length,) = struct.unpack_from(">Q", data, offset)
+        offset += 8
+        frames.append(data[offset:offset + length])
+        offset += length
+
+    def decode(item):
+        if isinstance(item, dict):
+            if "__frame__" in item:
+                return _frame_from_bytes(frames[item["__frame__"]])
+            if "__datetime__" in item:
+                return datetime.fromisoformat(item["__datetime__"])
+            if "__date__" in item:
+                return date.fromisoformat(item["__date__"])
+            return {key: decode(val) for key, val in item.items()}
+        if isinstance(item, list):
+            return [decode(val) for val in item]
+        return item
+
+    return decode(header)
+
+def hash_key(namespace, key):
+    """Stable storage key for any hashable cache key"""
+    return f"{namespace}:{hashlib.sha256(repr(key).encode('utf-8')).hexdigest()}"
+
+class MemoryBackend:
+    """LRU of live objects in this process"""
+
+    def __init__(self, max_entries=None):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at is not None and time.time() >= expires_at:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._entries[key] = (value, time.time() + ttl if ttl else None)
+            self._entries.move_to_end(key)
+            while self.max_entries and len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return True
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def values(self):
+        """Live values, most recently used first"""
+        now = time.time()
+        with self._lock:
+            return [value for value, expires_at in reversed(self._entries.values())
+                    if expires_at is None or now < expires_at]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+class DiskBackend:
+    """Serialized entries as files in a directory, shared by processes on this host"""
+
+    def __init__(self, namespace, directory=None, max_entries=None):
+        self.namespace = namespace
+        self.directory = os.path.join(directory or Config.CACHE_DIR, namespace)
+        self.max_entries = max_entries
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hash_key(self.namespace, key).split(":", 1)[1] + ".bin")
+
+    def _read(self, path):
+        """(expires_at, value) from an entry file, or None if it is missing or unreadable"""
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            (expires_at,) = struct.unpack_from(">d", data)
+            return expires_at, deserialize(data[8:])
+        except (OSError, ValueError, struct.error, SerializationError):
+            return None
+
+    def get(self, key):
+        path = self._path(key)
+        entry = self._read(path)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at and time.time() >= expires_at:
+            self.delete(key)
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return value
+
+    def set(self, key, value, ttl=None):
+        try:
+            data = serialize(value)
+        except SerializationError:
+            return False
+        path = self._path(key)
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temporary, "wb") as f:
+                f.write(struct.pack(">d", time.time() + ttl if ttl else 0.0))
+                f.write(data)
+            # Readers in other processes never see a half-written file
+            os.replace(temporary, path)
+        except OSError:
+            return False
+        self._evict()
+        return True
+
+    def _files(self):
+        try:
+            return [entry for entry in os.scandir(self.directory) if entry.name.endswith(".bin")]
+        except OSError:
+            return []
+
+    def _evict(self):
+        """Remove the least recently used files beyond max_entries"""
+        if not self.max_entries:
+            return
+        files = self._files()
+        if len(files) <= self.max_entries:
+            return
+        files.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in files[:len(files) - self.max_entries]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def values(self):
+        """Live values, most recently used first"""
+        now = time.time()
+        files = sorted(self._files(), key=lambda entry: entry.stat().st_mtime, reverse=True)
+        values = []
+        for entry in files:
+            item = self._read(entry.path)
+            if item is not None and (not item[0] or now < item[0]):
+                values.append(item[1])
+        return values
+
+    def clear(self):
+        for entry in self._files():
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+    def __len__(self):
+        return len(self._files())
+
+class RedisBackend:
+    """Serialized entries in a Redis-compatible server, shared by every replica.
+
+    Any client with the redis-py get/set/delete/scan_iter API can be passed in,
+    e.g. a local stand-in for tests.
+    """
+
+    def __init__(self, namespace, client=None, url=None):
+        self.namespace = namespace
+        self.key_prefix = Config.CACHE_KEY_PREFIX
+        self.prefix = f"{self.key_prefix}{namespace}:"
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url or Config.REDIS_URL)
+        self.client = client
+
+    def _key(self, key):
+        return self.key_prefix + hash_key(self.namespace, key)
+
+    def get(self, key):
+        try:
+            data = self.client.get(self._key(key))
+            return deserialize(data) if data is not None else None
+        except (SerializationError, ValueError):
+            return None
+        except Exception:
+            # An unreachable cache is treated as a miss
+            return None
+
+    def set(self, key, value, ttl=None):
+        try:
+            data = serialize(value)
+        except SerializationError:
+            return False
+        try:
+            # Redis evicts by its own maxmemory policy; entries also expire after ttl
+            self.client.set(self._key(key), data, ex=max(1, int(ttl)) if ttl else None)
+            return True
+        except Exception:
+            return False
+
+    def delete(self, key):
+        try:
+            self.client.delete(self._key(key))
+        except Exception:
+            pass
+
+    def _keys(self):
+        try:
+            return list(self.client.scan_iter(match=f"{self.prefix}*"))
+        except Exception:
+            return []
+
+    def values(self):
+        values = []
+        for key in self._keys():
+            try:
+                data = self.client.get(key)
+                if data is not None:
+                    values.append(deserialize(data))
+            except Exception:
+                continue
+        return values
+
+    def clear(self):
+        keys = self._keys()
+        if keys:
+            try:
+                self.client.delete(*keys)
+            except Exception:
+                pass
+
+    def __len__(self):
+        return len(self._keys())
+
+def make_backend(namespace, max_entries=None, backend=None):
+    """Backend for one cache, chosen by CACHE_BACKEND ('memory', 'disk' or 'redis')"""
+    backend = (backend or Config.CACHE_BACKEND).lower()
+    if backend == "redis":
+        try:
+            return RedisBackend(namespace)
+        except ImportError:
+            warnings.warn("CACHE_BACKEND is 'redis' but the redis package is not installed; using memory")
+    if backend == "disk":
+        return DiskBackend(namespace, max_entries=max_entries)
+    return MemoryBackend(max_entries)
@@ -15,6 +15,33 @@ class Config:
     # OpenAI Configuration
     OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
     
+    # LLM provider: 'vertex' or 'openai' (defaults to OpenAI when a key is configured)
+    LLM_PROVIDER = os.getenv('LLM_PROVIDER', 'openai' if OPENAI_API_KEY else 'vertex').lower()
+    
+    # LLM call routing: timeouts, retries, failover, hedging and circuit breaking
+    LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', '20'))  # seconds per attempt
+    LLM_DEADLINE = float(os.getenv('LLM_DEADLINE', '45'))  # seconds for the whole call
+    LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '2'))
+    LLM_RETRY_BASE_DELAY = float(os.getenv('LLM_RETRY_BASE_DELAY', '0.5'))
+    LLM_FAILOVER = os.getenv('LLM_FAILOVER', 'true').lower() == 'true'
+    LLM_HEDGE = os.getenv('LLM_HEDGE', 'false').lower() == 'true'
+    LLM_HEDGE_DELAY = float(os.getenv('LLM_HEDGE_DELAY', '3'))  # used until p95 is known
+    LLM_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('LLM_CIRCUIT_FAILURE_THRESHOLD', '5'))
+    LLM_CIRCUIT_RESET_SECONDS = float(os.getenv('LLM_CIRCUIT_RESET_SECONDS', '60'))
+    LLM_PROVIDER_WORKERS = int(os.getenv('LLM_PROVIDER_WORKERS', '8'))  # concurrent calls per provider, incl. abandoned ones
+    
+    # Admission control shared by all sessions in this process
+    SCHEDULER_MAX_WAIT = float(os.getenv('SCHEDULER_MAX_WAIT', '120'))  # seconds
+    SCHEDULER_FAIRNESS_HALF_LIFE = float(os.getenv('SCHEDULER_FAIRNESS_HALF_LIFE', '600'))  # seconds
+    LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', '8'))
+    LLM_PER_USER_CONCURRENCY = int(os.getenv('LLM_PER_USER_CONCURRENCY', '2'))
+    LLM_RATE_PER_MINUTE = float(os.getenv('LLM_RATE_PER_MINUTE', '120'))
+    LLM_USER_RATE_PER_MINUTE = float(os.getenv('LLM_USER_RATE_PER_MINUTE', '20'))
+    BIGQUERY_MAX_CONCURRENCY = int(os.getenv('BIGQUERY_MAX_CONCURRENCY', '10'))
+    BIGQUERY_PER_USER_CONCURRENCY = int(os.getenv('BIGQUERY_PER_USER_CONCURRENCY', '3'))
+    BIGQUERY_RATE_PER_MINUTE = float(os.getenv('BIGQUERY_RATE_PER_MINUTE', '300'))
+    BIGQUERY_USER_RATE_PER_MINUTE = float(os.getenv('BIGQUERY_USER_RATE_PER_MINUTE', '30'))
+    
     # App Configuration
     APP_TITLE = os.getenv('APP_TITLE', 'Marketing KPIs Analytics Dashboard')
     APP_DESCRIPTION = os.getenv('APP_DESCRIPTION', 'Interactive dashboard for exploring marketing KPIs using natural language queries')
@@ -23,6 +50,129 @@ class Config:
     MAX_QUERY_RESULTS = 1000
     QUERY_TIMEOUT = 30  # seconds
     
+    # BigQuery keeps a query's destination table for about 24 hours
+    JOB_RESULT_TTL_HOURS = float(os.getenv('JOB_RESULT_TTL_HOURS', '23'))
+    RESULT_PAGE_SIZE = int(os.getenv('RESULT_PAGE_SIZE', '500'))
+    
+    # Streaming export of full results to CSV/Parquet files
+    EXPORT_DIR = os.getenv('EXPORT_DIR', 'exports')
+    EXPORT_PAGE_SIZE = int(os.getenv('EXPORT_PAGE_SIZE', '50000'))
+    EXPORT_MAX_ROWS = int(os.getenv('EXPORT_MAX_ROWS', '50000000'))
+    EXPORT_DOWNLOAD_MAX_MB = float(os.getenv('EXPORT_DOWNLOAD_MAX_MB', '200'))  # larger files stay on the server
+    EXPORT_RETENTION_HOURS = float(os.getenv('EXPORT_RETENTION_HOURS', '24'))  # older export files are deleted (0 keeps them)
+    
+    # Dashboard of pinned saved queries
+    DASHBOARD_WORKERS = int(os.getenv('DASHBOARD_WORKERS', '4'))  # tiles run concurrently
+    DASHBOARD_MAX_AGE_MINUTES = float(os.getenv('DASHBOARD_MAX_AGE_MINUTES', '60'))  # older tiles are re-run
+    DASHBOARD_COLUMNS = int(os.getenv('DASHBOARD_COLUMNS', '3'))
+    
+    # Usage accounting and daily per-user quotas (0 = unlimited)
+    USAGE_DB_PATH = os.getenv('USAGE_DB_PATH', 'usage.sqlite3')
+    QUOTA_DAILY_TOKENS = int(os.getenv('QUOTA_DAILY_TOKENS', '0'))
+    QUOTA_DAILY_BYTES_BILLED = int(float(os.getenv('QUOTA_DAILY_GB_BILLED', '0')) * 1024 ** 3)
+    
+    # Opt-in recording of pipeline runs to JSONL, replayed with replay.py
+    TRACE_ENABLED = os.getenv('TRACE_ENABLED', 'false').lower() == 'true'
+    TRACE_PATH = os.getenv('TRACE_PATH', 'traces.jsonl')
+    
+    # Per-section timing of reruns, shown in the sidebar
+    RERUN_PROFILER = os.getenv('RERUN_PROFILER', 'false').lower() == 'true'
+    RERUN_PROFILE_HISTORY = int(os.getenv('RERUN_PROFILE_HISTORY', '20'))  # reruns averaged
+    
+    # Memoized result summaries and charts kept per process
+    VIZ_CACHE_ENTRIES = int(os.getenv('VIZ_CACHE_ENTRIES', '32'))
+    
+    # Tables per page in the catalog browser
+    CATALOG_PAGE_SIZE = int(os.getenv('CATALOG_PAGE_SIZE', '20'))
+    
+    # Schema context sent to the LLM: 'compact' (one line per table) or 'verbose'
+    SCHEMA_FORMAT = os.getenv('SCHEMA_FORMAT', 'compact').lower()
+    SCHEMA_TOKEN_BUDGET = int(os.getenv('SCHEMA_TOKEN_BUDGET', '1500'))
+    SCHEMA_INCLUDE_DESCRIPTIONS = os.getenv('SCHEMA_INCLUDE_DESCRIPTIONS', 'true').lower() == 'true'
+    # Columns never dropped when the schema is trimmed to the budget
+    SCHEMA_PRIORITY_COLUMNS = [c.strip() for c in os.getenv('SCHEMA_PRIORITY_COLUMNS', '').split(',') if c.strip()]
+    
+    # Cost rewrites applied before a query runs (see sql_rewriter.py)
+    ENABLE_COST_REWRITE = os.getenv('ENABLE_COST_REWRITE', 'true').lower() == 'true'
+    # Opt-in: queries without a filter on a table's partition column read at most this many days.
+    # This changes their results (totals cover only that window), so it is off by default (0).
+    PARTITION_FILTER_DAYS = int(os.getenv('PARTITION_FILTER_DAYS', '0'))
+    
+    # Percent of the base table a sampled preview reads (see sampling.py)
+    SAMPLE_PERCENT = float(os.getenv('SAMPLE_PERCENT', '5'))
+    
+    # Queries estimated above this size show the rows of a sampled LIMIT-ed preview while they run
+    PROGRESSIVE_PREVIEW = os.getenv('PROGRESSIVE_PREVIEW', 'true').lower() == 'true'
+    PROGRESSIVE_PREVIEW_MIN_BYTES = int(float(os.getenv('PROGRESSIVE_PREVIEW_MIN_GB', '1')) * 1024 ** 3)
+    PROGRESSIVE_PREVIEW_ROWS = int(os.getenv('PROGRESSIVE_PREVIEW_ROWS', '50'))
+    JOB_POLL_SECONDS = float(os.getenv('JOB_POLL_SECONDS', '0.5'))  # how often a running job is checked
+    
+    # Failed SQL is sent back to the LLM with the BigQuery error, within these bounds
+    SQL_AUTO_REPAIR = os.getenv('SQL_AUTO_REPAIR', 'true').lower() == 'true'
+    SQL_REPAIR_MAX_ATTEMPTS = int(os.getenv('SQL_REPAIR_MAX_ATTEMPTS', '2'))
+    SQL_REPAIR_DEADLINE = float(os.getenv('SQL_REPAIR_DEADLINE', '30'))  # seconds for the whole repair
+    
+    # Few-shot examples retrieved from successful queries
+    EXAMPLE_STORE_PATH = os.getenv('EXAMPLE_STORE_PATH', 'query_examples.jsonl')
+    EXAMPLE_STORE_MAX = int(os.getenv('EXAMPLE_STORE_MAX', '500'))
+    EXAMPLE_TOP_K = int(os.getenv('EXAMPLE_TOP_K', '3'))
+    EXAMPLE_TOKEN_BUDGET = int(os.getenv('EXAMPLE_TOKEN_BUDGET', '600'))
+    
+    # Result cache used to answer follow-up queries locally
+    RESULT_CACHE_SIZE = int(os.getenv('RESULT_CACHE_SIZE', '20'))
+    
+    # Storage for the shared schema, generation and result caches: 'memory' (this process),
+    # 'disk' (CACHE_DIR, shared on this host) or 'redis' (REDIS_URL, shared by every replica)
+    CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'memory')
+    CACHE_DIR = os.getenv('CACHE_DIR', '.cache')
+    REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+    CACHE_KEY_PREFIX = os.getenv('CACHE_KEY_PREFIX', 'kpi:')
+    SCHEMA_CACHE_TTL_MINUTES = float(os.getenv('SCHEMA_CACHE_TTL_MINUTES', '60'))
+    
+    # Process-wide caches shared by all sessions and filled ahead of time by the pre-warmer
+    GENERATION_CACHE_SIZE = int(os.getenv('GENERATION_CACHE_SIZE', '500'))
+    GENERATION_CACHE_TTL_HOURS = float(os.getenv('GENERATION_CACHE_TTL_HOURS', '24'))
+    
+    # Questions differing only in dates, numbers or quoted values reuse one parameterized query (see templates.py)
+    QUERY_TEMPLATES = os.getenv('QUERY_TEMPLATES', 'true').lower() == 'true'
+    QUERY_TEMPLATE_CACHE_SIZE = int(os.getenv('QUERY_TEMPLATE_CACHE_SIZE', '500'))
+    QUERY_TEMPLATE_TTL_HOURS = float(os.getenv('QUERY_TEMPLATE_TTL_HOURS', '168'))
+    SHARED_RESULT_CACHE_SIZE = int(os.getenv('SHARED_RESULT_CACHE_SIZE', '100'))
+    SHARED_RESULT_MAX_AGE_HOURS = float(os.getenv('SHARED_RESULT_MAX_AGE_HOURS', '12'))
+    
+    # Opt-in background pre-warming of saved and popular queries. Runs spend LLM calls
+    # and BigQuery scans nobody asked for yet, so it is off by default.
+    ENABLE_PREWARM = os.getenv('ENABLE_PREWARM', 'false').lower() == 'true'
+    PREWARM_WINDOWS = os.getenv('PREWARM_WINDOWS', '06:00-08:00')  # comma-separated local HH:MM-HH:MM
+    PREWARM_CHECK_INTERVAL = float(os.getenv('PREWARM_CHECK_INTERVAL', '300'))  # seconds between window checks
+    PREWARM_WORKERS = int(os.getenv('PREWARM_WORKERS', '2'))
+    PREWARM_TOP_QUESTIONS = int(os.getenv('PREWARM_TOP_QUESTIONS', '10'))
+    PREWARM_MAX_QUERIES = int(os.getenv('PREWARM_MAX_QUERIES', '25'))  # per run
+    PREWARM_MAX_LLM_CALLS = int(os.getenv('PREWARM_MAX_LLM_CALLS', '10'))  # per run
+    PREWARM_MAX_BYTES = int(float(os.getenv('PREWARM_MAX_GB', '50')) * 1024 ** 3)  # bytes scanned per run
+    PREWARM_STATE_PATH = os.getenv('PREWARM_STATE_PATH', 'prewarm_state.json')
+    
+    # Daily KPI rollups: generated SQL is routed to these tables when possible
+    ENABLE_ROLLUP_ROUTING = os.getenv('ENABLE_ROLLUP_ROUTING', 'true').lower() == 'true'
+    ROLLUP_DATASET = os.getenv('ROLLUP_DATASET')  # defaults to BIGQUERY_DATASET
+    ROLLUP_TABLE_PREFIX = os.getenv('ROLLUP_TABLE_PREFIX', 'rollup_daily_')
+    ROLLUP_REFRESH_LOOKBACK_DAYS = int(os.getenv('ROLLUP_REFRESH_LOOKBACK_DAYS', '3'))
+    # Refresh a rollup that is older than its base table before routing to it (else the query is not routed)
+    ROLLUP_AUTO_REFRESH = os.getenv('ROLLUP_AUTO_REFRESH', 'true').lower() == 'true'
+    ROLLUP_DEFINITIONS = {
+        "marketing_campaigns": {
+            "date_column": "start_date",
+            "dimensions": ["campaign_id", "campaign_name", "campaign_type", "channel"],
+            "measures": ["budget", "spend", "impressions", "clicks", "conversions", "revenue"]
+        },
+        "customer_metrics": {
+            "date_column": "date",
+            "dimensions": ["channel"],
+            "measures": ["new_customers", "returning_customers", "churn_rate",
+                         "lifetime_value", "acquisition_cost", "retention_rate"]
+        }
+    }
+    
     # Sample table schemas for context (update with your actual tables)
     SAMPLE_TABLES = {
         "marketing_campaigns": {
@@ -0,0 +1,105 @@
+"""
+Dashboard of pinned saved queries.
+
+Each pinned saved query is a tile. Tiles first show the newest result already
+at hand (the saved result or the shared result cache) with its age; tiles
+whose data is missing or older than DASHBOARD_MAX_AGE_MINUTES are then run
+concurrently on a bounded pool, and each is yielded as soon as its query
+finishes so the page can fill in progressively.
+"""
+
+import copy
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from config import Config
+from result_cache import SHARED_RESULT_CACHE
+from sql_rewriter import rewrite_for_cost
+from sql_validator import validate_sql
+from usage import usage_context
+
+def pinned_queries(saved_queries):
+    """(index, saved query) pairs of the pinned saved queries"""
+    return [(index, saved) for index, saved in enumerate(saved_queries or []) if saved.get('pinned')]
+
+def tile_sql(saved, table_schemas=None):
+    """The SQL a tile runs: the same checks and rewrites as the query pipeline, or None if rejected"""
+    is_valid, _, sql = validate_sql(saved['sql'], table_schemas)
+    if not is_valid:
+        return None
+    if Config.ENABLE_COST_REWRITE:
+        sql, _ = rewrite_for_cost(sql, table_schemas)
+    return sql
+
+def cached_result(saved, sql):
+    """Newest result at hand for a tile as {'df', 'fetched_at'}, or None"""
+    candidates = []
+    if saved.get('result') is not None and saved.get('refreshed_at'):
+        candidates.append({'df': saved['result'], 'fetched_at': saved['refreshed_at']})
+    shared = SHARED_RESULT_CACHE.get(sql) if sql else None
+    if shared is not None:
+        candidates.append({'df': shared['df'], 'fetched_at': shared['timestamp']})
+    return max(candidates, key=lambda item: item['fetched_at']) if candidates else None
+
+def is_stale(result, max_age_minutes=None):
+    """True if a tile result is missing or older than the dashboard allows"""
+    max_age = timedelta(minutes=max_age_minutes if max_age_minutes is not None else Config.DASHBOARD_MAX_AGE_MINUTES)
+    return result is None or datetime.now() - result['fetched_at'] > max_age
+
+def staleness_label(fetched_at, now=None):
+    """Short age badge such as '🟢 5m old' or '🟠 3h old'"""
+    age = (now or datetime.now()) - fetched_at
+    minutes = int(age.total_seconds() // 60)
+    if minutes < 1:
+        text = "just now"
+    elif minutes < 60:
+        text = f"{minutes}m old"
+    elif minutes < 48 * 60:
+        text = f"{minutes // 60}h old"
+    else:
+        text = f"{minutes // (24 * 60)}d old"
+    fresh = age <= timedelta(minutes=Config.DASHBOARD_MAX_AGE_MINUTES)
+    return f"{'🟢' if fresh else '🟠'} {text}"
+
+def _run_tile(saved, sql, bq_client):
+    """Run one tile's query with its own client state; returns the result dict"""
+    # Shallow copy: shares the BigQuery connection but not last_error/last_job.
+    # Quiet, since st.* calls from a pool thread land at arbitrary places on the
+    # page; the error comes back in the result and the tile shows it.
+    client = copy.copy(bq_client)
+    client.quiet = True
+    client.last_message = None
+    with usage_context(saved.get('question')):
+        df = client.execute_query(sql, Config.MAX_QUERY_RESULTS)
+    if df is None:
+        return {'error': client.last_error or client.last_message or "Query execution failed"}
+    fetched_at = datetime.now()
+    SHARED_RESULT_CACHE.put(sql, df)
+    saved['result'] = df
+    saved['refreshed_at'] = fetched_at
+    return {'df': df, 'fetched_at': fetched_at}
+
+def run_tiles(tiles, bq_client, max_workers=None, thread_setup=None):
+    """Run (key, saved, sql) tiles concurrently; yields (key, result) in completion order.
+
+    thread_setup(thread) is applied to each worker thread before it runs a
+    query (the app uses it to attach the Streamlit script context). Workers
+    never write to the page: failures are yielded as {'error': message}.
+    """
+    if not tiles:
+        return
+
+    def run(saved, sql):
+        if thread_setup is not None:
+            thread_setup(threading.current_thread())
+        return _run_tile(saved, sql, bq_client)
+
+    workers = max(1, min(max_workers or Config.DASHBOARD_WORKERS, len(tiles)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="dashboard") as pool:
+        futures = {pool.submit(run, saved, sql): key for key, saved, sql in tiles}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {'error': str(e)}
+            yield futures[future], result
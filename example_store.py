@@ -0,0 +1,247 @@
+"""
+Few-shot examples retrieved from queries that ran successfully.
+
+Every successful (question, SQL) pair is appended to a JSONL file and indexed
+with BM25 over the question words, the tables it reads and the columns it
+uses. The prompt gets the examples closest to the new question, up to a token
+budget, instead of the same fixed block every time.
+"""
+
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+from datetime import datetime
+from config import Config
+from sql_utils import column_references, normalize_sql, referenced_tables, strip_statement
+from tokens import count_tokens
+
+# The hand-written examples the store starts from
+SEED_EXAMPLES = [
+    {
+        "question": "Campaign Performance Analysis",
+        "sql": """SELECT
+    campaign_name,
+    SUM(spend) as total_spend,
+    SUM(impressions) as total_impressions,
+    SUM(clicks) as total_clicks,
+    SUM(conversions) as total_conversions,
+    ROUND(SUM(clicks) / SUM(impressions) * 100, 2) as ctr_percentage,
+    ROUND(SUM(conversions) / SUM(clicks) * 100, 2) as conversion_rate,
+    ROUND(SUM(revenue) / SUM(spend), 2) as roas
+FROM marketing_campaigns
+WHERE start_date >= '2024-01-01'
+GROUP BY campaign_name
+ORDER BY total_spend DESC"""
+    },
+    {
+        "question": "Monthly Customer Metrics",
+        "sql": """SELECT
+    DATE_TRUNC(date, MONTH) as month,
+    SUM(new_customers) as new_customers,
+    SUM(returning_customers) as returning_customers,
+    AVG(churn_rate) as avg_churn_rate,
+    AVG(lifetime_value) as avg_ltv,
+    AVG(acquisition_cost) as avg_cac
+FROM customer_metrics
+WHERE date >= '2024-01-01'
+GROUP BY month
+ORDER BY month"""
+    },
+    {
+        "question": "Top Performing Campaigns by ROAS",
+        "sql": """SELECT
+    campaign_name,
+    SUM(revenue) as total_revenue,
+    SUM(spend) as total_spend,
+    ROUND(SUM(revenue) / SUM(spend), 2) as roas
+FROM marketing_campaigns
+WHERE start_date >= '2024-01-01'
+GROUP BY campaign_name
+HAVING SUM(spend) > 1000
+ORDER BY roas DESC
+LIMIT 10"""
+    }
+]
+
+_STOPWORDS = {
+    "a", "an", "and", "are", "as", "by", "for", "from", "how", "in", "is", "me", "of",
+    "on", "or", "show", "the", "to", "was", "were", "what", "which", "with", "give", "list"
+}
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+def terms(text):
+    """Lower-case search terms; identifiers are split on underscores and plurals folded"""
+    result = []
+    for word in _WORD_RE.findall((text or "").lower()):
+        if word in _STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        result.append(word)
+    return result
+
+def format_examples(examples, header="-- Sample Marketing KPI Queries:"):
+    """Render examples as the SQL comment block used in the prompt"""
+    blocks = [header] if header else []
+    for number, example in enumerate(examples, 1):
+        blocks.append(f"-- {number}. {example['question']}\n{strip_statement(example['sql'])};")
+    return "\n" + "\n\n".join(blocks) + "\n"
+
+class ExampleStore:
+    """Persisted question/SQL pairs with a BM25 index"""
+
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, path=None, max_examples=None):
+        self.path = path or Config.EXAMPLE_STORE_PATH
+        self.max_examples = max_examples or Config.EXAMPLE_STORE_MAX
+        self._lock = threading.Lock()
+        self._examples = None
+        self._keys = {}
+
+    def _document_terms(self, example):
+        columns = [name for _, name in column_references(example['sql'])]
+        return terms(" ".join([example['question']] + example.get('tables', []) + columns))
+
+    def _index(self, example):
+        example['_terms'] = Counter(self._document_terms(example))
+        example['_length'] = sum(example['_terms'].values())
+        self._keys[normalize_sql(example['sql'])] = example
+
+    def _load(self):
+        """Read the store on first use (caller holds the lock)"""
+        if self._examples is not None:
+            return
+        self._examples = []
+        for seed in SEED_EXAMPLES:
+            example = dict(seed, tables=referenced_tables(seed['sql']), seed=True)
+            self._index(example)
+            self._examples.append(example)
+        if self.path and os.path.exists(self.path):
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    for line in f:
+                        if line.strip():
+                            self._add_loaded(json.loads(line))
+            except (OSError, ValueError):
+                pass
+
+    def _add_loaded(self, example):
+        if normalize_sql(example['sql']) in self._keys:
+            return
+        self._index(example)
+        self._examples.append(example)
+
+    def add(self, question, sql, tables=None):
+        """Record a question and the SQL that answered it; returns False for duplicates"""
+        question = (question or "").strip()
+        sql = strip_statement(sql or "")
+        if not question or not sql:
+            return False
+        with self._lock:
+            self._load()
+            existing = self._keys.get(normalize_sql(sql))
+            if existing is not None:
+                existing['uses'] = existing.get('uses', 1) + 1
+                return False
+            example = {
+                'question': question,
+                'sql': sql,
+                'tables': tables if tables is not None else referenced_tables(sql),
+                'added_at': datetime.now().isoformat(timespec="seconds"),
+                'uses': 1
+            }
+            self._index(example)
+            self._examples.append(example)
+            if len(self._examples) > self.max_examples:
+                self._evict()
+                self._rewrite()
+            else:
+                self._append(example)
+            return True
+
+    def _evict(self):
+        """Drop the oldest learned examples beyond the size limit; seeds are kept"""
+        learned = [ex for ex in self._examples if not ex.get('seed')]
+        overflow = len(self._examples) - self.max_examples
+        for example in learned[:overflow]:
+            self._examples.remove(example)
+            self._keys.pop(normalize_sql(example['sql']), None)
+
+    @staticmethod
+    def _serializable(example):
+        return {key: value for key, value in example.items() if not key.startswith('_') and key != 'seed'}
+
+    def _append(self, example):
+        if not self.path:
+            return
+        try:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(self._serializable(example)) + "\n")
+        except OSError:
+            pass
+
+    def _rewrite(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path, "w", encoding="utf-8") as f:
+                for example in self._examples:
+                    if not example.get('seed'):
+                        f.write(json.dumps(self._serializable(example)) + "\n")
+        except OSError:
+            pass
+
+    def search(self, question, k=None, token_budget=None):
+        """Best-matching examples for a question, at most k and within the token budget.
+
+        Falls back to the seed examples when nothing matches lexically.
+        """
+        k = k or Config.EXAMPLE_TOP_K
+        token_budget = token_budget or Config.EXAMPLE_TOKEN_BUDGET
+        query_terms = set(terms(question))
+        with self._lock:
+            self._load()
+            examples = list(self._examples)
+
+        ranked = []
+        if query_terms and examples:
+            average_length = sum(ex['_length'] for ex in examples) / len(examples) or 1
+            for example in examples:
+                score = 0.0
+                for term in query_terms:
+                    frequency = example['_terms'].get(term, 0)
+                    if not frequency:
+                        continue
+                    containing = sum(1 for ex in examples if term in ex['_terms'])
+                    idf = math.log(1 + (len(examples) - containing + 0.5) / (containing + 0.5))
+                    norm = frequency + self.K1 * (1 - self.B + self.B * example['_length'] / average_length)
+                    score += idf * frequency * (self.K1 + 1) / norm
+                if score > 0:
+                    ranked.append((score, example.get('uses', 1), example))
+            ranked.sort(key=lambda item: (item[0], item[1]), reverse=True)
+        candidates = [example for _, _, example in ranked] or [ex for ex in examples if ex.get('seed')]
+
+        selected = []
+        used = 0
+        for example in candidates:
+            if len(selected) >= k:
+                break
+            cost = count_tokens(format_examples([example], header=None))
+            if used + cost > token_budget:
+                continue
+            selected.append(example)
+            used += cost
+        return selected
+
+    def __len__(self):
+        with self._lock:
+            self._load()
+            return len(self._examples)
+
+# Shared by every session so one user's successful queries help the others
+EXAMPLE_STORE = ExampleStore()
@@ -0,0 +1,115 @@
+"""
+Streaming export of query results to CSV or Parquet files.
+
+Arrow record batches from BigQueryClient.stream_query are written to disk
+one at a time, so a multi-million-row export needs no more memory than a
+single page of results. Export files older than EXPORT_RETENTION_HOURS are
+removed whenever a new export starts.
+"""
+
+import os
+import time
+from datetime import datetime
+from config import Config
+from sql_rewriter import rewrite_for_cost
+from sql_utils import remove_limit
+
+EXPORT_FORMATS = {"csv": ".csv", "parquet": ".parquet"}
+
+def _open_writer(fmt, path, schema):
+    """Chunked writer for the chosen format"""
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+        return pq.ParquetWriter(path, schema, compression="snappy")
+    import pyarrow.csv as pacsv
+    return pacsv.CSVWriter(path, schema)
+
+def sweep_exports(directory=None, max_age_hours=None):
+    """Delete export files older than max_age_hours; returns how many were removed"""
+    directory = directory or Config.EXPORT_DIR
+    max_age_hours = Config.EXPORT_RETENTION_HOURS if max_age_hours is None else max_age_hours
+    if max_age_hours <= 0 or not os.path.isdir(directory):
+        return 0
+    cutoff = time.time() - max_age_hours * 3600
+    removed = 0
+    for entry in os.scandir(directory):
+        if not entry.name.startswith("export_") or not entry.is_file():
+            continue
+        try:
+            if entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+                removed += 1
+        except OSError:
+            pass
+    return removed
+
+def export_path(fmt, directory=None):
+    """New timestamped file name in the export directory"""
+    directory = directory or Config.EXPORT_DIR
+    os.makedirs(directory, exist_ok=True)
+    sweep_exports(directory)
+    return os.path.join(directory, f"export_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}{EXPORT_FORMATS[fmt]}")
+
+def write_batches(batches, fmt, path, on_progress=None):
+    """Write Arrow record batches to path; returns the number of rows written.
+
+    on_progress(rows_written) is called after every batch.
+    """
+    import pyarrow as pa
+
+    writer = None
+    rows = 0
+    try:
+        for batch in batches:
+            if writer is None:
+                writer = _open_writer(fmt, path, batch.schema)
+            if fmt == "parquet":
+                writer.write_table(pa.Table.from_batches([batch]))
+            else:
+                writer.write_batch(batch)
+            rows += batch.num_rows
+            if on_progress is not None:
+                on_progress(rows)
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        # No rows and no schema: still leave an (empty) file behind
+        open(path, "wb").close()
+    return rows
+
+def export_query(bq_client, sql, fmt="csv", table_schemas=None, full_result=True, on_progress=None):
+    """Run sql as a new job and stream its rows into a CSV or Parquet file.
+
+    With full_result the statement's own LIMIT is dropped, so the whole
+    result (up to EXPORT_MAX_ROWS rows) is exported. on_progress(rows, total)
+    is called as batches are written. Returns a dict with path, rows, bytes
+    and seconds, or raises on failure.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {fmt}")
+    if full_result:
+        sql = remove_limit(sql)
+    sql, _ = rewrite_for_cost(sql, table_schemas, max_results=Config.EXPORT_MAX_ROWS)
+
+    started = time.monotonic()
+    path = export_path(fmt)
+    stream = bq_client.stream_query(sql)
+    total = next(stream)
+    progress = (lambda rows: on_progress(rows, total)) if on_progress is not None else None
+    try:
+        rows = write_batches(stream, fmt, path, progress)
+    except Exception:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    finally:
+        stream.close()
+
+    return {
+        'path': path,
+        'format': fmt,
+        'rows': rows,
+        'bytes': os.path.getsize(path),
+        'seconds': time.monotonic() - started
+    }
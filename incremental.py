@@ -0,0 +1,196 @@
+"""
+Incremental refresh of saved queries grouped by a date dimension.
+
+A saved query such as "monthly customer metrics" groups its rows by a date
+bucket (a DATE/TIMESTAMP column or DATE_TRUNC of one). On refresh, only the
+latest stored bucket and anything newer is queried again, and those buckets
+replace the stored ones. Every bucket is recomputed in full, so averages and
+HAVING filters stay exact and refresh cost depends on the new data only.
+"""
+
+import re
+from datetime import datetime
+import pandas as pd
+from sql_utils import (
+    add_where_predicate, has_window, join_clauses, normalize_expression, parse_limit,
+    parse_order_item, parse_select_item, significant_tokens, split_clauses, split_table_reference,
+    split_top_level, table_name_from_path, output_names
+)
+
+_TRUNC_RE = re.compile(r"^(?:date|timestamp|datetime)_trunc\(([\w.`]+),\s*\w+\)$")
+_DATE_RE = re.compile(r"^(?:date|timestamp|datetime)\(([\w.`]+)\)$")
+_COLUMN_RE = re.compile(r"^[\w`]+(?:\.[\w`]+)?$")
+
+_DATE_TYPES = ("DATE", "DATETIME", "TIMESTAMP")
+
+# Functions whose value changes between runs: a window such as "the last 3 months"
+# moves, so buckets stored earlier would neither drop out nor fill up
+_VOLATILE_FUNCTIONS = {
+    "CURRENT_DATE", "CURRENT_DATETIME", "CURRENT_TIME", "CURRENT_TIMESTAMP",
+    "RAND", "GENERATE_UUID", "SESSION_USER"
+}
+
+def _column_type(column, table, table_schemas):
+    """Upper-case BigQuery type of a column, or None if unknown"""
+    for name, info in (table_schemas or {}).items():
+        if name.lower() == table.lower():
+            for col, col_type in info.get('columns', {}).items():
+                if col.lower() == column.lower():
+                    return str(col_type).upper()
+    return None
+
+def _date_source(expr):
+    """Underlying column of a date-bucket expression, or None"""
+    normalized = normalize_expression(expr)
+    for pattern in (_TRUNC_RE, _DATE_RE):
+        match = pattern.match(normalized)
+        if match:
+            return match.group(1)
+    if _COLUMN_RE.match(normalized):
+        return normalized
+    return None
+
+def _is_volatile(sql):
+    """True if the query calls a function whose value differs from run to run"""
+    return any(tok.value.upper() in _VOLATILE_FUNCTIONS for tok in significant_tokens(sql))
+
+def plan_incremental(sql, table_schemas=None):
+    """Describe how a query can be refreshed incrementally, or None if it cannot.
+
+    The query must be a single-table aggregate whose GROUP BY includes a
+    date dimension that is also an output column, without window functions
+    or functions such as CURRENT_DATE() that make its result depend on when it runs.
+    """
+    clauses = split_clauses(sql)
+    if not clauses or "group by" not in clauses or "from" not in clauses or has_window(sql) or _is_volatile(sql):
+        return None
+    reference = split_table_reference(clauses["from"])
+    if reference is None:
+        return None
+    table = table_name_from_path(reference[0])
+
+    items = [parse_select_item(item) for item in split_top_level(clauses["select"])]
+    names = output_names(items)
+    group_keys = [normalize_expression(key) for key in split_top_level(clauses["group by"])]
+
+    for position, ((expr, alias), name) in enumerate(zip(items, names), 1):
+        grouped = (normalize_expression(expr) in group_keys
+                   or (alias and alias.lower() in group_keys)
+                   or str(position) in group_keys)
+        source = _date_source(expr) if grouped else None
+        if not source:
+            continue
+        column = source.strip("`").split(".")[-1]
+        column_type = _column_type(column, table, table_schemas)
+        if column_type is None and not (column.lower() == "date" or column.lower().endswith("_date")):
+            continue
+        if column_type is not None and column_type not in _DATE_TYPES:
+            continue
+        limit, offset = parse_limit(clauses.get("limit"))
+        if offset:
+            return None
+        return {
+            'clauses': clauses,
+            'date_output': name,
+            'date_column': source,
+            'column_type': column_type or "DATE",
+            'limit': limit,
+            'order': [parse_order_item(item) for item in split_top_level(clauses.get("order by", ""))],
+            'names': names
+        }
+    return None
+
+def _literal(value, column_type):
+    """SQL literal for the high-water mark"""
+    value = pd.Timestamp(value)
+    if column_type == "DATE":
+        return f"DATE '{value:%Y-%m-%d}'"
+    if column_type == "DATETIME":
+        return f"DATETIME '{value:%Y-%m-%d %H:%M:%S}'"
+    if value.tzinfo is not None:
+        value = value.tz_convert("UTC").tz_localize(None)
+    return f"TIMESTAMP '{value:%Y-%m-%d %H:%M:%S}+00'"
+
+def high_water_mark(plan, stored_df):
+    """Latest date bucket in the stored result, or None"""
+    if stored_df is None or stored_df.empty or plan['date_output'] not in stored_df.columns:
+        return None
+    values = stored_df[plan['date_output']].dropna()
+    return values.max() if not values.empty else None
+
+def delta_sql(plan, hwm):
+    """The saved query restricted to the latest stored bucket and newer rows"""
+    clauses = dict(plan['clauses'])
+    clauses["where"] = add_where_predicate(
+        clauses.get("where"), f"{plan['date_column']} >= {_literal(hwm, plan['column_type'])}"
+    )
+    clauses.pop("limit", None)
+    return join_clauses(clauses)
+
+def _sort(plan, df):
+    """Apply the query's ORDER BY to a merged result; None if it cannot be mapped to columns"""
+    if not plan['order']:
+        return df.sort_values(plan['date_output'], kind="stable").reset_index(drop=True)
+    by, ascending = [], []
+    for expr, descending in plan['order']:
+        key = normalize_expression(expr)
+        if key.isdigit() and 0 < int(key) <= len(plan['names']):
+            column = plan['names'][int(key) - 1]
+        else:
+            column = next((name for name in plan['names'] if name.lower() == key.strip("`")), None)
+        if column is None or column not in df.columns:
+            return None
+        by.append(column)
+        ascending.append(not descending)
+    return df.sort_values(by, ascending=ascending, kind="stable").reset_index(drop=True)
+
+def merge_delta(plan, stored_df, delta_df, hwm):
+    """Replace the stored buckets from hwm onwards with the delta; None if the result must be rebuilt"""
+    column = plan['date_output']
+    if column not in delta_df.columns or list(delta_df.columns) != list(stored_df.columns):
+        return None
+    stored_dates = pd.to_datetime(stored_df[column], utc=True)
+    kept = stored_df[stored_dates < pd.to_datetime(pd.Series([hwm]), utc=True)[0]]
+    merged = pd.concat([kept, delta_df], ignore_index=True)
+    merged = _sort(plan, merged)
+    if merged is None:
+        return None
+    # A LIMIT that now cuts rows off would have kept a different set of rows
+    if plan['limit'] is not None and len(merged) > plan['limit']:
+        return None
+    return merged
+
+def refresh_saved_query(saved, bq_client, table_schemas=None):
+    """Refresh a saved query's stored result, incrementally when possible.
+
+    Updates saved['result'] and saved['refreshed_at'] and returns a dict
+    describing the refresh, or None if the query failed.
+    """
+    stored = saved.get('result')
+    plan = plan_incremental(saved['sql'], table_schemas)
+    hwm = high_water_mark(plan, stored) if plan else None
+
+    info = {'mode': 'full', 'full_bytes': bq_client.estimate_query_bytes(saved['sql'])}
+    if hwm is not None:
+        sql = delta_sql(plan, hwm)
+        delta_df = bq_client.execute_query(sql)
+        if delta_df is None:
+            return None
+        merged = merge_delta(plan, stored, delta_df, hwm)
+        if merged is not None:
+            info.update(
+                mode='incremental',
+                high_water_mark=hwm,
+                delta_rows=len(delta_df),
+                delta_bytes=bq_client.estimate_query_bytes(sql)
+            )
+            saved['result'] = merged
+            saved['refreshed_at'] = datetime.now()
+            return info
+
+    df = bq_client.execute_query(saved['sql'])
+    if df is None:
+        return None
+    saved['result'] = df
+    saved['refreshed_at'] = datetime.now()
+    return info
@@ -0,0 +1,302 @@
+"""
+Provider routing for LLM calls.
+
+Every call gets a per-attempt timeout and an overall deadline, failed attempts
+are retried with jittered exponential backoff, and each provider sits behind a
+circuit breaker so a failing provider is skipped instead of being waited on.
+In hedged mode a second request goes to the other provider once the primary
+has been slower than its recent p95, and whichever answer arrives first wins.
+"""
+
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, TimeoutError as FutureTimeout
+from config import Config
+
+class LLMUnavailableError(Exception):
+    """Raised when no provider produced an answer before the deadline"""
+
+class ProviderBusyError(Exception):
+    """Raised when every worker of a provider is still busy with earlier (possibly abandoned) calls"""
+
+class ProviderStats:
+    """Rolling latency and outcome counters for one provider"""
+
+    def __init__(self, window=200):
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.successes = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.hedges_won = 0
+
+    def record_success(self, latency):
+        with self._lock:
+            self._latencies.append(latency)
+            self.successes += 1
+
+    def record_failure(self, timed_out=False):
+        with self._lock:
+            self.failures += 1
+            if timed_out:
+                self.timeouts += 1
+
+    def record_hedge_won(self):
+        with self._lock:
+            self.hedges_won += 1
+
+    def percentile(self, pct):
+        """Latency percentile in seconds, or None without samples"""
+        with self._lock:
+            samples = sorted(self._latencies)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(round(pct / 100 * (len(samples) - 1))))
+        return samples[index]
+
+    def snapshot(self):
+        return {
+            'successes': self.successes,
+            'failures': self.failures,
+            'timeouts': self.timeouts,
+            'hedges_won': self.hedges_won,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'samples': len(self._latencies)
+        }
+
+class CircuitBreaker:
+    """Opens after consecutive failures; after a cool-down calls are let through again"""
+
+    def __init__(self, failure_threshold=None, reset_timeout=None):
+        self.failure_threshold = failure_threshold or Config.LLM_CIRCUIT_FAILURE_THRESHOLD
+        self.reset_timeout = reset_timeout or Config.LLM_CIRCUIT_RESET_SECONDS
+        self._lock = threading.Lock()
+        self._consecutive_failures = 0
+        self._opened_at = None
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return "half-open"
+            return "open"
+
+    def allow(self):
+        """True if a call may be attempted now"""
+        return self.state != "open"
+
+    def record_success(self):
+        with self._lock:
+            self._consecutive_failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        # In half-open state the count is still over the threshold, so one
+        # failed probe re-opens the circuit
+        with self._lock:
+            self._consecutive_failures += 1
+            if self._consecutive_failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+class _Outcome:
+    """Makes sure one provider call is counted once: by whoever settles it first"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._settled = False
+
+    def settle(self):
+        """True for the first caller only"""
+        with self._lock:
+            if self._settled:
+                return False
+            self._settled = True
+            return True
+
+# Stats, breakers and worker pools are process-wide so every session benefits from them.
+# Each provider has its own bounded pool: calls that timed out keep running until the
+# provider returns, and a slow provider must not take the workers of the other one.
+_STATS = {}
+_BREAKERS = {}
+_POOLS = {}
+_REGISTRY_LOCK = threading.Lock()
+
+def _provider_state(name):
+    with _REGISTRY_LOCK:
+        if name not in _STATS:
+            _STATS[name] = ProviderStats()
+            _BREAKERS[name] = CircuitBreaker()
+        return _STATS[name], _BREAKERS[name]
+
+def _provider_pool(name):
+    """(executor, free worker slots) of a provider"""
+    with _REGISTRY_LOCK:
+        if name not in _POOLS:
+            workers = Config.LLM_PROVIDER_WORKERS
+            _POOLS[name] = (
+                ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"llm-{name}"),
+                threading.BoundedSemaphore(workers)
+            )
+        return _POOLS[name]
+
+def provider_stats():
+    """Latency, outcome and circuit state for every provider seen so far"""
+    with _REGISTRY_LOCK:
+        names = list(_STATS)
+    result = {}
+    for name in names:
+        stats, breaker = _provider_state(name)
+        result[name] = dict(stats.snapshot(), circuit=breaker.state)
+    return result
+
+class LLMRouter:
+    """Routes a prompt to one of several providers with retries, deadlines and hedging"""
+
+    def __init__(self, providers, primary):
+        """providers maps a name to a callable taking the prompt inputs dict and returning text"""
+        self.providers = providers
+        self.primary = primary
+
+    def _order(self):
+        names = [self.primary] + [name for name in self.providers if name != self.primary]
+        return names if Config.LLM_FAILOVER else names[:1]
+
+    def _call(self, name, inputs, outcome):
+        """Run one provider call and record its outcome, unless it was already counted as timed out"""
+        stats, breaker = _provider_state(name)
+        started = time.monotonic()
+        try:
+            result = self.providers[name](inputs)
+        except Exception:
+            if outcome.settle():
+                stats.record_failure()
+                breaker.record_failure()
+            raise
+        if outcome.settle():
+            stats.record_success(time.monotonic() - started)
+            breaker.record_success()
+        return result
+
+    def _submit(self, name, inputs, outcome):
+        """Start a call on the provider's pool; raises ProviderBusyError instead of queueing behind busy workers"""
+        executor, slots = _provider_pool(name)
+        if not slots.acquire(blocking=False):
+            raise ProviderBusyError(f"All {Config.LLM_PROVIDER_WORKERS} workers for {name} are busy")
+
+        def run():
+            try:
+                return self._call(name, inputs, outcome)
+            finally:
+                slots.release()
+
+        try:
+            return executor.submit(run)
+        except Exception:
+            slots.release()
+            raise
+
+    @staticmethod
+    def _timed_out(name, outcome):
+        """Count an abandoned call as a timeout; its late result is then ignored"""
+        if outcome.settle():
+            stats, breaker = _provider_state(name)
+            stats.record_failure(timed_out=True)
+            breaker.record_failure()
+
+    def _attempt(self, name, inputs, deadline):
+        """One attempt bounded by the per-call timeout and the overall deadline; returns (answer, name)"""
+        timeout = min(Config.LLM_TIMEOUT, deadline - time.monotonic())
+        if timeout <= 0:
+            raise FutureTimeout()
+        outcome = _Outcome()
+        future = self._submit(name, inputs, outcome)
+        try:
+            return future.result(timeout=timeout), name
+        except FutureTimeout:
+            self._timed_out(name, outcome)
+            raise
+
+    def invoke(self, inputs, deadline=None):
+        """Return (answer, provider) for the first successful answer, raising LLMUnavailableError otherwise.
+
+        provider is the name of the provider that answered, which after a
+        failover or a hedge is not the primary. deadline is an optional
+        time.monotonic() value the caller must be answered by.
+        """
+        own_deadline = time.monotonic() + Config.LLM_DEADLINE
+        deadline = min(own_deadline, deadline) if deadline is not None else own_deadline
+        order = [name for name in self._order() if _provider_state(name)[1].allow()]
+        if not order:
+            raise LLMUnavailableError("All LLM providers are temporarily disabled after repeated failures")
+
+        if Config.LLM_HEDGE and len(order) > 1:
+            try:
+                return self._hedged(order[0], order[1], inputs, deadline)
+            except Exception as e:
+                last_error = e
+        else:
+            last_error = None
+            for name in order:
+                for attempt in range(Config.LLM_MAX_RETRIES + 1):
+                    if time.monotonic() >= deadline or not _provider_state(name)[1].allow():
+                        break
+                    try:
+                        return self._attempt(name, inputs, deadline)
+                    except Exception as e:
+                        last_error = e
+                    if attempt < Config.LLM_MAX_RETRIES:
+                        # Full jitter keeps retries from many sessions from synchronising
+                        backoff = Config.LLM_RETRY_BASE_DELAY * (2 ** attempt)
+                        time.sleep(min(random.uniform(0, backoff), max(deadline - time.monotonic(), 0)))
+
+        if isinstance(last_error, FutureTimeout):
+            raise LLMUnavailableError("No LLM answer before the deadline")
+        raise LLMUnavailableError(f"All LLM providers failed: {last_error}")
+
+    def _hedged(self, primary, secondary, inputs, deadline):
+        """Send to primary; after its p95 latency also send to secondary; returns the first (answer, name).
+
+        If the primary fails (or is busy) before then, the secondary is asked
+        at once; that is a failover, not a hedge, and does not count as a hedge won.
+        """
+        stats, _ = _provider_state(primary)
+        hedge_delay = stats.percentile(95) or Config.LLM_HEDGE_DELAY
+        outcomes = {primary: _Outcome(), secondary: _Outcome()}
+        futures = {}
+        last_error = None
+        hedged = False
+        try:
+            futures[self._submit(primary, inputs, outcomes[primary])] = primary
+            done, _ = wait(futures, timeout=min(hedge_delay, max(deadline - time.monotonic(), 0)))
+            # The primary is still running once the delay has passed
+            hedged = not done
+            send_secondary = hedged or next(iter(done)).exception() is not None
+        except ProviderBusyError as e:
+            last_error = e
+            send_secondary = True
+        if send_secondary:
+            try:
+                futures[self._submit(secondary, inputs, outcomes[secondary])] = secondary
+            except ProviderBusyError as e:
+                last_error = e
+
+        pending = set(futures)
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if hedged and futures[future] == secondary:
+                        _provider_state(secondary)[0].record_hedge_won()
+                    return future.result(), futures[future]
+                last_error = future.exception()
+        for future in pending:
+            self._timed_out(futures[future], outcomes[futures[future]])
+        raise last_error or FutureTimeout()
@@ -0,0 +1,413 @@
+"""
+Answer follow-up queries from an earlier cached result.
+
+Many follow-up questions ("only the top 5", "sort by ROAS", "just Q3") produce
+SQL that reads the same source as a query whose result is already cached,
+adding a filter, projection, sort, limit or a coarser GROUP BY. Those queries
+are evaluated here with pandas' vectorized operations instead of starting a
+new BigQuery job.
+"""
+
+import re
+from datetime import date
+import pandas as pd
+from sqlparse import tokens as T
+from sql_utils import (
+    split_clauses, split_top_level, split_conjuncts, parse_select_item,
+    parse_order_item, parse_limit, parse_aggregate, normalize_expression,
+    output_names, has_aggregate, has_window, significant_tokens
+)
+
+class CannotAnswerLocally(Exception):
+    """Raised when a query cannot be derived from a cached result"""
+
+
+def answer_from_cache(sql, result_cache):
+    """Try to answer a query from cached results.
+
+    Returns (DataFrame, source_sql) when one of the cached results can produce
+    the answer exactly, otherwise None.
+    """
+    exact = result_cache.get(sql)
+    if exact is not None:
+        return exact['df'], exact['sql']
+
+    new = split_clauses(sql)
+    if not new:
+        return None
+
+    for entry in result_cache.entries():
+        try:
+            df = derive_result(new, entry['sql'], entry['df'])
+        except (CannotAnswerLocally, KeyError, ValueError, TypeError):
+            continue
+        return df, entry['sql']
+    return None
+
+
+def derive_result(new, cached_sql, cached_df):
+    """Evaluate the parsed query `new` over the result of `cached_sql`"""
+    old = split_clauses(cached_sql)
+    if not old:
+        raise CannotAnswerLocally("cached query is not a simple SELECT")
+    if normalize_expression(old.get('from', '')) != normalize_expression(new.get('from', '')):
+        raise CannotAnswerLocally("different source")
+    for clauses in (old, new):
+        select = clauses['select']
+        if select.upper().startswith("DISTINCT") or clauses.get('qualify') or has_window(select):
+            raise CannotAnswerLocally("DISTINCT, QUALIFY and window functions are not supported")
+
+    old_items = _select_items(old)
+    new_items = _select_items(new)
+    outputs = _output_map(old_items, cached_df)
+
+    old_aggregated = bool(old.get('group by')) or has_aggregate(old['select'])
+    new_aggregated = bool(new.get('group by')) or has_aggregate(new['select'])
+    old_group = _group_keys(old, old_items)
+    new_group = _group_keys(new, new_items)
+
+    # WHERE: the cached filters must all still apply; extra terms become local filters
+    old_where = {normalize_expression(term) for term in split_conjuncts(old.get('where'))}
+    new_where = split_conjuncts(new.get('where'))
+    if not old_where <= {normalize_expression(term) for term in new_where}:
+        raise CannotAnswerLocally("cached result is filtered more narrowly")
+    extra_filters = [term for term in new_where if normalize_expression(term) not in old_where]
+
+    old_having = {normalize_expression(term) for term in split_conjuncts(old.get('having'))}
+    new_having = split_conjuncts(new.get('having'))
+    if not old_having <= {normalize_expression(term) for term in new_having}:
+        raise CannotAnswerLocally("cached result has a different HAVING")
+    extra_having = [term for term in new_having if normalize_expression(term) not in old_having]
+
+    if old_aggregated:
+        if not new_aggregated:
+            raise CannotAnswerLocally("row-level query over an aggregated result")
+        same_grain = set(new_group) == set(old_group)
+        if not same_grain:
+            if not set(new_group) < set(old_group) or old_having or extra_having:
+                raise CannotAnswerLocally("GROUP BY is not a coarser grain of the cached one")
+        # Row filters on an aggregated result are only exact on group keys
+        group_columns = {outputs.get(key) for key in old_group}
+        for term in extra_filters:
+            if _resolve(_predicate_subject(term), outputs) not in group_columns:
+                raise CannotAnswerLocally("filter on a non-grouping column")
+    else:
+        same_grain = not new_aggregated
+        if old.get('having') or new.get('having'):
+            raise CannotAnswerLocally("HAVING without aggregation")
+
+    # A LIMIT-ed cached result is only complete for the same ordering and a smaller LIMIT
+    old_limit, old_offset = parse_limit(old.get('limit'))
+    new_limit, new_offset = parse_limit(new.get('limit'))
+    if new.get('limit') and new_limit is None:
+        raise CannotAnswerLocally("unsupported LIMIT")
+    if old.get('limit'):
+        if (old_limit is None or old_offset or new_limit is None or extra_filters or extra_having
+                or not same_grain or new_limit + new_offset > old_limit
+                or normalize_expression(old.get('order by', '')) != normalize_expression(new.get('order by', ''))):
+            raise CannotAnswerLocally("cached result was truncated by LIMIT")
+
+    frame = cached_df
+    conditions = extra_filters + (extra_having if same_grain else [])
+    if conditions:
+        mask = pd.Series(True, index=frame.index)
+        for term in conditions:
+            mask &= _predicate_mask(term, frame, outputs)
+        frame = frame[mask]
+
+    if same_grain:
+        result = _project(new_items, frame, outputs, old)
+    elif old_aggregated:
+        result = _regroup(new_items, new_group, frame, outputs)
+    else:
+        result = _aggregate_rows(new_items, new_group, frame, outputs)
+
+    result = _order(new, new_items, result)
+    if new_limit is not None:
+        result = result.iloc[new_offset:new_offset + new_limit]
+    return result.reset_index(drop=True)
+
+
+def _select_items(clauses):
+    """Parse the select list into (expression, alias) pairs"""
+    return [parse_select_item(item) for item in split_top_level(clauses['select'])]
+
+
+def _output_map(items, df):
+    """Map normalized select expressions of the cached query to result columns"""
+    columns = list(df.columns)
+    outputs = {}
+    if len(items) == 1 and items[0][0] == "*":
+        for column in columns:
+            outputs[normalize_expression(str(column))] = column
+        return outputs
+    if any(expr == "*" or expr.endswith(".*") for expr, _ in items) or len(items) != len(columns):
+        raise CannotAnswerLocally("cannot line up cached columns with the select list")
+    for (expr, alias), column in zip(items, columns):
+        outputs[normalize_expression(expr)] = column
+        # A qualified column "t.col" is also referred to as plain "col"
+        bare = normalize_expression(expr).split(".")[-1]
+        if re.fullmatch(r"[\w`]+", bare):
+            outputs.setdefault(bare, column)
+    return outputs
+
+
+def _group_keys(clauses, items):
+    """Normalized GROUP BY expressions with ordinals and aliases expanded"""
+    keys = []
+    aliases = {alias.lower(): expr for expr, alias in items if alias}
+    for key in split_top_level(clauses.get('group by', '')):
+        if key.isdigit():
+            key = items[int(key) - 1][0]
+        elif key.strip("`").lower() in aliases:
+            key = aliases[key.strip("`").lower()]
+        keys.append(normalize_expression(key))
+    return keys
+
+
+def _resolve(expr, outputs):
+    """Return the cached column holding an expression"""
+    column = outputs.get(normalize_expression(expr))
+    if column is None:
+        raise CannotAnswerLocally(f"'{expr}' is not available in the cached result")
+    return column
+
+
+def _project(items, frame, outputs, old):
+    """Select and rename columns for a query at the cached grain"""
+    old_items = _select_items(old)
+    data = {}
+    for (expr, alias), name in zip(items, output_names(items)):
+        if expr == "*":
+            if not (len(old_items) == 1 and old_items[0][0] == "*"):
+                raise CannotAnswerLocally("SELECT * needs a cached SELECT *")
+            for column in frame.columns:
+                data[column] = frame[column]
+            continue
+        column = _resolve(expr, outputs)
+        data[name] = frame[column]
+    return pd.DataFrame(data, index=frame.index)
+
+
+def _regroup(items, keys, frame, outputs):
+    """Re-aggregate an aggregated cached result to a coarser grain"""
+    # Partial counts are never NULL, so their total is 0 (not NULL) over no rows
+    combine = {"SUM": "sum", "COUNT": "count_total", "MIN": "min", "MAX": "max"}
+    key_columns = [outputs[key] for key in keys]
+    specs = []
+    for (expr, alias), name in zip(items, output_names(items)):
+        normalized = normalize_expression(expr)
+        if normalized in keys:
+            specs.append((name, outputs[normalized], None))
+            continue
+        aggregate = parse_aggregate(expr)
+        if not aggregate or aggregate[0] not in combine or aggregate[1].upper().startswith("DISTINCT"):
+            raise CannotAnswerLocally(f"'{expr}' cannot be re-aggregated")
+        column = _resolve(expr, outputs)
+        specs.append((name, column, combine[aggregate[0]]))
+    return _run_aggregation(frame, key_columns, specs)
+
+
+def _aggregate_rows(items, keys, frame, outputs):
+    """Aggregate a row-level cached result"""
+    functions = {"SUM": "sum", "COUNT": "count", "MIN": "min", "MAX": "max", "AVG": "mean"}
+    key_columns = [_resolve(key, outputs) for key in keys]
+    specs = []
+    for (expr, alias), name in zip(items, output_names(items)):
+        normalized = normalize_expression(expr)
+        if normalized in keys:
+            column = _resolve(expr, outputs)
+            specs.append((name, column, None))
+            continue
+        aggregate = parse_aggregate(expr)
+        if not aggregate:
+            raise CannotAnswerLocally(f"'{expr}' is neither a grouping key nor an aggregate")
+        function, argument = aggregate
+        if function == "COUNT" and argument == "*":
+            specs.append((name, None, "size"))
+        elif function == "COUNT" and argument.upper().startswith("DISTINCT "):
+            column = _resolve(argument[len("DISTINCT "):], outputs)
+            specs.append((name, column, "nunique"))
+        else:
+            column = _resolve(argument, outputs)
+            specs.append((name, column, functions[function]))
+    return _run_aggregation(frame, key_columns, specs)
+
+
+def _run_aggregation(frame, key_columns, specs):
+    """Group the frame and compute each (name, column, function) spec"""
+    if key_columns:
+        grouped = frame.groupby(key_columns, dropna=False, sort=False)
+        keys_frame = grouped.size().reset_index()[key_columns]
+    else:
+        grouped = None
+        keys_frame = pd.DataFrame(index=[0])
+
+    data = {}
+    for name, column, function in specs:
+        if function is None:
+            data[name] = keys_frame[column].to_numpy()
+        elif function == "size":
+            data[name] = [len(frame)] if grouped is None else grouped.size().to_numpy()
+        else:
+            source = frame[column] if grouped is None else grouped[column]
+            if function == "sum":
+                # SQL's SUM is NULL, not 0, when there is no non-NULL value
+                value = source.sum(min_count=1)
+            elif function == "count_total":
+                value = source.sum()
+            else:
+                value = source.agg(function)
+            data[name] = [value] if grouped is None else value.to_numpy()
+    return pd.DataFrame(data)
+
+
+def _order(new, items, result):
+    """Apply the ORDER BY clause against the output columns"""
+    order_by = new.get('order by')
+    if not order_by:
+        return result
+    by_expr = {}
+    names = list(result.columns)
+    for (expr, alias), name in zip(items, names):
+        by_expr[normalize_expression(expr)] = name
+    by_name = {str(name).lower(): name for name in names}
+
+    columns, ascending = [], []
+    for item in split_top_level(order_by):
+        expr, descending = parse_order_item(item)
+        if expr.isdigit():
+            column = names[int(expr) - 1]
+        elif expr.strip("`").lower() in by_name:
+            column = by_name[expr.strip("`").lower()]
+        elif normalize_expression(expr) in by_expr:
+            column = by_expr[normalize_expression(expr)]
+        else:
+            raise CannotAnswerLocally(f"cannot order by '{expr}'")
+        columns.append(column)
+        ascending.append(not descending)
+    # BigQuery sorts NULLs first ascending and last descending
+    return result.sort_values(columns, ascending=ascending, kind="stable",
+                              na_position="first" if ascending[0] else "last")
+
+
+def _predicate_subject(term):
+    """Left-hand expression of a simple predicate"""
+    tokens = significant_tokens(term)
+    index = _operator_index(tokens)
+    return " ".join(tok.value for tok in tokens[:index])
+
+
+def _operator_index(tokens):
+    """Index of the top-level operator of a simple predicate"""
+    depth = 0
+    for index, tok in enumerate(tokens):
+        if tok.ttype is T.Punctuation and tok.value == "(":
+            depth += 1
+        elif tok.ttype is T.Punctuation and tok.value == ")":
+            depth -= 1
+        elif depth == 0 and (tok.ttype in T.Operator.Comparison
+                             or (tok.is_keyword and tok.normalized in ("IN", "NOT", "BETWEEN", "IS", "LIKE"))):
+            return index
+    raise CannotAnswerLocally("not a simple predicate")
+
+
+def _predicate_mask(term, frame, outputs):
+    """Evaluate a simple predicate over the cached frame as a boolean mask"""
+    tokens = significant_tokens(term)
+    index = _operator_index(tokens)
+    series = frame[_resolve(" ".join(tok.value for tok in tokens[:index]), outputs)]
+    rest = tokens[index:]
+
+    negate = False
+    if rest[0].is_keyword and rest[0].normalized == "NOT":
+        negate = True
+        rest = rest[1:]
+    operator = " ".join(rest[0].normalized.upper().split())
+    operands = rest[1:]
+    # sqlparse reads "NOT LIKE" as a single comparison operator
+    if operator == "NOT LIKE":
+        negate = True
+        operator = "LIKE"
+
+    if operator == "IS":
+        keyword = " ".join(tok.normalized for tok in operands)
+        if keyword not in ("NULL", "NOT NULL"):
+            raise CannotAnswerLocally("unsupported IS predicate")
+        mask = series.isna() if keyword == "NULL" else series.notna()
+    elif operator == "NOT NULL":
+        mask = series.notna()
+    elif operator == "IN":
+        text = "".join(tok.value for tok in operands).strip()
+        if not (text.startswith("(") and text.endswith(")")):
+            raise CannotAnswerLocally("IN needs a literal list")
+        values = [_literal(significant_tokens(item), series) for item in split_top_level(text[1:-1])]
+        mask = series.isin(values)
+    elif operator == "BETWEEN":
+        bounds = " ".join(tok.value for tok in operands)
+        parts = re.split(r"\s+AND\s+", bounds, maxsplit=1, flags=re.IGNORECASE)
+        if len(parts) != 2:
+            raise CannotAnswerLocally("malformed BETWEEN")
+        low = _literal(significant_tokens(parts[0]), series)
+        high = _literal(significant_tokens(parts[1]), series)
+        mask = (series >= low) & (series <= high)
+    elif operator == "LIKE":
+        pattern = _literal(operands, None)
+        regex = "^" + re.escape(pattern).replace("%", ".*").replace("_", ".") + "$"
+        mask = series.astype("string").str.match(regex, na=False).astype(bool)
+    else:
+        value = _literal(operands, series)
+        comparisons = {
+            "=": series.eq, "!=": series.ne, "<>": series.ne, "<": series.lt,
+            "<=": series.le, ">": series.gt, ">=": series.ge
+        }
+        if operator not in comparisons:
+            raise CannotAnswerLocally(f"unsupported operator {operator}")
+        mask = comparisons[operator](value)
+        # SQL comparisons with NULL are never true
+        mask &= series.notna()
+
+    mask = mask.fillna(False).astype(bool)
+    # NOT IN / NOT LIKE / NOT BETWEEN on a NULL is NULL, which filters the row out
+    return (~mask & series.notna()) if negate else mask
+
+
+def _literal(tokens, series):
+    """Convert literal tokens into a Python value comparable with the series"""
+    tokens = list(tokens)
+    typed = None
+    if len(tokens) == 2 and tokens[0].normalized.upper() in ("DATE", "DATETIME", "TIMESTAMP") and tokens[1].ttype in T.String:
+        typed = tokens[0].normalized.upper()
+        tokens = tokens[1:]
+    sign = 1
+    if len(tokens) == 2 and tokens[0].value == "-" and tokens[1].ttype in T.Number:
+        sign = -1
+        tokens = tokens[1:]
+    if len(tokens) != 1:
+        raise CannotAnswerLocally("expected a literal value")
+
+    tok = tokens[0]
+    if tok.ttype in T.Number.Integer:
+        return sign * int(tok.value)
+    if tok.ttype in T.Number:
+        return sign * float(tok.value)
+    if tok.is_keyword and tok.normalized in ("TRUE", "FALSE"):
+        return tok.normalized == "TRUE"
+    if tok.ttype not in T.String:
+        raise CannotAnswerLocally("expected a literal value")
+
+    text = tok.value[1:-1].replace("\\'", "'")
+    if series is None:
+        return text
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        value = pd.Timestamp(text)
+        tz = getattr(series.dtype, "tz", None)
+        if tz is not None and value.tzinfo is None:
+            value = value.tz_localize(tz)
+        return value
+    sample = series.dropna()
+    if typed == "DATE" or (len(sample) and isinstance(sample.iloc[0], date)):
+        return date.fromisoformat(text[:10])
+    if pd.api.types.is_numeric_dtype(series.dtype):
+        return float(text)
+    return text
@@ -0,0 +1,357 @@
+"""
+Per-session question → SQL → validated → executing → result pipeline.
+
+Streamlit reruns the whole script on every widget interaction, so each stage's
+output is kept in a QueryPipeline stored in session state. A stage only runs
+again when its inputs change; otherwise the previous output is reused.
+"""
+
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+from config import Config
+from example_store import EXAMPLE_STORE
+from local_answer import answer_from_cache
+from result_cache import SHARED_RESULT_CACHE
+from sampling import sample_query
+from schema_catalog import schema_fingerprint
+from sql_rewriter import reduces_scan, rewrite_for_cost
+from sql_validator import validate_sql
+from templates import TEMPLATE_STORE, parameterize, question_literals
+from tracing import TRACE_WRITER, Trace, pipeline_outcome
+from usage import usage_context
+
+IDLE = "idle"
+QUESTION = "question"
+SQL = "sql"
+VALIDATED = "validated"
+EXECUTING = "executing"
+RESULT = "result"
+FAILED = "failed"
+
+class QueryPipeline:
+    """State machine holding the output of each pipeline stage"""
+
+    def __init__(self):
+        self.trace = None
+        self.reset()
+
+    def reset(self):
+        """Forget every stage"""
+        # A run abandoned part-way is still recorded as far as it got
+        self._finish_trace(final=True)
+        self.stage = IDLE
+        self.question = None
+        self.sql = None
+        self.sql_inputs = None
+        self.validation = None
+        self.result = None
+        self.result_sql = None
+        self.execution_info = {}
+        self.error = None
+        self.failed_stage = None
+        self.repair_info = None
+        self.template = None
+        self.updated_at = None
+
+    def _advance(self, stage):
+        self.stage = stage
+        self.updated_at = datetime.now()
+
+    def _trace_stage(self, name, table_schemas=None):
+        """Record a stage into this run's trace, started on first use; does nothing unless TRACE_ENABLED"""
+        if not Config.TRACE_ENABLED:
+            return nullcontext()
+        if self.trace is None:
+            self.trace = Trace(self.question, table_schemas)
+        elif self.trace.table_schemas is None:
+            self.trace.table_schemas = table_schemas
+        return self.trace.stage(name)
+
+    def _finish_trace(self, final=False):
+        """Write the trace once the run has a result or failed (with final, wherever it stopped)"""
+        if self.trace is None or not (final or self.stage in (RESULT, FAILED)):
+            return
+        self.trace.update(**pipeline_outcome(self))
+        TRACE_WRITER.write(self.trace)
+        self.trace = None
+
+    def _fail(self, stage, error):
+        """Record which stage failed and why"""
+        self.error = error
+        self.failed_stage = stage
+        self._advance(FAILED)
+
+    def set_question(self, question):
+        """Record the question; downstream stages are dropped if it changed"""
+        question = (question or "").strip()
+        if question == self.question:
+            return False
+        self.reset()
+        self.question = question
+        self._advance(QUESTION)
+        return True
+
+    def set_sql(self, sql, inputs=None):
+        """Replace the SQL (generated or edited); validation and results are dropped"""
+        if sql == self.sql:
+            return
+        self.sql = sql
+        self.sql_inputs = inputs
+        self.validation = None
+        self.result = None
+        self.result_sql = None
+        self.execution_info = {}
+        self.error = None
+        self.failed_stage = None
+        self.repair_info = None
+        self.template = None
+        self._advance(SQL)
+
+    def generate(self, text2sql, table_schemas, sample_queries="", force=False):
+        """Generate SQL for the current question unless it is already up to date.
+
+        A question that differs from an earlier one only in its values fills in
+        that question's query template instead of calling the LLM.
+        """
+        if not self.question:
+            return None
+        inputs = (self.question, schema_fingerprint(table_schemas))
+        if self.sql and self.sql_inputs == inputs and not force:
+            return self.sql
+
+        with self._trace_stage("generate", table_schemas), usage_context(self.question):
+            template = TEMPLATE_STORE.match(self.question, inputs[1]) if Config.QUERY_TEMPLATES and not force else None
+            if template is not None:
+                sql = template['sql']
+            else:
+                sql = text2sql.generate_sql(self.question, table_schemas, sample_queries, use_cache=not force)
+        if self.trace is not None:
+            self.trace.update(sample_queries=sample_queries, generated_sql=sql)
+        if not sql:
+            self._fail(SQL, "SQL generation failed")
+            self._finish_trace()
+            return None
+        self.set_sql(sql, inputs)
+        self.template = template
+        return sql
+
+    def check(self, table_schemas=None):
+        """Run the local static checks; a missing LIMIT is added to the SQL in place.
+
+        Returns False (and fails the validation stage) when the SQL is rejected.
+        """
+        is_valid, message, checked_sql = validate_sql(self.sql, table_schemas)
+        if not is_valid:
+            self.validation = (False, message)
+            self._fail(VALIDATED, message)
+            return False
+        self.sql = checked_sql
+        return True
+
+    def repair(self, text2sql, bq_client, table_schemas=None):
+        """Let the LLM fix the failed SQL; on success the repaired SQL becomes current and validated"""
+        if not (Config.SQL_AUTO_REPAIR and text2sql is not None and self.question and self.sql and self.error):
+            return False
+
+        def check(sql):
+            is_valid, message, sql = validate_sql(sql, table_schemas)
+            if is_valid:
+                is_valid, message = bq_client.validate_query(sql)
+            return is_valid, message, sql
+
+        failed_sql, error = self.sql, self.error
+        with usage_context(self.question):
+            repaired = text2sql.repair_sql(self.question, failed_sql, error, table_schemas, check)
+        if repaired is None:
+            return False
+        self.set_sql(repaired, self.sql_inputs)
+        self.validation = (True, "Query is valid")
+        self._advance(VALIDATED)
+        self.repair_info = {'original_sql': failed_sql, 'error': error}
+        return True
+
+    def validate(self, bq_client, table_schemas=None, text2sql=None, force=False):
+        """Check the current SQL locally, then dry-run it once; the verdict is kept until the SQL changes"""
+        if not self.sql:
+            return None
+        if self.validation is not None and not force:
+            return self.validation
+
+        with self._trace_stage("validate", table_schemas):
+            self._validate(bq_client, table_schemas, text2sql)
+        self._finish_trace()
+        return self.validation
+
+    def _validate(self, bq_client, table_schemas, text2sql):
+        # Obviously broken or unsafe SQL never reaches BigQuery
+        if self.check(table_schemas):
+            is_valid, message = bq_client.validate_query(self.sql)
+            self.validation = (is_valid, message)
+            if is_valid:
+                if self.stage == SQL:
+                    self._advance(VALIDATED)
+                return
+            self._fail(VALIDATED, message)
+
+        self.repair(text2sql, bq_client, table_schemas)
+
+    def execute(self, bq_client, result_cache=None, rollup_router=None, table_schemas=None,
+                text2sql=None, force=False, sample_percent=None, on_preview=None, on_wait=None):
+        """Run the current SQL and keep its result.
+
+        Returns True if a new result was produced, False if the existing result
+        was reused or execution failed. With text2sql, failed SQL is repaired
+        and run once more. With sample_percent, a query that would run on
+        BigQuery runs as an approximate preview on a sample of its table.
+        on_preview and on_wait are handed to BigQueryClient.execute_query for
+        full scans, to show early rows and progress while the job runs.
+        """
+        if not self.sql:
+            return False
+        # An exact result also answers a preview; a preview does not answer an exact run
+        if self.result is not None and self.result_sql == self.sql and not force \
+                and (sample_percent or not self.is_preview):
+            return False
+
+        with self._trace_stage("execute", table_schemas):
+            executed = self._execute(
+                bq_client, result_cache, rollup_router, table_schemas, text2sql, force, sample_percent,
+                on_preview, on_wait
+            )
+        self._finish_trace()
+        return executed
+
+    @property
+    def is_preview(self):
+        """True if the current result is an approximate sampled preview"""
+        return self.execution_info.get('source') == 'sample'
+
+    def _execute(self, bq_client, result_cache, rollup_router, table_schemas, text2sql, force, sample_percent=None,
+                 on_preview=None, on_wait=None):
+        if self.validation is None:
+            if not self.check(table_schemas) and not self.repair(text2sql, bq_client, table_schemas):
+                return False
+        elif not self.validation[0]:
+            # Rejected by validate() (which already tried a repair); never sent to BigQuery
+            self._fail(VALIDATED, self.validation[1])
+            return False
+
+        self._advance(EXECUTING)
+        info = {'source': 'bigquery'}
+
+        # Partition filters, column pruning and LIMIT enforcement
+        run_sql = self.sql
+        if Config.ENABLE_COST_REWRITE:
+            run_sql, changes = rewrite_for_cost(self.sql, table_schemas)
+            if changes:
+                info['rewrite'] = {'sql': run_sql, 'changes': changes}
+
+        # Follow-ups that refine a cached result are answered locally
+        cached = answer_from_cache(run_sql, result_cache) if result_cache is not None and not force else None
+        # Results another session or the pre-warmer fetched recently
+        shared = None
+        if cached is None and not force:
+            shared = SHARED_RESULT_CACHE.get(run_sql, timedelta(hours=Config.SHARED_RESULT_MAX_AGE_HOURS))
+        if cached is not None:
+            df, info['source_sql'] = cached
+            info['source'] = 'local'
+        elif shared is not None:
+            df = shared['df']
+            info['source'] = 'shared'
+            info['fetched_at'] = shared['timestamp']
+            if result_cache is not None:
+                result_cache.put(run_sql, df)
+        else:
+            # Two dry runs only when the rewrite can scan less; a LIMIT alone never does
+            if 'rewrite' in info and reduces_scan(info['rewrite']['changes']):
+                info['rewrite']['original_bytes'] = bq_client.estimate_query_bytes(self.sql)
+                info['rewrite']['rewritten_bytes'] = bq_client.estimate_query_bytes(run_sql)
+            execute_sql = run_sql
+            if rollup_router is not None and Config.ENABLE_ROLLUP_ROUTING:
+                routing = rollup_router.route(run_sql)
+                if routing['routed']:
+                    execute_sql = routing['sql']
+                    info['source'] = 'rollup'
+                    info['routing'] = routing
+            # Cached and rollup answers are exact and already cheap; only full scans are sampled
+            sampled = sample_query(run_sql, sample_percent) if sample_percent and info['source'] == 'bigquery' else None
+            if sampled is not None:
+                execute_sql, info['sample'] = sampled
+                info['source'] = 'sample'
+                # What the exact run would scan, shown next to the preview's cost
+                info['sample']['full_bytes'] = info.get('rewrite', {}).get('rewritten_bytes') \
+                    or bq_client.estimate_query_bytes(run_sql)
+            # SQL filled in from a template runs as the template, with the question's values as parameters
+            parameters = None
+            if self.template is not None:
+                execute_sql, parameters = parameterize(execute_sql, question_literals(self.question)) \
+                    or (execute_sql, None)
+            with usage_context(self.question):
+                # Early rows only for full scans; a sample or rollup is already the cheap answer
+                df = bq_client.execute_query(
+                    execute_sql, Config.MAX_QUERY_RESULTS,
+                    on_preview=on_preview if info['source'] == 'bigquery' else None, on_wait=on_wait,
+                    parameters=parameters
+                )
+            info['job'] = bq_client.last_job
+            # Cached under the SQL that produced the rows; approximate rows are never reused
+            if df is not None and result_cache is not None and sampled is None:
+                result_cache.put(run_sql, df)
+            if df is not None:
+                info['fetched_at'] = datetime.now()
+
+        if df is None:
+            self._fail(EXECUTING, bq_client.last_error or "Query execution failed")
+            # A quota refusal is not an SQL error; sending it to the LLM would only spend tokens
+            if not bq_client.quota_exceeded and self.repair(text2sql, bq_client, table_schemas):
+                return self._execute(
+                    bq_client, result_cache, rollup_router, table_schemas, None, False, sample_percent,
+                    on_preview, on_wait
+                )
+            return False
+
+        # SQL that BigQuery accepted becomes a few-shot example for similar questions
+        if info['source'] not in ('local', 'shared') and self.question:
+            EXAMPLE_STORE.add(self.question, self.sql)
+            # ... and, if the question's values can be swapped out, a template for questions like it
+            if Config.QUERY_TEMPLATES and self.template is None:
+                TEMPLATE_STORE.learn(
+                    self.question, self.sql, schema_fingerprint(table_schemas),
+                    check=lambda sql, parameters: bq_client.validate_query(sql, parameters)[0]
+                )
+
+        self.result = df
+        self.result_sql = self.sql
+        self.execution_info = info
+        self.error = None
+        self.failed_stage = None
+        self._advance(RESULT)
+        return True
+
+    def reopen(self, question, sql, job, bq_client, result_cache=None, rollup_router=None, table_schemas=None):
+        """Show an earlier query again: read its job's stored rows, else run it as a new job.
+
+        Returns True if a new result was produced.
+        """
+        self.set_question(question)
+        self.set_sql(sql, self.sql_inputs)
+        if self.result is not None and self.result_sql == self.sql:
+            return False
+
+        df = bq_client.read_job_result(job) if job else None
+        if df is None:
+            return self.execute(bq_client, result_cache, rollup_router, table_schemas)
+        self.load_result(question, sql, df, {'source': 'job', 'job': job})
+        return True
+
+    def load_result(self, question, sql, df, info):
+        """Show a result produced elsewhere (a stored job, a dashboard tile) as the current one"""
+        self.set_question(question)
+        self.set_sql(sql, self.sql_inputs)
+        self.validation = (True, "Query is valid")
+        self.result = df
+        self.result_sql = self.sql
+        self.execution_info = info
+        self.error = None
+        self.failed_stage = None
+        self._advance(RESULT)
@@ -0,0 +1,268 @@
+"""
+Background pre-warming of saved and frequently asked queries.
+
+Sessions register the queries users save and count the questions they ask.
+During the configured windows (before business hours by default) a daemon
+thread re-runs the saved queries and regenerates and re-runs the most asked
+questions on a small thread pool, at BATCH priority so interactive users are
+always served first. The generated SQL lands in GENERATION_CACHE and the rows
+in SHARED_RESULT_CACHE, so the first person to ask in the morning gets an
+answer without waiting for the LLM or BigQuery. Each run stops at the query,
+LLM-call and scanned-bytes budgets.
+"""
+
+import json
+import os
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time as dtime, timedelta
+from config import Config
+from result_cache import SHARED_RESULT_CACHE
+from scheduler import BATCH
+from sql_rewriter import rewrite_for_cost
+from sql_utils import normalize_sql
+from sql_validator import validate_sql
+from usage import usage_context
+
+def parse_windows(text):
+    """Parse 'HH:MM-HH:MM, ...' into a list of (start, end) times; bad entries are skipped"""
+    windows = []
+    for part in (text or "").split(","):
+        try:
+            start, end = (dtime.fromisoformat(value.strip()) for value in part.split("-"))
+        except ValueError:
+            continue
+        windows.append((start, end))
+    return windows
+
+def current_window(now, windows):
+    """Start datetime of the window containing now, or None"""
+    for start, end in windows:
+        opened = datetime.combine(now.date(), start)
+        if start <= end:
+            if start <= now.time() < end:
+                return opened
+        elif now.time() >= start:
+            # Window spans midnight, evening part
+            return opened
+        elif now.time() < end:
+            return opened - timedelta(days=1)
+    return None
+
+class Prewarmer:
+    """Registry of queries worth warming plus the thread that warms them"""
+
+    def __init__(self, state_path=None):
+        self.state_path = state_path if state_path is not None else Config.PREWARM_STATE_PATH
+        self._lock = threading.Lock()
+        self._saved = {}
+        self._questions = Counter()
+        self._freshness = {}
+        self._loaded = False
+        self._thread = None
+        self._stop = threading.Event()
+        self._run_lock = threading.Lock()
+        self.table_schemas = {}
+        self.last_run = None
+        self.last_error = None
+        self._last_window = None
+
+    # -- registry --------------------------------------------------------
+
+    def _load(self):
+        """Read the persisted registry on first use (caller holds the lock)"""
+        if self._loaded:
+            return
+        self._loaded = True
+        if not self.state_path or not os.path.exists(self.state_path):
+            return
+        try:
+            with open(self.state_path, encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+        self._saved = {normalize_sql(item['sql']): item for item in state.get('saved', [])}
+        self._questions = Counter(state.get('questions', {}))
+
+    def _persist(self):
+        """Write the registry (caller holds the lock)"""
+        if not self.state_path:
+            return
+        try:
+            with open(self.state_path, "w", encoding="utf-8") as f:
+                json.dump({'saved': list(self._saved.values()), 'questions': dict(self._questions)}, f)
+        except OSError:
+            pass
+
+    def register_saved(self, question, sql):
+        """Warm this saved query on every run"""
+        with self._lock:
+            self._load()
+            self._saved[normalize_sql(sql)] = {'question': question, 'sql': sql}
+            self._persist()
+
+    def unregister_saved(self, sql):
+        with self._lock:
+            self._load()
+            if self._saved.pop(normalize_sql(sql), None) is not None:
+                self._persist()
+
+    def record_question(self, question):
+        """Count a question so the most asked ones are warmed"""
+        question = " ".join((question or "").split())
+        if not question:
+            return
+        with self._lock:
+            self._load()
+            self._questions[question] += 1
+            self._persist()
+
+    def candidates(self):
+        """Saved queries, then the most asked questions"""
+        with self._lock:
+            self._load()
+            saved = [dict(item, kind='saved') for item in self._saved.values()]
+            saved_questions = {item['question'] for item in saved}
+            popular = [
+                {'question': question, 'sql': None, 'kind': 'popular', 'asked': count}
+                for question, count in self._questions.most_common()
+                if question not in saved_questions
+            ][:Config.PREWARM_TOP_QUESTIONS]
+        return saved + popular
+
+    def freshness(self, key):
+        """When a question or SQL was last warmed, or None"""
+        with self._lock:
+            return self._freshness.get(key)
+
+    # -- warming ---------------------------------------------------------
+
+    def run(self, bq_client, text2sql, table_schemas=None):
+        """Warm every candidate once within this run's budgets; returns the run summary"""
+        if not self._run_lock.acquire(blocking=False):
+            return None
+        try:
+            table_schemas = table_schemas if table_schemas is not None else self.table_schemas
+            summary = {
+                'started_at': datetime.now(), 'finished_at': None, 'warmed': 0, 'failed': 0,
+                'skipped': 0, 'llm_calls': 0, 'bytes': 0
+            }
+            budget_lock = threading.Lock()
+
+            def reserve(field, amount, limit):
+                with budget_lock:
+                    if summary[field] + amount > limit:
+                        return False
+                    summary[field] += amount
+                    return True
+
+            def warm(candidate):
+                with usage_context(candidate['question']):
+                    outcome = self._warm_one(candidate, bq_client, text2sql, table_schemas, reserve)
+                with budget_lock:
+                    summary[outcome] += 1
+
+            candidates = self.candidates()
+            summary['skipped'] = max(0, len(candidates) - Config.PREWARM_MAX_QUERIES)
+            candidates = candidates[:Config.PREWARM_MAX_QUERIES]
+            with ThreadPoolExecutor(max_workers=max(1, Config.PREWARM_WORKERS), thread_name_prefix="prewarm") as pool:
+                list(pool.map(warm, candidates))
+            summary['finished_at'] = datetime.now()
+            self.last_run = summary
+            return summary
+        finally:
+            self._run_lock.release()
+
+    def _warm_one(self, candidate, bq_client, text2sql, table_schemas, reserve):
+        """Generate (for popular questions) and run one query; returns 'warmed', 'failed' or 'skipped'"""
+        sql = candidate['sql']
+        if sql is None:
+            if not reserve('llm_calls', 1, Config.PREWARM_MAX_LLM_CALLS):
+                return 'skipped'
+            sql = text2sql.generate_sql(
+                candidate['question'], table_schemas,
+                text2sql.get_sample_queries(candidate['question']),
+                priority=BATCH, use_cache=False
+            )
+            if not sql:
+                return 'failed'
+
+        # The same checks and rewrites a session applies, so the cache keys match
+        is_valid, _, sql = validate_sql(sql, table_schemas)
+        if not is_valid:
+            return 'failed'
+        if Config.ENABLE_COST_REWRITE:
+            sql, _ = rewrite_for_cost(sql, table_schemas)
+
+        estimate = bq_client.estimate_query_bytes(sql)
+        if estimate is None:
+            return 'failed'
+        if not reserve('bytes', estimate, Config.PREWARM_MAX_BYTES):
+            return 'skipped'
+        df = bq_client.execute_query(sql, Config.MAX_QUERY_RESULTS, priority=BATCH)
+        if df is None:
+            return 'failed'
+        SHARED_RESULT_CACHE.put(sql, df)
+        warmed_at = datetime.now()
+        with self._lock:
+            self._freshness[candidate['question']] = warmed_at
+            self._freshness[normalize_sql(candidate['sql'] or sql)] = warmed_at
+        return 'warmed'
+
+    # -- scheduling ------------------------------------------------------
+
+    def start(self, table_schemas=None, client_factory=None):
+        """Start the background thread once per process; later calls only refresh the schemas.
+
+        client_factory() returns the (bq_client, text2sql) pair the thread uses.
+        """
+        if table_schemas:
+            self.table_schemas = table_schemas
+        with self._lock:
+            if self._thread is not None or not Config.ENABLE_PREWARM or client_factory is None:
+                return
+            self._thread = threading.Thread(target=self._loop, args=(client_factory,), name="prewarmer", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self, client_factory):
+        clients = None
+        windows = parse_windows(Config.PREWARM_WINDOWS)
+        while not self._stop.is_set():
+            window = current_window(datetime.now(), windows)
+            # Once per window, and only after a session has provided the schemas
+            if window is not None and window != self._last_window and self.table_schemas:
+                self._last_window = window
+                try:
+                    clients = clients or client_factory()
+                    self.run(*clients)
+                    self.last_error = None
+                except Exception as e:
+                    # A failed run is retried in the next window; the error shows in status()
+                    self.last_error = {'at': datetime.now(), 'error': f"{type(e).__name__}: {e}"}
+            self._stop.wait(Config.PREWARM_CHECK_INTERVAL)
+
+    def next_window(self, now=None):
+        """Start of the next configured window after now, or None"""
+        now = now or datetime.now()
+        starts = [
+            datetime.combine(now.date() + timedelta(days=offset), start)
+            for offset in (0, 1) for start, _ in parse_windows(Config.PREWARM_WINDOWS)
+        ]
+        upcoming = [start for start in starts if start > now]
+        return min(upcoming) if upcoming else None
+
+    def status(self):
+        return {
+            'running': self._thread is not None and self._thread.is_alive(),
+            'candidates': len(self.candidates()),
+            'last_run': self.last_run,
+            'last_error': self.last_error,
+            'next_window': self.next_window()
+        }
+
+# One pre-warmer per process, shared by every session
+PREWARMER = Prewarmer()
@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+"""
+Replay recorded pipeline traces through the current code.
+
+Each trace written with TRACE_ENABLED is run through QueryPipeline again,
+repeating the stages it recorded (generate, validate, execute). By default
+the LLM and BigQuery are stand-ins answering with the recorded responses, so
+a replay is deterministic and times only the code in this repository;
+--simulate-latency adds the recorded service times back, and --live-llm /
+--live-bigquery use the real services instead.
+
+The report lists per-stage latency (recorded and replayed) and every trace
+whose prompt, SQL, validation verdict, final stage or result shape changed.
+Save a report with --json on the deployed version and pass it as --baseline
+on a candidate to catch latency regressions before deploying.
+
+Usage:
+    python replay.py traces.jsonl [--live-llm] [--live-bigquery] [--simulate-latency]
+                     [--limit N] [--json report.json] [--baseline report.json]
+                     [--max-regression 0.2] [--fail-on-diff]
+"""
+
+import argparse
+import difflib
+import json
+import os
+import sys
+import time
+
+# Replays must not record themselves or touch the app's persisted state
+os.environ.update({
+    'TRACE_ENABLED': 'false',
+    'CACHE_BACKEND': 'memory',
+    'USAGE_DB_PATH': ':memory:',
+    'EXAMPLE_STORE_PATH': '',
+    'QUOTA_DAILY_TOKENS': '0',
+    'QUOTA_DAILY_GB_BILLED': '0',
+    'LLM_HEDGE': 'false',
+    # A template learned from one trace would answer the next without its recorded LLM call
+    'QUERY_TEMPLATES': 'false',
+    # Every trace is replayed by one user back to back; production spreads them
+    # across users, so the per-user rate limits would only add waits
+    'LLM_USER_RATE_PER_MINUTE': '1000000',
+    'BIGQUERY_USER_RATE_PER_MINUTE': '1000000',
+    'LLM_RATE_PER_MINUTE': '1000000',
+    'BIGQUERY_RATE_PER_MINUTE': '1000000'
+})
+
+import pandas as pd
+from config import Config
+from llm_router import LLMRouter
+from pipeline import QueryPipeline, FAILED
+from sql_utils import normalize_sql
+from text2sql import Text2SQLGenerator
+from tracing import Trace, pipeline_outcome, read_traces, record_dry_run, record_query
+
+# Also when the app's modules were imported before the environment above was set
+Config.TRACE_ENABLED = False
+Config.QUERY_TEMPLATES = False
+
+STAGES = ["generate", "validate", "execute"]
+
+# Outcome fields compared between the recording and the replay; SQL is compared normalized
+COMPARED_FIELDS = ["generated_sql", "sql", "run_sql", "validation", "stage", "failed_stage", "rows", "column_names"]
+SQL_FIELDS = {"generated_sql", "sql", "run_sql"}
+
+class RecordedLLM:
+    """Provider calls answered with a trace's recorded LLM outputs, in order"""
+
+    def __init__(self, trace, simulate_latency=False):
+        self.simulate_latency = simulate_latency
+        self.calls = {"generate": [], "repair": []}
+        for call in trace.get('llm_calls', []):
+            self.calls.setdefault(call['kind'], []).append(call)
+        # Generation answered from the cache has no recorded call; answer with what it returned
+        if not self.calls["generate"] and trace.get('generated_sql'):
+            self.calls["generate"].append({'output': trace['generated_sql'], 'seconds': 0.0})
+        self.unrecorded = 0
+
+    def provider(self, kind):
+        """Callable for an LLMRouter; an empty answer once the recorded ones run out"""
+        pending = list(self.calls.get(kind, []))
+
+        def call(inputs):
+            if not pending:
+                # Empty rather than an error, so the router's circuit breaker stays closed
+                self.unrecorded += 1
+                return ""
+            recorded = pending.pop(0)
+            if self.simulate_latency and recorded.get('seconds'):
+                time.sleep(recorded['seconds'])
+            return recorded['output']
+        return call
+
+class RecordedText2SQL(Text2SQLGenerator):
+    """Text2SQLGenerator whose providers are a RecordedLLM; prompts are still built by the current code"""
+
+    def __init__(self, trace, simulate_latency=False):
+        providers = [call['provider'] for call in trace.get('llm_calls', []) if call.get('provider')]
+        super().__init__(use_vertex_ai=(providers[0] if providers else Config.LLM_PROVIDER) != 'openai')
+        self.recorded = RecordedLLM(trace, simulate_latency)
+
+    def _initialize_llm(self):
+        self.chain = self.recorded
+        self.router = LLMRouter({self.provider: self.recorded.provider("generate")}, primary=self.provider)
+        self.repair_router = LLMRouter({self.provider: self.recorded.provider("repair")}, primary=self.provider)
+
+class RecordedBigQuery:
+    """Stand-in for BigQueryClient answering dry runs and queries from a trace.
+
+    Query results have the recorded row count and column names (the rows
+    themselves are never recorded). SQL the trace never ran is accepted and
+    answered with the trace's final result shape, and counted as unrecorded.
+    """
+
+    def __init__(self, trace, simulate_latency=False):
+        self.simulate_latency = simulate_latency
+        self.last_error = None
+        self.last_job = None
+        self.quota_exceeded = False
+        self.dry_runs = {normalize_sql(run['sql']): run for run in trace.get('dry_runs', [])}
+        self.queries = {normalize_sql(query['sql']): query for query in trace.get('queries', [])}
+        self.final = {'rows': trace.get('rows'), 'column_names': trace.get('column_names'), 'seconds': 0.0}
+        self.unrecorded = 0
+
+    def _wait(self, recorded):
+        if self.simulate_latency and recorded.get('seconds'):
+            time.sleep(recorded['seconds'])
+
+    def validate_query(self, query, parameters=None):
+        started = time.perf_counter()
+        run = self.dry_runs.get(normalize_sql(query))
+        if run is None:
+            self.unrecorded += 1
+            run = {'valid': True, 'message': "Query is valid", 'bytes_processed': None}
+        self._wait(run)
+        record_dry_run(query, run['valid'], run['message'], run['bytes_processed'], time.perf_counter() - started)
+        return run['valid'], run['message']
+
+    def estimate_query_bytes(self, query, parameters=None):
+        recorded = self.dry_runs.get(normalize_sql(query)) or self.queries.get(normalize_sql(query))
+        return recorded.get('bytes_processed') if recorded else None
+
+    def execute_query(self, query, max_results=None, priority=None, on_preview=None, on_wait=None, parameters=None):
+        self.last_error = None
+        self.last_job = None
+        started = time.perf_counter()
+        recorded = self.queries.get(normalize_sql(query))
+        if recorded is None:
+            self.unrecorded += 1
+            recorded = self.final
+            if recorded['column_names'] is None:
+                recorded = dict(recorded, error="No recorded result for this query")
+        self._wait(recorded)
+        if recorded.get('error'):
+            self.last_error = recorded['error']
+            record_query(query, None, None, self.last_error, time.perf_counter() - started)
+            return None
+        df = pd.DataFrame(index=range(recorded['rows'] or 0), columns=recorded['column_names'])
+        self.last_job = {
+            'job_id': 'replay',
+            'bytes_processed': recorded.get('bytes_processed'),
+            'bytes_billed': recorded.get('bytes_billed'),
+            'slot_ms': recorded.get('slot_ms')
+        }
+        record_query(query, df, self.last_job, None, time.perf_counter() - started)
+        return df
+
+def replay_trace(trace, table_schemas=None, text2sql=None, bq_client=None, simulate_latency=False):
+    """Run one recorded trace through the current pipeline; returns the replayed trace data.
+
+    text2sql and bq_client default to stand-ins built from the trace.
+    """
+    recorded_stages = trace.get('stages', {})
+    text2sql = text2sql or RecordedText2SQL(trace, simulate_latency)
+    bq_client = bq_client or RecordedBigQuery(trace, simulate_latency)
+
+    pipeline = QueryPipeline()
+    pipeline.set_question(trace['question'])
+    replayed = Trace(trace['question'], table_schemas)
+
+    if "generate" in recorded_stages:
+        with replayed.stage("generate"):
+            pipeline.generate(text2sql, table_schemas, trace.get('sample_queries') or "", force=True)
+        replayed.update(generated_sql=pipeline.sql)
+    elif trace.get('sql'):
+        pipeline.set_sql(trace['sql'])
+
+    # Like the app, a run stops at the first failed stage
+    if "validate" in recorded_stages and pipeline.sql and pipeline.stage != FAILED:
+        with replayed.stage("validate"):
+            pipeline.validate(bq_client, table_schemas, text2sql, force=True)
+    if "execute" in recorded_stages and pipeline.sql and pipeline.stage != FAILED:
+        with replayed.stage("execute"):
+            pipeline.execute(bq_client, None, None, table_schemas, text2sql, force=True)
+
+    replayed.update(**pipeline_outcome(pipeline))
+    replayed.update(unrecorded={
+        'llm': getattr(getattr(text2sql, 'recorded', None), 'unrecorded', 0),
+        'bigquery': getattr(bq_client, 'unrecorded', 0)
+    })
+    return replayed.data
+
+def _prompt_diff(recorded, replayed, limit=8):
+    """First changed lines of a prompt as a unified diff"""
+    lines = list(difflib.unified_diff(
+        (recorded or "").splitlines(), (replayed or "").splitlines(), "recorded", "replayed", lineterm="", n=0
+    ))
+    return lines[:limit]
+
+def compare(recorded, replayed):
+    """Differences between a recorded trace and its replay, as a list of dicts"""
+    differences = []
+    for field in COMPARED_FIELDS:
+        before, after = recorded.get(field), replayed.get(field)
+        if field in SQL_FIELDS:
+            same = normalize_sql(before or "") == normalize_sql(after or "")
+        else:
+            same = before == after
+        if not same:
+            differences.append({'field': field, 'recorded': before, 'replayed': after})
+
+    for kind in ("generate", "repair"):
+        before = [call['prompt'] for call in recorded.get('llm_calls', []) if call['kind'] == kind]
+        after = [call['prompt'] for call in replayed.get('llm_calls', []) if call['kind'] == kind]
+        if len(before) != len(after):
+            differences.append({'field': f"{kind}_calls", 'recorded': len(before), 'replayed': len(after)})
+        for index, (old, new) in enumerate(zip(before, after)):
+            if old != new:
+                differences.append({'field': f"{kind}_prompt[{index}]", 'diff': _prompt_diff(old, new)})
+    return differences
+
+def _percentile(values, pct):
+    """Nearest-rank percentile, or None without values"""
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+def latency_summary(results):
+    """p50/p95 seconds per stage and in total, for the recording and the replay"""
+    summary = {}
+    for stage in STAGES + ["total"]:
+        row = {}
+        for side in ("recorded", "replayed"):
+            if stage == "total":
+                values = [sum(result[side]['stages'].values()) for result in results]
+            else:
+                values = [result[side]['stages'][stage] for result in results if stage in result[side]['stages']]
+            row[side] = {'p50': _percentile(values, 50), 'p95': _percentile(values, 95), 'count': len(values)}
+        summary[stage] = row
+    return summary
+
+def regressions(latency, baseline, max_regression):
+    """Stages whose replayed p50 or p95 grew by more than max_regression (a fraction) over the baseline"""
+    found = []
+    for stage, row in latency.items():
+        previous = baseline.get('latency', {}).get(stage, {}).get('replayed', {})
+        for pct in ("p50", "p95"):
+            before, after = previous.get(pct), row['replayed'][pct]
+            if before and after is not None and after > before * (1 + max_regression):
+                found.append({'stage': stage, 'percentile': pct, 'baseline': before, 'replayed': after})
+    return found
+
+def run_replay(path, limit=None, live_llm=False, live_bigquery=False, simulate_latency=False):
+    """Replay every trace in a file; returns the report dict"""
+    traces, schemas = read_traces(path)
+    if limit:
+        traces = traces[:limit]
+
+    text2sql = Text2SQLGenerator(use_vertex_ai=Config.LLM_PROVIDER != 'openai') if live_llm else None
+    bq_client = None
+    if live_bigquery:
+        from bigquery_client import BigQueryClient
+        bq_client = BigQueryClient()
+        if not bq_client.initialize_client():
+            raise SystemExit("❌ Could not connect to BigQuery")
+    else:
+        # A stand-in answer is never worth retrying
+        Config.LLM_MAX_RETRIES = 0
+
+    results = []
+    for trace in traces:
+        table_schemas = schemas.get(trace.get('schema_fingerprint'))
+        replayed = replay_trace(trace, table_schemas, text2sql, bq_client, simulate_latency)
+        results.append({
+            'trace_id': trace.get('trace_id'),
+            'question': trace['question'],
+            'schemas_recorded': table_schemas is not None,
+            'recorded': {'stages': trace.get('stages', {})},
+            'replayed': {'stages': replayed['stages'], 'unrecorded': replayed['unrecorded']},
+            'differences': compare(trace, replayed)
+        })
+
+    return {
+        'path': path,
+        'replayed_at': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'mode': {'live_llm': live_llm, 'live_bigquery': live_bigquery, 'simulate_latency': simulate_latency},
+        'traces': results,
+        'latency': latency_summary(results)
+    }
+
+def _ms(seconds):
+    return f"{seconds * 1000:>9.1f} ms" if seconds is not None else f"{'n/a':>12}"
+
+def print_report(report, found_regressions=None):
+    """Print latency per stage and the traces whose output changed"""
+    results = report['traces']
+    changed = [result for result in results if result['differences']]
+    print("=" * 60)
+    print(f"🔁 Replay of {len(results)} traces from {report['path']}")
+    print("=" * 60)
+    print(f"\n⏱️  Latency{'':<13}{'recorded p50':>12}{'p95':>12}{'replayed p50':>14}{'p95':>12}")
+    for stage, row in report['latency'].items():
+        if not row['recorded']['count'] and not row['replayed']['count']:
+            continue
+        print(f"   {stage:<18}{_ms(row['recorded']['p50'])}{_ms(row['recorded']['p95'])}"
+              f"  {_ms(row['replayed']['p50'])}{_ms(row['replayed']['p95'])}")
+
+    if found_regressions:
+        print("\n🐢 Regressions against the baseline:")
+        for item in found_regressions:
+            print(f"   {item['stage']} {item['percentile']}: {item['baseline'] * 1000:.1f} ms → {item['replayed'] * 1000:.1f} ms")
+
+    print(f"\n🔍 Output differences: {len(changed)} of {len(results)} traces")
+    for result in changed:
+        print(f"\n   ❓ {result['question'][:70]}  ({result['trace_id']})")
+        for difference in result['differences']:
+            if 'diff' in difference:
+                print(f"      {difference['field']} changed:")
+                for line in difference['diff']:
+                    print(f"         {line}")
+            else:
+                print(f"      {difference['field']}: {difference['recorded']!r} → {difference['replayed']!r}")
+    unrecorded = sum(result['replayed']['unrecorded']['llm'] + result['replayed']['unrecorded']['bigquery'] for result in results)
+    missing_schemas = sum(1 for result in results if not result['schemas_recorded'])
+    if unrecorded:
+        print(f"\n⚠️  {unrecorded} calls had no recorded response and were answered by the stand-ins")
+    if missing_schemas:
+        print(f"⚠️  {missing_schemas} traces were replayed without their table schemas")
+    print()
+
+def main():
+    """Parse arguments, replay and print the report; exits 1 on regressions (or differences with --fail-on-diff)"""
+    parser = argparse.ArgumentParser(description="Replay recorded pipeline traces through the current code")
+    parser.add_argument("path", nargs="?", default=Config.TRACE_PATH, help="trace file (default: TRACE_PATH)")
+    parser.add_argument("--limit", type=int, help="replay only the first N traces")
+    parser.add_argument("--live-llm", action="store_true", help="call the configured LLM instead of the recorded outputs")
+    parser.add_argument("--live-bigquery", action="store_true", help="run dry runs and queries on BigQuery")
+    parser.add_argument("--simulate-latency", action="store_true", help="stand-ins wait as long as the recorded calls took")
+    parser.add_argument("--json", help="write the full report to this file")
+    parser.add_argument("--baseline", help="earlier --json report to compare replayed latency against")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="allowed p50/p95 growth over the baseline (0.2 = 20%%)")
+    parser.add_argument("--fail-on-diff", action="store_true", help="also exit 1 when any output changed")
+    args = parser.parse_args()
+
+    report = run_replay(args.path, args.limit, args.live_llm, args.live_bigquery, args.simulate_latency)
+    found = []
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            found = regressions(report['latency'], json.load(f), args.max_regression)
+        report['regressions'] = found
+    print_report(report, found)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, default=str)
+
+    changed = any(result['differences'] for result in report['traces'])
+    sys.exit(1 if found or (args.fail_on_diff and changed) else 0)
+
+if __name__ == "__main__":
+    main()
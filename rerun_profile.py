@@ -0,0 +1,86 @@
+"""
+Per-section timing of Streamlit reruns.
+
+Streamlit runs the whole script again on every widget interaction. The app
+marks checkpoints as it goes (after the sidebar, the question box, each
+visualization tab, ...); the time since the previous checkpoint is charged to
+the named section. The last RERUN_PROFILE_HISTORY reruns of a session are
+kept so the panel can show which sections dominate a typical rerun.
+"""
+
+import time
+from collections import deque
+import streamlit as st
+from config import Config
+
+class RerunProfiler:
+    """Section timings of the most recent reruns of one session"""
+
+    def __init__(self, history=None):
+        self.reruns = deque(maxlen=history or Config.RERUN_PROFILE_HISTORY)
+        self._current = None
+        self._started = None
+        self._last_mark = None
+
+    def start(self):
+        """Begin timing a rerun"""
+        self._started = self._last_mark = time.perf_counter()
+        self._current = {}
+
+    def checkpoint(self, section):
+        """Charge the time since the previous checkpoint to section"""
+        if self._current is None:
+            return
+        now = time.perf_counter()
+        self._current[section] = self._current.get(section, 0.0) + now - self._last_mark
+        self._last_mark = now
+
+    def finish(self):
+        """Record the rerun; time after the last checkpoint is charged to 'other'"""
+        if self._current is None:
+            return
+        self.checkpoint("other")
+        self.reruns.append({'sections': self._current, 'total': time.perf_counter() - self._started})
+        self._current = None
+
+    def summary(self):
+        """Per section: mean and max seconds and share of rerun time, slowest first"""
+        if not self.reruns:
+            return []
+        total = sum(rerun['total'] for rerun in self.reruns) or 1.0
+        sections = {}
+        for rerun in self.reruns:
+            for name, seconds in rerun['sections'].items():
+                sections.setdefault(name, []).append(seconds)
+        rows = [
+            {
+                'section': name,
+                'mean_ms': 1000 * sum(times) / len(self.reruns),
+                'max_ms': 1000 * max(times),
+                'share': sum(times) / total
+            }
+            for name, times in sections.items()
+        ]
+        return sorted(rows, key=lambda row: row['mean_ms'], reverse=True)
+
+    def last_total(self):
+        return self.reruns[-1]['total'] if self.reruns else None
+
+def current_profiler():
+    """This session's profiler, created on first use"""
+    if 'rerun_profiler' not in st.session_state:
+        st.session_state.rerun_profiler = RerunProfiler()
+    return st.session_state.rerun_profiler
+
+def checkpoint(section):
+    """Shorthand for current_profiler().checkpoint(section)"""
+    current_profiler().checkpoint(section)
+
+def profiled(main):
+    """Run main() as one profiled rerun, even when it returns early or reruns"""
+    profiler = current_profiler()
+    profiler.start()
+    try:
+        main()
+    finally:
+        profiler.finish()
@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta
+from cache_backend import MemoryBackend, make_backend
+from config import Config
+from sql_utils import normalize_sql
+
+class ResultCache:
+    """Bounded LRU cache of query results keyed by normalized SQL"""
+
+    def __init__(self, max_entries=None, backend=None, ttl=None):
+        self.max_entries = max_entries or Config.RESULT_CACHE_SIZE
+        self.backend = backend if backend is not None else MemoryBackend(self.max_entries)
+        self.ttl = ttl
+
+    def get(self, sql, max_age=None):
+        """Return the cached entry for a query, or None; entries older than max_age (a timedelta) are ignored"""
+        entry = self.backend.get(normalize_sql(sql))
+        if entry is None or (max_age is not None and datetime.now() - entry['timestamp'] > max_age):
+            return None
+        return entry
+
+    def put(self, sql, df):
+        """Store a query result, evicting the least recently used entry"""
+        self.backend.set(normalize_sql(sql), {
+            'sql': sql,
+            'df': df,
+            'timestamp': datetime.now()
+        }, ttl=self.ttl)
+
+    def entries(self):
+        """Return cached entries, most recently used first"""
+        return self.backend.values()
+
+    def clear(self):
+        """Drop every cached result"""
+        self.backend.clear()
+
+    def __len__(self):
+        return len(self.backend)
+
+class GenerationCache:
+    """Bounded LRU cache of generated SQL keyed by question and schema, with a TTL"""
+
+    def __init__(self, max_entries=None, ttl_hours=None, backend=None):
+        self.max_entries = max_entries or Config.GENERATION_CACHE_SIZE
+        self.ttl = timedelta(hours=ttl_hours if ttl_hours is not None else Config.GENERATION_CACHE_TTL_HOURS)
+        self.backend = backend if backend is not None else MemoryBackend(self.max_entries)
+
+    @staticmethod
+    def _key(question, schema_key):
+        return (" ".join((question or "").lower().split()), schema_key)
+
+    def get(self, question, schema_key):
+        """Return the cached entry ({'sql', 'timestamp'}) for a question, or None"""
+        entry = self.backend.get(self._key(question, schema_key))
+        if entry is None or datetime.now() - entry['timestamp'] > self.ttl:
+            return None
+        return entry
+
+    def put(self, question, schema_key, sql):
+        """Store generated SQL, evicting the least recently used entry"""
+        self.backend.set(
+            self._key(question, schema_key),
+            {'sql': sql, 'timestamp': datetime.now()},
+            ttl=self.ttl.total_seconds()
+        )
+
+    def clear(self):
+        self.backend.clear()
+
+    def __len__(self):
+        return len(self.backend)
+
+# Process-wide caches filled by every session and by the background pre-warmer.
+# With CACHE_BACKEND=disk or redis they are shared with other processes and replicas.
+GENERATION_CACHE = GenerationCache(backend=make_backend("generation", Config.GENERATION_CACHE_SIZE))
+SHARED_RESULT_CACHE = ResultCache(
+    Config.SHARED_RESULT_CACHE_SIZE,
+    backend=make_backend("results", Config.SHARED_RESULT_CACHE_SIZE),
+    ttl=Config.SHARED_RESULT_MAX_AGE_HOURS * 3600
+)
+SCHEMA_CACHE = make_backend("schemas")
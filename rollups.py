@@ -0,0 +1,273 @@
+"""
+Daily KPI rollups and query routing.
+
+Pre-aggregated daily tables are built (and incrementally refreshed) in
+BigQuery for the base tables listed in Config.ROLLUP_DEFINITIONS. The router
+rewrites generated SQL to read from a rollup when the query only groups and
+filters on rollup dimensions or the date column and aggregates rollup measures.
+
+A query is only routed to a rollup written after the last change to its base
+table. A stale rollup has its missing days refreshed first
+(ROLLUP_AUTO_REFRESH), or the query stays on the base table.
+"""
+
+import re
+import threading
+from config import Config
+from sql_utils import (
+    split_clauses, join_clauses, split_top_level, parse_select_item,
+    split_table_reference, table_name_from_path, column_references, has_aggregate
+)
+
+ROW_COUNT_COLUMN = "row_count"
+
+# One refresh of a rollup at a time in this process; sessions that waited re-check and usually skip theirs
+_REFRESH_LOCK = threading.Lock()
+
+_AGGREGATE_CALL_RE = re.compile(
+    r"\b(SUM|AVG|MIN|MAX|COUNT)\s*\(\s*(DISTINCT\s+)?((?:`?\w+`?\.)?`?\w+`?|\*)\s*\)",
+    re.IGNORECASE,
+)
+
+
+class RollupStore:
+    """Builds, refreshes and describes the daily rollup tables"""
+
+    def __init__(self, bq_client, table_schemas=None):
+        self.bq_client = bq_client
+        self.table_schemas = table_schemas if table_schemas is not None else {}
+
+    @property
+    def dataset_id(self):
+        return Config.ROLLUP_DATASET or self.bq_client.dataset_id
+
+    def rollup_table_id(self, base_table):
+        """Fully qualified rollup table for a base table"""
+        return f"{self.bq_client.project_id}.{self.dataset_id}.{Config.ROLLUP_TABLE_PREFIX}{base_table}"
+
+    def base_table_id(self, base_table):
+        return f"{self.bq_client.project_id}.{self.bq_client.dataset_id}.{base_table}"
+
+    def definition(self, base_table):
+        """Rollup definition restricted to columns that exist in the base table.
+
+        Returns None when the table has no rollup or its date column is not a
+        DATE (a TIMESTAMP column cannot be answered at daily grain).
+        """
+        spec = Config.ROLLUP_DEFINITIONS.get(base_table)
+        if not spec:
+            return None
+        columns = {name.lower(): str(dtype).upper() for name, dtype in
+                   self.table_schemas.get(base_table, {}).get('columns', {}).items()}
+        if columns and columns.get(spec['date_column'].lower()) != "DATE":
+            return None
+
+        def present(names):
+            return [name for name in names if not columns or name.lower() in columns]
+
+        return {
+            'date_column': spec['date_column'],
+            'dimensions': present(spec.get('dimensions', [])),
+            'measures': present(spec.get('measures', []))
+        }
+
+    def _select_list(self, definition):
+        """Aggregations stored per day and dimension combination"""
+        keys = [definition['date_column']] + definition['dimensions']
+        items = list(keys)
+        for measure in definition['measures']:
+            items.extend([
+                f"SUM({measure}) AS {measure}",
+                f"COUNT({measure}) AS {measure}__n",
+                f"MIN({measure}) AS {measure}__min",
+                f"MAX({measure}) AS {measure}__max"
+            ])
+        items.append(f"COUNT(*) AS {ROW_COUNT_COLUMN}")
+        return keys, items
+
+    def build(self, base_table):
+        """(Re)create a rollup table from the full history of its base table"""
+        definition = self.definition(base_table)
+        if not definition:
+            self.bq_client._report("error", f"No usable rollup definition for '{base_table}'")
+            return False
+        keys, items = self._select_list(definition)
+        cluster = f"\nCLUSTER BY {', '.join(definition['dimensions'][:4])}" if definition['dimensions'] else ""
+        query = f"""
+CREATE OR REPLACE TABLE `{self.rollup_table_id(base_table)}`
+PARTITION BY {definition['date_column']}{cluster} AS
+SELECT {', '.join(items)}
+FROM `{self.base_table_id(base_table)}`
+GROUP BY {', '.join(keys)}
+"""
+        return self.bq_client.run_statement(query)
+
+    def refresh(self, base_table):
+        """Incrementally refresh a rollup by recomputing days past its high-water mark"""
+        definition = self.definition(base_table)
+        if not definition:
+            self.bq_client._report("error", f"No usable rollup definition for '{base_table}'")
+            return False
+        if not self.is_available(base_table):
+            return self.build(base_table)
+
+        keys, items = self._select_list(definition)
+        date_column = definition['date_column']
+        rollup = self.rollup_table_id(base_table)
+        # Recompute the last few days as well so late-arriving rows are picked up.
+        # One transaction, so a concurrent refresh cannot interleave and double-count days.
+        query = f"""
+DECLARE watermark DATE DEFAULT (
+  SELECT DATE_SUB(IFNULL(MAX({date_column}), DATE '1970-01-01'), INTERVAL {int(Config.ROLLUP_REFRESH_LOOKBACK_DAYS)} DAY)
+  FROM `{rollup}`
+);
+BEGIN TRANSACTION;
+DELETE FROM `{rollup}` WHERE {date_column} >= watermark;
+INSERT INTO `{rollup}` ({', '.join(parse_select_item(item)[1] or item for item in items)})
+SELECT {', '.join(items)}
+FROM `{self.base_table_id(base_table)}`
+WHERE {date_column} >= watermark
+GROUP BY {', '.join(keys)};
+COMMIT TRANSACTION;
+"""
+        return self.bq_client.run_statement(query)
+
+    def is_available(self, base_table):
+        """True if the rollup table for base_table exists"""
+        return self.bq_client.table_exists(self.rollup_table_id(base_table))
+
+    def is_current(self, base_table):
+        """True if the rollup exists and was written after the last change to its base table"""
+        rollup_modified = self.bq_client.table_modified(self.rollup_table_id(base_table))
+        if rollup_modified is None:
+            return False
+        base_modified = self.bq_client.table_modified(self.base_table_id(base_table))
+        return base_modified is not None and rollup_modified >= base_modified
+
+    def ensure_current(self, base_table):
+        """True if the rollup can answer for its base table, refreshing its missing days first if allowed"""
+        if self.is_current(base_table):
+            return True
+        if not Config.ROLLUP_AUTO_REFRESH:
+            return False
+        with _REFRESH_LOCK:
+            # Another session may have refreshed it while this one waited
+            if self.is_current(base_table):
+                return True
+            return self.is_available(base_table) and self.refresh(base_table)
+
+
+class RollupRouter:
+    """Rewrites aggregate queries over base tables to read from daily rollups"""
+
+    def __init__(self, store):
+        self.store = store
+        self.stats = {'routed': 0, 'bytes_saved': 0}
+
+    def rewrite(self, sql):
+        """Return (rewritten_sql, base_table) or (None, None) if the query cannot use a rollup"""
+        clauses = split_clauses(sql)
+        if not clauses or clauses.get('qualify'):
+            return None, None
+        reference = split_table_reference(clauses.get('from'))
+        if not reference:
+            return None, None
+        path, alias = reference
+        base_table = table_name_from_path(path)
+        definition = self.store.definition(base_table)
+        if not definition:
+            return None, None
+        # Only route queries that aggregate; row-level queries need the raw table
+        if not (clauses.get('group by') or has_aggregate(clauses['select'])):
+            return None, None
+
+        dimensions = {name.lower() for name in definition['dimensions']}
+        measures = {name.lower() for name in definition['measures']}
+        grain_columns = dimensions | {definition['date_column'].lower()}
+        qualifiers = {None, base_table.lower(), path.replace("`", "").lower()}
+        if alias:
+            qualifiers.add(alias.lower())
+
+        aliases = set()
+        for item in split_top_level(clauses['select']):
+            item_alias = parse_select_item(item)[1]
+            if item_alias:
+                aliases.add(item_alias.lower())
+
+        rewritten = {}
+        for name, text in clauses.items():
+            if name == 'from':
+                continue
+            new_text, ok = self._rewrite_aggregates(text, measures, grain_columns)
+            if not ok:
+                return None, None
+            # Anything left outside aggregates must be available at rollup grain
+            for qualifier, column in column_references(_AGGREGATE_CALL_RE.sub("0", text)):
+                if qualifier is not None and qualifier.lower() not in qualifiers:
+                    return None, None
+                if column.lower() not in grain_columns and column.lower() not in aliases:
+                    return None, None
+            rewritten[name] = new_text
+
+        rollup_from = f"`{self.store.rollup_table_id(base_table)}`"
+        rewritten['from'] = f"{rollup_from} AS {alias}" if alias else f"{rollup_from} AS {base_table}"
+        return join_clauses(rewritten), base_table
+
+    def _rewrite_aggregates(self, text, measures, grain_columns):
+        """Replace aggregates over measures with their rollup equivalents"""
+        state = {'ok': True}
+
+        def replace(match):
+            function, distinct, argument = match.group(1).upper(), match.group(2), match.group(3)
+            column = argument.replace("`", "").split(".")[-1]
+            lower = column.lower()
+            if argument == "*":
+                if function == "COUNT" and not distinct:
+                    return f"SUM({ROW_COUNT_COLUMN})"
+                state['ok'] = False
+                return match.group(0)
+            if lower in grain_columns and (distinct or function in ("MIN", "MAX")):
+                # Distinct counts and extremes of grouping columns are unchanged by the rollup
+                return match.group(0)
+            if lower not in measures or distinct:
+                state['ok'] = False
+                return match.group(0)
+            if function == "SUM":
+                return f"SUM({column})"
+            if function == "COUNT":
+                return f"SUM({column}__n)"
+            if function == "AVG":
+                return f"SAFE_DIVIDE(SUM({column}), SUM({column}__n))"
+            return f"{function}({column}__{function.lower()})"
+
+        new_text = _AGGREGATE_CALL_RE.sub(replace, text)
+        return new_text, state['ok']
+
+    def route(self, sql):
+        """Rewrite a query to use a rollup and measure the bytes saved.
+
+        Returns a dict with the SQL to execute and, when routed, the rollup
+        used and the dry-run bytes of the original and rewritten queries. A
+        rollup that is missing, or stale and cannot be refreshed, is not used.
+        """
+        rewritten, base_table = self.rewrite(sql)
+        if not rewritten or not self.store.ensure_current(base_table):
+            return {'sql': sql, 'routed': False}
+
+        original_bytes = self.store.bq_client.estimate_query_bytes(sql)
+        rollup_bytes = self.store.bq_client.estimate_query_bytes(rewritten)
+        if rollup_bytes is None:
+            # The rollup query does not validate; stay on the base table
+            return {'sql': sql, 'routed': False}
+
+        bytes_saved = (original_bytes or 0) - rollup_bytes
+        self.stats['routed'] += 1
+        self.stats['bytes_saved'] += max(bytes_saved, 0)
+        return {
+            'sql': rewritten,
+            'routed': True,
+            'rollup_table': self.store.rollup_table_id(base_table),
+            'original_bytes': original_bytes,
+            'rollup_bytes': rollup_bytes,
+            'bytes_saved': bytes_saved
+        }
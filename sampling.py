@@ -0,0 +1,170 @@
+"""
+Sampled previews of exploratory queries.
+
+A preview reads SAMPLE_PERCENT of the query's base table with
+TABLESAMPLE SYSTEM, so BigQuery scans and bills roughly that fraction of the
+table. With joins only the first table in FROM (normally the fact table) is
+sampled; the tables joined to it are read in full.
+
+Additive aggregates (SUM, COUNT, COUNTIF) in the select list and HAVING are
+scaled by 100 / percent, so totals and counts estimate the full values and
+ratios of them stay unchanged. AVG, MIN, MAX, COUNT(DISTINCT ...) and
+window aggregates are left as computed on the sample. Block sampling is
+clustered and small groups may be missing, so previews are approximate.
+"""
+
+from sqlparse import tokens as T
+from config import Config
+from sql_rewriter import _enforce_limit
+from sql_utils import (
+    _flat_tokens, _significant, has_aggregate, join_clauses, output_names, parse_select_item,
+    split_clauses, split_top_level, strip_statement, tokens_with_offsets
+)
+
+_ADDITIVE = {"SUM", "COUNT", "COUNTIF"}
+_COUNTS = {"COUNT", "COUNTIF"}
+
+def _factor_text(percent):
+    factor = 100.0 / percent
+    return str(int(factor)) if factor.is_integer() else f"{factor:.10g}"
+
+def _closing_paren(tokens, index):
+    """Index of the parenthesis closing the one at tokens[index]"""
+    depth = 0
+    for position in range(index, len(tokens)):
+        tok = tokens[position][1]
+        if tok.ttype is T.Punctuation and tok.value == "(":
+            depth += 1
+        elif tok.ttype is T.Punctuation and tok.value == ")":
+            depth -= 1
+            if depth == 0:
+                return position
+    return None
+
+def _next_significant(tokens, index):
+    for position in range(index, len(tokens)):
+        if not tokens[position][1].is_whitespace:
+            return position
+    return None
+
+def scale_aggregates(text, percent):
+    """Scale the additive aggregate calls in an expression; returns (text, scaled, unscaled) call counts"""
+    tokens = tokens_with_offsets(text)
+    factor = _factor_text(percent)
+    spans = []
+    unscaled = 0
+    covered_until = -1
+    for index, (offset, tok) in enumerate(tokens):
+        name = tok.value.upper()
+        if offset < covered_until or tok.is_whitespace or name not in _ADDITIVE:
+            continue
+        opening = _next_significant(tokens, index + 1)
+        if opening is None or tokens[opening][1].value != "(":
+            continue
+        closing = _closing_paren(tokens, opening)
+        if closing is None:
+            continue
+        argument = _next_significant(tokens, opening + 1)
+        after = _next_significant(tokens, closing + 1)
+        # Window aggregates add up groups, not rows; distinct counts do not scale
+        if after is not None and tokens[after][1].is_keyword and tokens[after][1].normalized == "OVER":
+            continue
+        if argument is not None and tokens[argument][1].is_keyword and tokens[argument][1].normalized == "DISTINCT":
+            unscaled += 1
+            continue
+        end = tokens[closing][0] + 1
+        spans.append((offset, end, name))
+        covered_until = end
+
+    for start, end, name in reversed(spans):
+        call = text[start:end]
+        if name in _COUNTS and "." in factor:
+            scaled = f"CAST({call} * {factor} AS INT64)"
+        else:
+            scaled = f"({call} * {factor})"
+        text = text[:start] + scaled + text[end:]
+    return text, len(spans), unscaled
+
+def _sample_first_table(from_clause, percent):
+    """FROM clause with TABLESAMPLE after its first table reference, or None if it does not start with a table"""
+    tokens = tokens_with_offsets(from_clause)
+    index = _next_significant(tokens, 0)
+    if index is None or tokens[index][1].ttype not in T.Name:
+        return None, None
+    table = tokens[index][1].value
+    end = index
+    # project.dataset.table and my-project.dataset.table
+    while True:
+        separator = end + 1
+        if separator + 1 < len(tokens) and tokens[separator][1].value in (".", "-") \
+                and tokens[separator + 1][1].ttype in T.Name:
+            table += tokens[separator][1].value + tokens[separator + 1][1].value
+            end = separator + 1
+        else:
+            break
+    following = _next_significant(tokens, end + 1)
+    if following is not None and tokens[following][1].is_keyword and tokens[following][1].normalized == "AS":
+        following = _next_significant(tokens, following + 1)
+        if following is None or tokens[following][1].ttype not in T.Name:
+            return None, None
+        end = following
+    elif following is not None and tokens[following][1].ttype in T.Name:
+        end = following
+    elif following is not None and tokens[following][1].value == "(":
+        # A table function such as UNNEST(...) or a parameterized view
+        return None, None
+    insert_at = tokens[end][0] + len(tokens[end][1].value)
+    sampled = f"{from_clause[:insert_at]} TABLESAMPLE SYSTEM ({percent:g} PERCENT){from_clause[insert_at:]}"
+    return sampled, table.strip("`")
+
+def sample_query(sql, percent=None):
+    """Rewrite a query to run on a sample of its first table.
+
+    Returns (sampled_sql, info) or None when the query cannot be sampled
+    (CTEs, set operations, a subquery or table function in FROM, or a query
+    that already samples). info has the percent, the sampled table, the
+    scaling factor and the output columns that were scaled or left unscaled.
+    """
+    percent = Config.SAMPLE_PERCENT if percent is None else percent
+    if not 0 < percent < 100:
+        return None
+    clauses = split_clauses(sql or "")
+    if not clauses or "from" not in clauses:
+        return None
+    # sqlparse does not know TABLESAMPLE as a keyword, so compare the text
+    if any(tok.value.upper() == "TABLESAMPLE" for tok in _significant(_flat_tokens(sql))):
+        return None
+    from_clause, table = _sample_first_table(clauses["from"], percent)
+    if from_clause is None:
+        return None
+    clauses["from"] = from_clause
+
+    items = [parse_select_item(item) for item in split_top_level(clauses["select"])]
+    scaled_columns, unscaled_columns = [], []
+    rewritten = []
+    for (expr, alias), name in zip(items, output_names(items)):
+        scaled_expr, scaled, unscaled = scale_aggregates(expr, percent)
+        if scaled:
+            scaled_columns.append(name)
+        elif unscaled or has_aggregate(expr):
+            unscaled_columns.append(name)
+        # Aggregates without an alias stay anonymous, so the output names do not change
+        rewritten.append(f"{scaled_expr} AS {alias}" if alias else scaled_expr)
+    clauses["select"] = ", ".join(rewritten)
+    if clauses.get("having"):
+        clauses["having"] = scale_aggregates(clauses["having"], percent)[0]
+
+    return strip_statement(join_clauses(clauses)), {
+        'percent': percent,
+        'table': table,
+        'factor': 100.0 / percent,
+        'scaled': scaled_columns,
+        'unscaled': unscaled_columns
+    }
+
+def preview_query(sql, rows=None, percent=None):
+    """A cheap first look at a query's rows: its sampled form with a LIMIT of rows, or None if it cannot be sampled"""
+    sampled = sample_query(sql, percent)
+    if sampled is None:
+        return None
+    return _enforce_limit(sampled[0], rows or Config.PROGRESSIVE_PREVIEW_ROWS, [])
@@ -0,0 +1,261 @@
+"""
+Process-wide admission control for LLM calls and BigQuery jobs.
+
+Every request takes a slot from a FairScheduler before it runs. A scheduler
+enforces a global and a per-user concurrency limit plus token-bucket rate
+limits, serves interactive requests before batch/background ones, and within
+a priority serves the user who has had the fewest recent requests first, so
+one power user cannot starve everyone else. Request counts decay with a
+half-life of SCHEDULER_FAIRNESS_HALF_LIFE, and idle users are forgotten.
+"""
+
+import heapq
+import itertools
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+import streamlit as st
+from config import Config
+
+INTERACTIVE = 0
+BATCH = 1
+
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BATCH: "batch"}
+
+# Idle users are dropped at most this often, once their decayed count is below _FORGOTTEN
+_PRUNE_INTERVAL = 60.0
+_FORGOTTEN = 0.05
+
+class QueueTimeoutError(Exception):
+    """Raised when a request waited longer than the scheduler allows"""
+
+class TokenBucket:
+    """Classic token bucket; rate is tokens per second"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self):
+        """True if a token can be taken now (caller holds the scheduler lock)"""
+        self._refill()
+        return self.tokens >= 1
+
+    def take(self):
+        self._refill()
+        self.tokens -= 1
+
+    def is_full(self, now):
+        """True once the bucket has refilled completely, when it is the same as a new one"""
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+    def wait_time(self):
+        """Seconds until the next token is available"""
+        self._refill()
+        if self.tokens >= 1 or self.rate <= 0:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+class FairScheduler:
+    """Concurrency limits, rate limits, priorities and per-user fairness"""
+
+    def __init__(self, name, max_concurrency, per_user_concurrency, rate_per_minute, user_rate_per_minute,
+                 half_life=None):
+        self.name = name
+        self.half_life = half_life or Config.SCHEDULER_FAIRNESS_HALF_LIFE
+        self.max_concurrency = max_concurrency
+        self.per_user_concurrency = per_user_concurrency
+        self.user_rate_per_minute = user_rate_per_minute
+        self._bucket = TokenBucket(rate_per_minute / 60.0, max(1, max_concurrency))
+        self._user_buckets = {}
+        self._cond = threading.Condition()
+        self._waiting = []  # heap of (priority, served, seq, user_id)
+        self._seq = itertools.count()
+        self._active = defaultdict(int)
+        self._served = {}  # user_id -> (decayed request count, time.monotonic() it was decayed to)
+        self._pruned = time.monotonic()
+        self.stats = {'admitted': 0, 'rejected': 0, 'total_wait': 0.0, 'max_depth': 0}
+
+    def _user_bucket(self, user_id):
+        if user_id not in self._user_buckets:
+            self._user_buckets[user_id] = TokenBucket(
+                self.user_rate_per_minute / 60.0, max(1, self.per_user_concurrency)
+            )
+        return self._user_buckets[user_id]
+
+    def _served_count(self, user_id, now):
+        """Requests admitted for a user, each counting half as much every half-life"""
+        count, updated = self._served.get(user_id, (0.0, now))
+        return count * 0.5 ** ((now - updated) / self.half_life)
+
+    def _prune(self, now):
+        """Forget users with nothing running or queued whose count has decayed away (caller holds the lock)"""
+        if now - self._pruned < _PRUNE_INTERVAL:
+            return
+        self._pruned = now
+        busy = set(self._active) | {ticket[3] for ticket in self._waiting}
+        for user_id in [user for user in self._served if user not in busy]:
+            if self._served_count(user_id, now) < _FORGOTTEN:
+                del self._served[user_id]
+        for user_id in [user for user in self._user_buckets if user not in busy]:
+            if self._user_buckets[user_id].is_full(now):
+                del self._user_buckets[user_id]
+
+    def _eligible(self, user_id):
+        return (self._active[user_id] < self.per_user_concurrency
+                and self._bucket.available()
+                and self._user_bucket(user_id).available())
+
+    def _position(self, ticket):
+        """1-based position of a ticket among waiting requests"""
+        return sorted(self._waiting).index(ticket) + 1
+
+    def _can_admit(self, ticket):
+        """Admit the first waiting ticket (in fair order) whose user is eligible"""
+        if sum(self._active.values()) >= self.max_concurrency:
+            return False
+        for candidate in sorted(self._waiting):
+            if self._eligible(candidate[3]):
+                return candidate == ticket
+        return False
+
+    @contextmanager
+    def slot(self, user_id, priority=INTERACTIVE, on_wait=None, timeout=None):
+        """Block until the request may run; on_wait(position) is called while queued"""
+        timeout = Config.SCHEDULER_MAX_WAIT if timeout is None else timeout
+        started = time.monotonic()
+        with self._cond:
+            ticket = (priority, self._served_count(user_id, started), next(self._seq), user_id)
+            heapq.heappush(self._waiting, ticket)
+            self.stats['max_depth'] = max(self.stats['max_depth'], len(self._waiting))
+        try:
+            last_position = None
+            while True:
+                with self._cond:
+                    if self._can_admit(ticket):
+                        self._waiting.remove(ticket)
+                        heapq.heapify(self._waiting)
+                        self._bucket.take()
+                        self._user_bucket(user_id).take()
+                        self._active[user_id] += 1
+                        now = time.monotonic()
+                        self._served[user_id] = (self._served_count(user_id, now) + 1, now)
+                        self._prune(now)
+                        self.stats['admitted'] += 1
+                        self.stats['total_wait'] += time.monotonic() - started
+                        break
+                    waited = time.monotonic() - started
+                    if waited >= timeout:
+                        self.stats['rejected'] += 1
+                        raise QueueTimeoutError(
+                            f"{self.name} is busy; waited {waited:.0f}s without getting a slot"
+                        )
+                    position = self._position(ticket)
+                    if on_wait is None or position == last_position:
+                        # Wake up for token refills even if nobody releases a slot
+                        pause = max(self._bucket.wait_time(), self._user_bucket(user_id).wait_time(), 0.05)
+                        self._cond.wait(timeout=min(pause, 1.0, timeout - waited))
+                        continue
+                last_position = position
+                # Outside the lock: a Streamlit callback may raise to stop or rerun the script
+                on_wait(position)
+        except BaseException:
+            # A ticket left behind would be picked first forever and block everyone queued after it
+            with self._cond:
+                if ticket in self._waiting:
+                    self._waiting.remove(ticket)
+                    heapq.heapify(self._waiting)
+                self._cond.notify_all()
+            raise
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active[user_id] -= 1
+                if not self._active[user_id]:
+                    del self._active[user_id]
+                self._cond.notify_all()
+
+    def snapshot(self):
+        """Queue depth and counters"""
+        with self._cond:
+            depth = defaultdict(int)
+            for priority, _, _, _ in self._waiting:
+                depth[PRIORITY_NAMES.get(priority, str(priority))] += 1
+            admitted = self.stats['admitted']
+            return {
+                'active': sum(self._active.values()),
+                'queued': len(self._waiting),
+                'queued_by_priority': dict(depth),
+                'admitted': admitted,
+                'rejected': self.stats['rejected'],
+                'max_depth': self.stats['max_depth'],
+                'avg_wait': self.stats['total_wait'] / admitted if admitted else 0.0
+            }
+
+LLM_SCHEDULER = FairScheduler(
+    "LLM",
+    max_concurrency=Config.LLM_MAX_CONCURRENCY,
+    per_user_concurrency=Config.LLM_PER_USER_CONCURRENCY,
+    rate_per_minute=Config.LLM_RATE_PER_MINUTE,
+    user_rate_per_minute=Config.LLM_USER_RATE_PER_MINUTE
+)
+BIGQUERY_SCHEDULER = FairScheduler(
+    "BigQuery",
+    max_concurrency=Config.BIGQUERY_MAX_CONCURRENCY,
+    per_user_concurrency=Config.BIGQUERY_PER_USER_CONCURRENCY,
+    rate_per_minute=Config.BIGQUERY_RATE_PER_MINUTE,
+    user_rate_per_minute=Config.BIGQUERY_USER_RATE_PER_MINUTE
+)
+
+def scheduler_stats():
+    """Snapshot of every scheduler"""
+    return {scheduler.name: scheduler.snapshot() for scheduler in (LLM_SCHEDULER, BIGQUERY_SCHEDULER)}
+
+def current_user_id():
+    """Identify the requesting user: signed-in email, else the Streamlit session"""
+    try:
+        email = st.experimental_user.email
+        if email:
+            return email
+    except Exception:
+        pass
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        ctx = get_script_run_ctx()
+        if ctx is not None:
+            return ctx.session_id
+    except Exception:
+        pass
+    return "background"
+
+@contextmanager
+def scheduled(scheduler, priority=INTERACTIVE):
+    """Take a scheduler slot for the current user, showing the queue position while waiting"""
+    user_id = current_user_id()
+    placeholder = None
+
+    def on_wait(position):
+        nonlocal placeholder
+        if priority != INTERACTIVE or user_id == "background":
+            return
+        if placeholder is None:
+            placeholder = st.empty()
+        placeholder.info(f"⏳ {scheduler.name} is busy — you are number {position} in the queue")
+
+    try:
+        with scheduler.slot(user_id, priority=priority, on_wait=on_wait):
+            if placeholder is not None:
+                placeholder.empty()
+            yield
+    finally:
+        if placeholder is not None:
+            placeholder.empty()
@@ -0,0 +1,271 @@
+import bisect
+import hashlib
+import json
+import re
+import threading
+from collections import OrderedDict, defaultdict
+from config import Config
+from tokens import count_tokens
+
+# Short type names used in the compact prompt encoding
+TYPE_ABBREVIATIONS = {
+    "STRING": "str",
+    "INT64": "int",
+    "INTEGER": "int",
+    "FLOAT64": "float",
+    "FLOAT": "float",
+    "NUMERIC": "num",
+    "BIGNUMERIC": "bignum",
+    "BOOL": "bool",
+    "BOOLEAN": "bool",
+    "DATE": "date",
+    "DATETIME": "datetime",
+    "TIMESTAMP": "ts",
+    "TIME": "time",
+    "RECORD": "struct",
+    "STRUCT": "struct",
+    "BYTES": "bytes",
+    "GEOGRAPHY": "geo",
+    "JSON": "json"
+}
+
+COMPACT_LEGEND = "# table(column:type, ...) -- description"
+
+_ENCODED_CACHE = OrderedDict()
+_ENCODED_CACHE_SIZE = 64
+_cache_lock = threading.Lock()
+
+def schema_fingerprint(table_schemas):
+    """Stable hash of the table schemas used to generate SQL"""
+    payload = json.dumps(table_schemas, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+def format_schemas_verbose(table_schemas):
+    """Original multi-line schema format: one line per column plus a description line"""
+    lines = []
+    for table_name, schema_info in table_schemas.items():
+        lines.append("")
+        lines.append(f"Table: {table_name}")
+        lines.append(f"Description: {schema_info.get('description', 'No description')}")
+        lines.append("Columns:")
+        for col_name, col_type in schema_info.get('columns', {}).items():
+            lines.append(f"  - {col_name}: {col_type}")
+        lines.append("")
+    return "\n".join(lines) + "\n"
+
+def partition_info(schema_info):
+    """(column, type) of the time partitioning column, or None.
+
+    Ingestion-time partitioned tables use the _PARTITIONTIME pseudo column;
+    integer-range partitioning is not used for pruning and returns None.
+    """
+    partitioning = (schema_info or {}).get("partitioning")
+    if not partitioning or partitioning.get("type") == "RANGE":
+        return None
+    field = partitioning.get("field")
+    if not field:
+        return "_PARTITIONTIME", "TIMESTAMP"
+    return field, str(schema_info.get("columns", {}).get(field, "TIMESTAMP")).upper()
+
+def clustering_columns(schema_info):
+    """Clustering columns in order, possibly empty"""
+    return list((schema_info or {}).get("clustering", []))
+
+def abbreviate_type(col_type):
+    """Short name for a BigQuery type"""
+    return TYPE_ABBREVIATIONS.get(str(col_type).upper(), str(col_type).lower())
+
+def column_priority(col_name, col_type):
+    """Higher values are kept longer when the schema has to be trimmed to the budget"""
+    name = col_name.lower()
+    col_type = str(col_type).upper()
+    if name in (c.lower() for c in Config.SCHEMA_PRIORITY_COLUMNS):
+        return 4
+    if col_type in ("DATE", "DATETIME", "TIMESTAMP") or name.endswith("_id") or name.endswith("_name") or name == "id":
+        return 3
+    if col_type in ("INT64", "INTEGER", "FLOAT64", "FLOAT", "NUMERIC", "BIGNUMERIC"):
+        return 2
+    return 1
+
+def _table_line(table_name, columns, description, dropped, layout=""):
+    """One compact line for a table"""
+    parts = [f"{name}:{abbreviate_type(col_type)}" for name, col_type in columns]
+    if dropped:
+        parts.append(f"...+{dropped}")
+    line = f"{table_name}({', '.join(parts)}){layout}"
+    if description and description != "No description available":
+        line += f" -- {description}"
+    return line
+
+def encode_schemas(table_schemas, include_descriptions=True, token_budget=None):
+    """Compact schema encoding, one line per table, trimmed to a token budget.
+
+    When the encoding is over budget, descriptions are dropped first and then
+    the lowest-priority columns, never the last column of a table. Results
+    are cached per schema fingerprint.
+    """
+    key = (schema_fingerprint(table_schemas), include_descriptions, token_budget)
+    with _cache_lock:
+        if key in _ENCODED_CACHE:
+            _ENCODED_CACHE.move_to_end(key)
+            return _ENCODED_CACHE[key]
+
+    encoded = _encode(table_schemas, include_descriptions, token_budget)
+
+    with _cache_lock:
+        _ENCODED_CACHE[key] = encoded
+        while len(_ENCODED_CACHE) > _ENCODED_CACHE_SIZE:
+            _ENCODED_CACHE.popitem(last=False)
+    return encoded
+
+def _layout(schema_info):
+    """Partition and cluster columns, so the model can write filters that prune"""
+    notes = []
+    partition = partition_info(schema_info)
+    if partition:
+        notes.append(f"partition:{partition[0]}")
+    clustering = clustering_columns(schema_info)
+    if clustering:
+        notes.append(f"cluster:{','.join(clustering)}")
+    return f" [{'; '.join(notes)}]" if notes else ""
+
+def _encode(table_schemas, include_descriptions, token_budget):
+    tables = {
+        name: {
+            'columns': list(info.get('columns', {}).items()),
+            'description': info.get('description', '') if include_descriptions else '',
+            'layout': _layout(info),
+            'dropped': 0
+        }
+        for name, info in table_schemas.items()
+    }
+
+    def render(name):
+        table = tables[name]
+        return _table_line(name, table['columns'], table['description'], table['dropped'], table['layout'])
+
+    line_tokens = {name: count_tokens(render(name)) for name in tables}
+    legend_tokens = count_tokens(COMPACT_LEGEND)
+
+    def total():
+        return legend_tokens + sum(line_tokens.values()) + len(line_tokens)
+
+    if token_budget and total() > token_budget:
+        for name, table in tables.items():
+            if table['description']:
+                table['description'] = ''
+                line_tokens[name] = count_tokens(render(name))
+
+    if token_budget and total() > token_budget:
+        # Drop columns from lowest to highest priority; later columns go first within a tier
+        candidates = []
+        for name, table in tables.items():
+            for position, (col_name, col_type) in enumerate(table['columns']):
+                candidates.append((column_priority(col_name, col_type), -position, name, col_name))
+        candidates.sort()
+        for _, _, name, col_name in candidates:
+            if total() <= token_budget:
+                break
+            table = tables[name]
+            if len(table['columns']) <= 1:
+                continue
+            table['columns'] = [col for col in table['columns'] if col[0] != col_name]
+            table['dropped'] += 1
+            line_tokens[name] = count_tokens(render(name))
+
+    return "\n".join([COMPACT_LEGEND] + [render(name) for name in tables])
+
+_TERM_RE = re.compile(r"[a-z0-9]+")
+
+def _catalog_terms(text):
+    """Lower-case words of a name or description; identifiers split on underscores"""
+    return _TERM_RE.findall((text or "").lower())
+
+class CatalogIndex:
+    """Prebuilt search index over table names, column names and descriptions.
+
+    Every query term must match (as a prefix) a word of the table name, one of
+    its columns or its description. Table-name matches rank above column
+    matches, which rank above description matches.
+    """
+
+    TABLE_WEIGHT = 3
+    COLUMN_WEIGHT = 2
+    DESCRIPTION_WEIGHT = 1
+
+    def __init__(self, table_schemas):
+        self.tables = sorted(table_schemas)
+        self._postings = defaultdict(dict)  # term -> {table: weight}
+        self._columns = defaultdict(lambda: defaultdict(set))  # term -> table -> matching columns
+        for table, info in table_schemas.items():
+            self._add(_catalog_terms(table), table, self.TABLE_WEIGHT)
+            for column in info.get('columns', {}):
+                for term in _catalog_terms(column):
+                    self._add([term], table, self.COLUMN_WEIGHT)
+                    self._columns[term][table].add(column)
+            self._add(_catalog_terms(info.get('description', '')), table, self.DESCRIPTION_WEIGHT)
+        self._terms = sorted(self._postings)
+
+    def _add(self, terms, table, weight):
+        for term in terms:
+            postings = self._postings[term]
+            postings[table] = max(postings.get(table, 0), weight)
+
+    def _expand(self, prefix):
+        """Indexed terms starting with prefix"""
+        start = bisect.bisect_left(self._terms, prefix)
+        end = bisect.bisect_left(self._terms, prefix + "\uffff")
+        return self._terms[start:end]
+
+    def search(self, query):
+        """Matching tables as (table, matching columns), best first; every table for an empty query"""
+        terms = _catalog_terms(query)
+        if not terms:
+            return [(table, []) for table in self.tables]
+
+        scores = None
+        matched_columns = defaultdict(set)
+        for term in terms:
+            term_scores = {}
+            for indexed in self._expand(term):
+                # Whole-word matches rank above prefix matches
+                bonus = 0.5 if indexed == term else 0
+                for table, weight in self._postings[indexed].items():
+                    term_scores[table] = max(term_scores.get(table, 0), weight + bonus)
+                for table, columns in self._columns.get(indexed, {}).items():
+                    matched_columns[table] |= columns
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {table: score + term_scores[table] for table, score in scores.items() if table in term_scores}
+            if not scores:
+                return []
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return [(table, sorted(matched_columns.get(table, ()))) for table, _ in ranked]
+
+    def __len__(self):
+        return len(self.tables)
+
+def compare_schema_token_counts(table_schemas, token_budget=None):
+    """Token counts of the verbose and compact encodings of the same schemas"""
+    verbose = format_schemas_verbose(table_schemas)
+    compact = encode_schemas(table_schemas, token_budget=token_budget)
+    verbose_tokens = count_tokens(verbose)
+    compact_tokens = count_tokens(compact)
+    return {
+        'verbose_tokens': verbose_tokens,
+        'compact_tokens': compact_tokens,
+        'saved_tokens': verbose_tokens - compact_tokens,
+        'saved_pct': 100.0 * (verbose_tokens - compact_tokens) / verbose_tokens if verbose_tokens else 0.0
+    }
+
+if __name__ == "__main__":
+    from tokens import tokenizer_name
+    counts = compare_schema_token_counts(Config.SAMPLE_TABLES)
+    print(f"Tokenizer: {tokenizer_name()}")
+    print(f"Verbose schema: {counts['verbose_tokens']} tokens")
+    print(f"Compact schema: {counts['compact_tokens']} tokens")
+    print(f"Saved: {counts['saved_tokens']} tokens ({counts['saved_pct']:.0f}%)")
+    print()
+    print(encode_schemas(Config.SAMPLE_TABLES))
@@ -0,0 +1,131 @@
+"""
+Process-wide single-flight deduplication.
+
+When several Streamlit sessions issue the same request at the same moment
+(e.g. everyone clicking the same sample question at 9am), only the first
+caller does the work; the others wait for it and share its result.
+
+If the first caller is interrupted (its Streamlit script was stopped or
+rerun) while others are waiting, the work it started can be detached and
+finished on a background thread for them instead of being abandoned.
+"""
+
+import contextvars
+import threading
+
+_current_flight = contextvars.ContextVar("current_flight", default=None)
+
+class _Call:
+    """One in-flight call and the callers waiting on it"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+        self.detached = False
+
+class Flight:
+    """The call the current leader is running, as seen from inside fn()"""
+
+    def __init__(self, group, key, call):
+        self.group = group
+        self.key = key
+        self.call = call
+
+    def detach(self, finish):
+        """If other callers wait on this call, complete it with finish() on a background thread.
+
+        Returns False (and does nothing) when nobody else is waiting.
+        """
+        with self.group._lock:
+            if not self.call.waiters:
+                return False
+            self.call.detached = True
+        context = contextvars.copy_context()
+        threading.Thread(
+            target=context.run, args=(self.group._finish_detached, self.key, self.call, finish),
+            name=f"{self.group.name}-detached", daemon=True
+        ).start()
+        return True
+
+def current_flight():
+    """The single-flight call the calling code runs as leader, or None"""
+    return _current_flight.get()
+
+class SingleFlight:
+    """Coalesces concurrent calls that share a key"""
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.stats = {'requests': 0, 'executed': 0, 'coalesced': 0}
+
+    def do(self, key, fn):
+        """Run fn() for key, or wait for the identical call already in flight"""
+        with self._lock:
+            self.stats['requests'] += 1
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.stats['coalesced'] += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self.stats['executed'] += 1
+                leader = True
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        token = _current_flight.set(Flight(self, key, call))
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        except BaseException:
+            # The leader's script was stopped or rerun; unless the work was detached
+            # for them, waiters get an error rather than its control exception
+            if not call.detached:
+                call.error = RuntimeError(f"The {self.name} call was cancelled by the session that started it")
+            raise
+        finally:
+            _current_flight.reset(token)
+            if not call.detached:
+                self._complete(key, call)
+        return call.result
+
+    def _complete(self, key, call):
+        with self._lock:
+            self._calls.pop(key, None)
+        call.event.set()
+
+    def _finish_detached(self, key, call, finish):
+        try:
+            call.result = finish()
+        except Exception as e:
+            call.error = e
+        finally:
+            self._complete(key, call)
+
+    def in_flight(self):
+        """Number of distinct calls currently running"""
+        with self._lock:
+            return len(self._calls)
+
+# Process-wide groups shared by every session
+LLM_FLIGHTS = SingleFlight("llm")
+QUERY_FLIGHTS = SingleFlight("bigquery")
+
+def singleflight_stats():
+    """Counters for every single-flight group"""
+    return {
+        group.name: dict(group.stats, in_flight=group.in_flight())
+        for group in (LLM_FLIGHTS, QUERY_FLIGHTS)
+    }
@@ -0,0 +1,198 @@
+"""
+Cost-reducing rewrites applied to SQL before it is sent to BigQuery.
+
+- Subqueries and CTEs that read `SELECT *` from a table are narrowed to the
+  columns the rest of the statement uses.
+- SELECTs over a time-partitioned table get a partition filter: an
+  EXTRACT(YEAR FROM col) = N filter gains the equivalent range on the
+  partition column. Only if PARTITION_FILTER_DAYS is set, queries without any
+  filter on it are limited to the last that many days; unlike the other
+  rewrites this changes the result, and limits_rows() reports it.
+- The top-level LIMIT is added or lowered to MAX_QUERY_RESULTS.
+
+Every rewrite is described in the returned list of changes.
+"""
+
+import re
+from sqlparse import tokens as T
+from config import Config
+from schema_catalog import partition_info
+from sql_utils import (
+    _flat_tokens, _significant, add_where_predicate, column_references, join_clauses,
+    normalize_expression, split_clauses, split_conjuncts, split_table_reference,
+    strip_statement, table_name_from_path, tokens_with_offsets
+)
+
+_EXTRACT_YEAR_RE = re.compile(r"^extract\(year from ([\w.`]+)\)\s*=\s*(\d{4})$")
+
+# Start of the change message of the one rewrite that drops rows
+_RECENT_PARTITIONS_CHANGE = "Limited "
+# Starts of the LIMIT change messages; a LIMIT caps the rows returned, not the bytes scanned
+_LIMIT_CHANGES = ("Added LIMIT", "Lowered LIMIT")
+
+def _schema_for(table_name, table_schemas):
+    for name, info in (table_schemas or {}).items():
+        if name.lower() == table_name.lower():
+            return info
+    return None
+
+def _selects_star(sql):
+    """True if any select list in the text contains * or alias.*"""
+    tokens = _significant(_flat_tokens(sql))
+    for index, tok in enumerate(tokens):
+        if tok.value != "*" or index == 0:
+            continue
+        previous = tokens[index - 1]
+        if previous.value in (",", ".") or (previous.is_keyword and previous.normalized in ("SELECT", "DISTINCT")):
+            return True
+    return False
+
+def _subquery_blocks(sql):
+    """(start, end) offsets of the innermost parenthesized SELECT bodies"""
+    stack = []
+    blocks = []
+    tokens = tokens_with_offsets(sql)
+    for index, (offset, tok) in enumerate(tokens):
+        if tok.ttype is T.Punctuation and tok.value == "(":
+            stack.append(index)
+        elif tok.ttype is T.Punctuation and tok.value == ")" and stack:
+            opened = stack.pop()
+            inner = [t for _, t in tokens[opened + 1:index] if not t.is_whitespace and t.ttype not in T.Comment]
+            if inner and inner[0].is_keyword and inner[0].normalized == "SELECT":
+                blocks.append((tokens[opened][0] + 1, offset))
+    return [
+        (start, end) for start, end in blocks
+        if not any(start < other_start and other_end < end for other_start, other_end in blocks)
+    ]
+
+def _has_bare_reference(conjunct, column):
+    """True if the column appears in the condition outside any function call"""
+    depth = 0
+    for tok in _significant(_flat_tokens(conjunct)):
+        if tok.ttype is T.Punctuation and tok.value == "(":
+            depth += 1
+        elif tok.ttype is T.Punctuation and tok.value == ")":
+            depth -= 1
+        elif depth == 0 and tok.ttype in T.Name and tok.value.strip("`").lower() == column.lower():
+            return True
+    return False
+
+def _year_range(column, col_type, year):
+    if col_type == "DATE":
+        return f"{column} BETWEEN DATE '{year}-01-01' AND DATE '{year}-12-31'"
+    literal = "DATETIME" if col_type == "DATETIME" else "TIMESTAMP"
+    return f"{column} >= {literal} '{year}-01-01' AND {column} < {literal} '{year + 1}-01-01'"
+
+def _recent_partitions(column, col_type, days):
+    if col_type == "DATE":
+        return f"{column} >= DATE_SUB(CURRENT_DATE(), INTERVAL {days} DAY)"
+    if col_type == "DATETIME":
+        return f"{column} >= DATETIME_SUB(CURRENT_DATETIME(), INTERVAL {days} DAY)"
+    return f"{column} >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL {days} DAY)"
+
+def _partition_filter(clauses, table, alias, schema, changes):
+    """Add or tighten the partition predicate of a single-table SELECT; True if changed"""
+    partition = partition_info(schema)
+    if partition is None:
+        return False
+    column, col_type = partition
+    qualified = f"{alias}.{column}" if alias else column
+    conjuncts = split_conjuncts(clauses.get("where", ""))
+
+    if any(_has_bare_reference(conjunct, column) for conjunct in conjuncts):
+        return False
+
+    for conjunct in conjuncts:
+        match = _EXTRACT_YEAR_RE.match(normalize_expression(conjunct))
+        if match and table_name_from_path(match.group(1)).lower() == column.lower():
+            clauses["where"] = add_where_predicate(clauses.get("where"), _year_range(qualified, col_type, int(match.group(2))))
+            changes.append(f"Added a range on partition column {column} of {table} equivalent to its EXTRACT(YEAR) filter")
+            return True
+
+    if any(name.lower() == column.lower() for conjunct in conjuncts for _, name in column_references(conjunct)):
+        # Filtered through some other function; leave it rather than guess
+        return False
+    if Config.PARTITION_FILTER_DAYS <= 0:
+        return False
+    clauses["where"] = add_where_predicate(
+        clauses.get("where"), _recent_partitions(qualified, col_type, Config.PARTITION_FILTER_DAYS)
+    )
+    changes.append(
+        f"{_RECENT_PARTITIONS_CHANGE}{table} to the last {Config.PARTITION_FILTER_DAYS} days of partition column {column}"
+    )
+    return True
+
+def _rewrite_block(block, outside, table_schemas, changes, top_level=False):
+    """Rewrite one simple single-table SELECT; returns the (possibly unchanged) text"""
+    clauses = split_clauses(block)
+    if clauses is None or "from" not in clauses:
+        return block
+    reference = split_table_reference(clauses["from"])
+    if reference is None:
+        return block
+    path, alias = reference
+    table = table_name_from_path(path)
+    schema = _schema_for(table, table_schemas)
+    if schema is None:
+        return block
+    changed = False
+
+    columns = list(schema.get("columns", {}))
+    if not top_level and clauses["select"].strip() == "*" and columns and not _selects_star(outside):
+        used = {name.lower() for _, name in column_references(outside)}
+        kept = [col for col in columns if col.lower() in used] or columns[:1]
+        if len(kept) < len(columns):
+            clauses["select"] = ", ".join(kept)
+            changes.append(f"Narrowed SELECT * on {table} to the {len(kept)} of {len(columns)} columns used")
+            changed = True
+
+    changed = _partition_filter(clauses, table, alias, schema, changes) or changed
+    return join_clauses(clauses) if changed else block
+
+def _enforce_limit(sql, max_results, changes):
+    """Add a top-level LIMIT or lower one above max_results"""
+    depth = 0
+    limit_token = None
+    tokens = tokens_with_offsets(sql)
+    for index, (offset, tok) in enumerate(tokens):
+        if tok.ttype is T.Punctuation and tok.value == "(":
+            depth += 1
+        elif tok.ttype is T.Punctuation and tok.value == ")":
+            depth -= 1
+        elif depth == 0 and tok.is_keyword and tok.normalized == "LIMIT":
+            following = [(o, t) for o, t in tokens[index + 1:] if not t.is_whitespace]
+            limit_token = following[0] if following else None
+    if limit_token is None:
+        changes.append(f"Added LIMIT {max_results}")
+        return f"{sql}\nLIMIT {max_results}"
+    offset, tok = limit_token
+    if tok.ttype in T.Literal.Number.Integer and int(tok.value) > max_results:
+        changes.append(f"Lowered LIMIT {tok.value} to {max_results}")
+        return sql[:offset] + str(max_results) + sql[offset + len(tok.value):]
+    return sql
+
+def limits_rows(changes):
+    """True if the rewrites include a PARTITION_FILTER_DAYS window, so the result covers only recent data"""
+    return any(change.startswith(_RECENT_PARTITIONS_CHANGE) for change in changes)
+
+def reduces_scan(changes):
+    """True if a rewrite other than the LIMIT can change the bytes scanned, so comparing dry runs is worthwhile"""
+    return any(not change.startswith(_LIMIT_CHANGES) for change in changes)
+
+def rewrite_for_cost(sql, table_schemas=None, max_results=None):
+    """Return (rewritten_sql, changes) for a read-only query"""
+    sql = strip_statement(sql or "")
+    changes = []
+    if not sql:
+        return sql, changes
+
+    # Innermost subqueries first; later offsets first so earlier ones stay valid
+    for start, end in sorted(_subquery_blocks(sql), reverse=True):
+        body = sql[start:end]
+        rewritten = _rewrite_block(body, sql[:start] + sql[end:], table_schemas, changes)
+        if rewritten != body:
+            sql = sql[:start] + rewritten + sql[end:]
+
+    sql = _rewrite_block(sql, "", table_schemas, changes, top_level=True)
+    sql = _enforce_limit(sql, max_results or Config.MAX_QUERY_RESULTS, changes)
+    return sql, changes
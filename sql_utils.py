@@ -0,0 +1,427 @@
+import re
+import sqlparse
+from sqlparse import tokens as T
+
+# Top-level clauses of a simple SELECT, in the order they appear
+CLAUSE_ORDER = ["select", "from", "where", "group by", "having", "qualify", "order by", "limit"]
+
+# Keywords that make a statement more than a single SELECT block
+_COMPOUND_KEYWORDS = {"UNION", "UNION ALL", "UNION DISTINCT", "INTERSECT", "EXCEPT", "WITH", "WINDOW"}
+
+_AGGREGATE_RE = re.compile(r"^(SUM|COUNT|MIN|MAX|AVG)\s*\((.*)\)$", re.IGNORECASE | re.DOTALL)
+
+
+def _flat_tokens(sql):
+    """Return the flattened sqlparse tokens of a SQL string, comments removed"""
+    statements = sqlparse.parse(sql)
+    if not statements:
+        return []
+    return [tok for tok in statements[0].flatten() if tok.ttype not in T.Comment]
+
+
+def _significant(tokens):
+    """Drop whitespace and newline tokens"""
+    return [tok for tok in tokens if not tok.is_whitespace]
+
+
+def strip_statement(sql):
+    """Strip surrounding whitespace and a trailing semicolon"""
+    return sql.strip().rstrip(";").strip()
+
+
+def normalize_expression(text):
+    """Normalize an expression or clause for comparison (case, quoting and spacing)"""
+    parts = []
+    for tok in _significant(_flat_tokens(text)):
+        value = tok.value
+        if tok.ttype in T.String:
+            parts.append(value)
+        else:
+            parts.append(value.strip("`").lower())
+    normalized = " ".join(parts)
+    normalized = re.sub(r"\s*([().,])\s*", r"\1", normalized)
+    return normalized.rstrip(";")
+
+
+def normalize_sql(sql):
+    """Normalize a whole statement so equivalent spellings share a cache key"""
+    return normalize_expression(strip_statement(sql))
+
+
+def split_clauses(sql):
+    """Split a single SELECT statement into its top-level clauses.
+
+    Returns a dict keyed by lower-case clause name, or None when the statement
+    is not a plain SELECT (CTEs, set operations and DML are not handled).
+    """
+    tokens = _flat_tokens(strip_statement(sql))
+    if not tokens:
+        return None
+
+    clauses = {}
+    current = None
+    depth = 0
+    for tok in tokens:
+        if tok.ttype is T.Punctuation and tok.value == "(":
+            depth += 1
+        elif tok.ttype is T.Punctuation and tok.value == ")":
+            depth -= 1
+
+        if depth == 0 and tok.is_keyword:
+            keyword = " ".join(tok.normalized.split())
+            if keyword in _COMPOUND_KEYWORDS:
+                return None
+            name = keyword.lower()
+            if name in CLAUSE_ORDER and name not in clauses:
+                if current is None and name != "select":
+                    return None
+                current = name
+                clauses[current] = ""
+                continue
+            if current is None:
+                return None
+
+        if current is None:
+            if tok.is_whitespace:
+                continue
+            return None
+        clauses[current] += tok.value
+
+    if "select" not in clauses:
+        return None
+    return {name: text.strip() for name, text in clauses.items()}
+
+
+def join_clauses(clauses):
+    """Rebuild a SQL statement from a clause dict produced by split_clauses"""
+    parts = []
+    for name in CLAUSE_ORDER:
+        text = clauses.get(name)
+        if text:
+            parts.append(f"{name.upper()} {text}")
+    return "\n".join(parts)
+
+
+def _split_tokens(text, is_separator):
+    """Split text on top-level tokens accepted by is_separator"""
+    pieces = []
+    current = ""
+    depth = 0
+    previous = None
+    for tok in _flat_tokens(text):
+        if tok.ttype is T.Punctuation and tok.value == "(":
+            depth += 1
+        elif tok.ttype is T.Punctuation and tok.value == ")":
+            depth -= 1
+        if depth == 0 and is_separator(tok, previous):
+            pieces.append(current.strip())
+            current = ""
+        else:
+            current += tok.value
+        if not tok.is_whitespace:
+            previous = tok
+    if current.strip():
+        pieces.append(current.strip())
+    return pieces
+
+
+def split_top_level(text, separator=","):
+    """Split on a punctuation separator that is not nested in parentheses"""
+    return _split_tokens(text, lambda tok, prev: tok.ttype is T.Punctuation and tok.value == separator)
+
+
+def split_conjuncts(text):
+    """Split a WHERE/HAVING condition into its top-level AND terms"""
+    if not text:
+        return []
+    # AND binds tighter than OR: "a OR b AND c" is one term, not "a OR b" and "c"
+    if len(_split_tokens(text, lambda tok, prev: tok.is_keyword and tok.normalized == "OR")) > 1:
+        return [text.strip()]
+    state = {"between": False}
+
+    def is_and(tok, previous):
+        if tok.is_keyword and tok.normalized == "BETWEEN":
+            state["between"] = True
+        if tok.is_keyword and tok.normalized == "AND":
+            if state["between"]:
+                state["between"] = False
+                return False
+            return True
+        return False
+
+    conjuncts = _split_tokens(text, is_and)
+    # A whole condition wrapped in parentheses is still a single conjunct,
+    # but "(a AND b)" on its own is the same as "a AND b"
+    if len(conjuncts) == 1 and _is_wrapped(conjuncts[0]):
+        inner = conjuncts[0][1:-1].strip()
+        if not any(tok.is_keyword and tok.normalized == "OR" for tok in _flat_tokens(inner)):
+            return split_conjuncts(inner)
+    return conjuncts
+
+
+def _is_wrapped(text):
+    """True if the whole text is enclosed in one pair of parentheses"""
+    text = text.strip()
+    if not (text.startswith("(") and text.endswith(")")):
+        return False
+    depth = 0
+    for index, char in enumerate(text):
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+            if depth == 0 and index != len(text) - 1:
+                return False
+    return True
+
+
+def _strip_trailing(tokens, count):
+    """Text of the tokens minus the last `count` significant tokens"""
+    kept = list(tokens)
+    while count:
+        tok = kept.pop()
+        if not tok.is_whitespace:
+            count -= 1
+    return "".join(tok.value for tok in kept).strip()
+
+
+def parse_select_item(item):
+    """Split a select-list item into (expression, alias or None)"""
+    tokens = _flat_tokens(item)
+    significant = _significant(tokens)
+    if len(significant) >= 3 and significant[-2].is_keyword and significant[-2].normalized == "AS":
+        return _strip_trailing(tokens, 2), significant[-1].value.strip("`")
+    if len(significant) >= 2:
+        last, before = significant[-1], significant[-2]
+        implicit_alias = (last.ttype in T.Name or (last.is_keyword and last.ttype is not T.Keyword.Order)) \
+            and not (before.ttype is T.Punctuation and before.value in (".", "(", ",")) \
+            and not (before.ttype in T.Operator or before.is_keyword)
+        if implicit_alias:
+            return _strip_trailing(tokens, 1), last.value.strip("`")
+    return item.strip(), None
+
+
+def output_name(expr, alias):
+    """Column name BigQuery assigns to a select item"""
+    if alias:
+        return alias
+    tokens = _significant(_flat_tokens(expr))
+    if tokens and all(tok.ttype in T.Name or tok.ttype is T.Punctuation and tok.value == "." for tok in tokens):
+        return tokens[-1].value.strip("`")
+    return None
+
+
+def output_names(items):
+    """Column names BigQuery gives a list of (expr, alias) select items (f0_, f1_, ... when anonymous)"""
+    names = []
+    anonymous = 0
+    for expr, alias in items:
+        name = output_name(expr, alias)
+        if name is None:
+            name = f"f{anonymous}_"
+            anonymous += 1
+        names.append(name)
+    return names
+
+
+def parse_order_item(item):
+    """Split an ORDER BY item into (expression, descending)"""
+    tokens = _flat_tokens(item)
+    significant = _significant(tokens)
+    descending = False
+    trailing = 0
+    for tok in reversed(significant):
+        if tok.ttype is T.Keyword.Order or tok.normalized in ("NULLS FIRST", "NULLS LAST"):
+            descending = descending or tok.normalized == "DESC"
+            trailing += 1
+        else:
+            break
+    return _strip_trailing(tokens, trailing), descending
+
+
+def parse_limit(text):
+    """Parse a LIMIT clause into (limit, offset); returns (None, 0) if absent"""
+    if not text:
+        return None, 0
+    match = re.match(r"^\s*(\d+)\s*(?:OFFSET\s+(\d+))?\s*$", text, re.IGNORECASE)
+    if not match:
+        return None, 0
+    return int(match.group(1)), int(match.group(2) or 0)
+
+
+def parse_aggregate(expr):
+    """Return (FUNCTION, argument) for a bare aggregate call, else None"""
+    match = _AGGREGATE_RE.match(expr.strip())
+    if not match:
+        return None
+    argument = match.group(2).strip()
+    # Reject things like "SUM(a) / SUM(b)" that merely start and end with parens
+    if not _is_wrapped(f"({argument})"):
+        return None
+    return match.group(1).upper(), argument
+
+
+_AGGREGATE_CALL_RE = re.compile(
+    r"\b(SUM|COUNT|COUNTIF|MIN|MAX|AVG|ANY_VALUE|ARRAY_AGG|STRING_AGG|LOGICAL_AND|LOGICAL_OR|APPROX_\w+)\s*\(",
+    re.IGNORECASE,
+)
+
+
+def has_aggregate(text):
+    """True if the text calls an aggregate function"""
+    return bool(_AGGREGATE_CALL_RE.search(text or ""))
+
+
+def has_window(text):
+    """True if the text uses an analytic (OVER) clause"""
+    return any(tok.is_keyword and tok.normalized == "OVER" for tok in _flat_tokens(text or ""))
+
+
+def significant_tokens(text):
+    """Non-whitespace tokens of an expression, used by the predicate parsers"""
+    return _significant(_flat_tokens(text))
+
+
+def column_references(text):
+    """Column identifiers referenced in an expression or clause, as (qualifier, name).
+
+    Function names, type names, aliases introduced with AS and typed literals
+    such as DATE '2024-01-01' are skipped.
+    """
+    tokens = _significant(_flat_tokens(text or ""))
+    references = []
+    index = 0
+    while index < len(tokens):
+        tok = tokens[index]
+        previous = tokens[index - 1] if index else None
+        following = tokens[index + 1] if index + 1 < len(tokens) else None
+        is_name = tok.ttype in T.Name and tok.ttype is not T.Name.Placeholder
+        if not is_name or (previous is not None and previous.is_keyword and previous.normalized == "AS"):
+            index += 1
+            continue
+        if following is not None and following.ttype is T.Punctuation and following.value == "(":
+            index += 1
+            continue
+        if tok.ttype is T.Name.Builtin and following is not None and (following.ttype in T.Literal):
+            index += 1
+            continue
+        if following is not None and following.ttype is T.Punctuation and following.value == "." \
+                and index + 2 < len(tokens) and tokens[index + 2].ttype in T.Name:
+            references.append((tok.value.strip("`"), tokens[index + 2].value.strip("`")))
+            index += 3
+            continue
+        references.append((None, tok.value.strip("`")))
+        index += 1
+    return references
+
+
+def split_table_reference(from_clause):
+    """Split a single-table FROM clause into (table path, alias); None for joins or subqueries"""
+    tokens = _significant(_flat_tokens(from_clause or ""))
+    if not tokens or any(tok.ttype is T.Punctuation and tok.value in ("(", ",") for tok in tokens):
+        return None
+    if any(tok.is_keyword and "JOIN" in tok.normalized for tok in tokens):
+        return None
+    if tokens[0].ttype not in T.Name:
+        return None
+    path = tokens[0].value
+    index = 1
+    while index + 1 < len(tokens) and tokens[index].value in (".", "-") and tokens[index + 1].ttype in T.Name:
+        path += tokens[index].value + tokens[index + 1].value
+        index += 2
+    rest = tokens[index:]
+    if rest and rest[0].is_keyword and rest[0].normalized == "AS":
+        rest = rest[1:]
+    if len(rest) > 1 or not path:
+        return None
+    alias = rest[0].value.strip("`") if rest else None
+    return path, alias
+
+
+def table_name_from_path(path):
+    """Last component of a (possibly back-quoted, project-qualified) table path"""
+    return path.replace("`", "").split(".")[-1]
+
+
+def referenced_tables(sql):
+    """Names of the tables read by a statement (FROM and JOIN targets, CTE names excluded)"""
+    tokens = _significant(_flat_tokens(strip_statement(sql or "")))
+    cte_names = set()
+    for index, tok in enumerate(tokens[:-2]):
+        if tok.ttype in T.Name and tokens[index + 1].is_keyword and tokens[index + 1].normalized == "AS" \
+                and tokens[index + 2].value == "(":
+            cte_names.add(tok.value.strip("`").lower())
+
+    tables = []
+    # FROM inside EXTRACT(... FROM ...) is not a table reference
+    owners = []
+    for index, tok in enumerate(tokens[:-1]):
+        if tok.ttype is T.Punctuation and tok.value == "(":
+            owners.append(tokens[index - 1].value.upper() if index else None)
+            continue
+        if tok.ttype is T.Punctuation and tok.value == ")":
+            if owners:
+                owners.pop()
+            continue
+        if owners and owners[-1] == "EXTRACT":
+            continue
+        if not (tok.is_keyword and (tok.normalized == "FROM" or "JOIN" in tok.normalized)):
+            continue
+        following = tokens[index + 1]
+        if following.ttype not in T.Name:
+            continue
+        path = following.value
+        position = index + 2
+        while position + 1 < len(tokens) and tokens[position].value in (".", "-") \
+                and tokens[position + 1].ttype in T.Name:
+            path += tokens[position].value + tokens[position + 1].value
+            position += 2
+        name = table_name_from_path(path)
+        if name.lower() not in cte_names and name not in tables:
+            tables.append(name)
+    return tables
+
+
+def tokens_with_offsets(sql):
+    """Flattened tokens of a statement (comments included) with their character offsets"""
+    statements = sqlparse.parse(sql)
+    if not statements:
+        return []
+    result = []
+    position = 0
+    for tok in statements[0].flatten():
+        result.append((position, tok))
+        position += len(tok.value)
+    return result
+
+
+def add_where_predicate(where, predicate):
+    """AND a predicate onto a WHERE condition, parenthesizing a top-level OR"""
+    if not where:
+        return predicate
+    depth = 0
+    has_or = False
+    for tok in _flat_tokens(where):
+        if tok.ttype is T.Punctuation and tok.value == "(":
+            depth += 1
+        elif tok.ttype is T.Punctuation and tok.value == ")":
+            depth -= 1
+        elif depth == 0 and tok.is_keyword and tok.normalized == "OR":
+            has_or = True
+    if has_or:
+        where = f"({where})"
+    return f"{where}\n  AND {predicate}"
+
+
+def remove_limit(sql):
+    """Drop the top-level LIMIT (and OFFSET) clause of a statement"""
+    sql = strip_statement(sql)
+    depth = 0
+    for offset, tok in tokens_with_offsets(sql):
+        if tok.ttype is T.Punctuation and tok.value == "(":
+            depth += 1
+        elif tok.ttype is T.Punctuation and tok.value == ")":
+            depth -= 1
+        elif depth == 0 and tok.is_keyword and tok.normalized == "LIMIT":
+            return sql[:offset].rstrip()
+    return sql
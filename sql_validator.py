@@ -0,0 +1,166 @@
+"""
+Local static checks for generated SQL.
+
+Runs in a few milliseconds against the cached table schemas, so queries that
+write data, reference tables or columns that don't exist, or can't be parsed
+fail before a BigQuery dry run is sent.
+"""
+
+import sqlparse
+from sqlparse import tokens as T
+from config import Config
+from sql_utils import _flat_tokens, _significant, column_references, referenced_tables, strip_statement, table_name_from_path
+
+# Statement keywords that modify data or schema
+FORBIDDEN_KEYWORDS = {
+    "INSERT", "UPDATE", "DELETE", "MERGE", "REPLACE", "TRUNCATE", "CREATE", "ALTER",
+    "DROP", "GRANT", "REVOKE", "CALL", "EXECUTE", "DECLARE", "SET", "EXPORT", "LOAD"
+}
+
+# Date-part arguments (DATE_TRUNC(d, WEEK(MONDAY)), EXTRACT(ISOWEEK FROM d)) that sqlparse reads as names
+DATE_PART_NAMES = {
+    "isoweek", "isoyear", "dayofweek", "dayofyear", "millisecond", "microsecond",
+    "monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"
+}
+
+def _forbidden_keyword(tokens):
+    """First data- or schema-modifying keyword in the statement, if any"""
+    for index, tok in enumerate(tokens):
+        if tok.ttype in (T.Keyword.DML, T.Keyword.DDL) or (tok.is_keyword and tok.normalized in FORBIDDEN_KEYWORDS):
+            following = tokens[index + 1] if index + 1 < len(tokens) else None
+            # REPLACE(...) is also a string function
+            if tok.normalized == "SELECT" or (following is not None and following.value == "("):
+                continue
+            return tok.normalized
+    return None
+
+def _has_top_level_limit(tokens):
+    depth = 0
+    for tok in tokens:
+        if tok.ttype is T.Punctuation and tok.value == "(":
+            depth += 1
+        elif tok.ttype is T.Punctuation and tok.value == ")":
+            depth -= 1
+        elif depth == 0 and tok.is_keyword and tok.normalized == "LIMIT":
+            return True
+    return False
+
+def _paren_balance(tokens):
+    depth = 0
+    for tok in tokens:
+        if tok.ttype is T.Punctuation and tok.value == "(":
+            depth += 1
+        elif tok.ttype is T.Punctuation and tok.value == ")":
+            depth -= 1
+            if depth < 0:
+                return depth
+    return depth
+
+def _defined_names(tokens):
+    """Names the statement defines itself: CTEs, table aliases and column aliases"""
+    names = set()
+    for index, tok in enumerate(tokens):
+        if tok.ttype not in T.Name or index == 0:
+            continue
+        previous = tokens[index - 1]
+        if previous.is_keyword and previous.normalized == "AS":
+            names.add(tok.value.strip("`").lower())
+        elif previous.ttype in T.Name or previous.ttype in T.Literal or previous.value == ")":
+            # Implicit alias: `SUM(x) total`, `marketing_campaigns m`
+            if index + 1 >= len(tokens) or tokens[index + 1].value not in (".", "("):
+                names.add(tok.value.strip("`").lower())
+        if index + 2 < len(tokens) and tokens[index + 1].is_keyword and tokens[index + 1].normalized == "AS" \
+                and tokens[index + 2].value == "(":
+            names.add(tok.value.strip("`").lower())
+    return names
+
+def _table_aliases(tokens):
+    """Alias -> table name for FROM and JOIN targets"""
+    aliases = {}
+    for index, tok in enumerate(tokens):
+        if not (tok.is_keyword and (tok.normalized == "FROM" or "JOIN" in tok.normalized)):
+            continue
+        position = index + 1
+        if position >= len(tokens) or tokens[position].ttype not in T.Name:
+            continue
+        path = tokens[position].value
+        position += 1
+        while position + 1 < len(tokens) and tokens[position].value in (".", "-") \
+                and tokens[position + 1].ttype in T.Name:
+            path += tokens[position].value + tokens[position + 1].value
+            position += 2
+        if position < len(tokens) and tokens[position].is_keyword and tokens[position].normalized == "AS":
+            position += 1
+        if position < len(tokens) and tokens[position].ttype in T.Name:
+            aliases[tokens[position].value.strip("`").lower()] = table_name_from_path(path).lower()
+    return aliases
+
+def _schema_lookup(table_schemas):
+    """Lower-case table name -> set of lower-case column names"""
+    return {
+        name.lower(): {col.lower() for col in info.get('columns', {})}
+        for name, info in table_schemas.items()
+    }
+
+def validate_sql(sql, table_schemas=None, max_results=None):
+    """Check a query locally.
+
+    Returns (is_valid, message, sql). The returned SQL has a LIMIT added when
+    the statement had none.
+    """
+    sql = strip_statement(sql or "")
+    if not sql:
+        return False, "Query is empty", sql
+
+    statements = [s for s in sqlparse.split(sql) if s.strip().rstrip(";").strip()]
+    if len(statements) > 1:
+        return False, "Only a single statement can be run", sql
+
+    flat = _flat_tokens(sql)
+    tokens = _significant(flat)
+    if any(tok.ttype in T.Error for tok in tokens):
+        return False, "Query has an unterminated string or identifier", sql
+    if _paren_balance(tokens) != 0:
+        return False, "Query has unbalanced parentheses", sql
+
+    forbidden = _forbidden_keyword(tokens)
+    if forbidden:
+        return False, f"Only read-only SELECT queries are allowed (found {forbidden})", sql
+    first = tokens[0]
+    if not (first.is_keyword and first.normalized in ("SELECT", "WITH")) and first.value != "(":
+        return False, "Query must start with SELECT or WITH", sql
+
+    if table_schemas:
+        schemas = _schema_lookup(table_schemas)
+        defined = _defined_names(tokens)
+        aliases = _table_aliases(tokens)
+        tables = referenced_tables(sql)
+        unknown_tables = [t for t in tables if t.lower() not in schemas and t.lower() not in defined]
+        if unknown_tables:
+            return False, f"Unknown table(s): {', '.join(unknown_tables)}", sql
+
+        known_tables = [t.lower() for t in tables if t.lower() in schemas]
+        # Skip column checks when a schema failed to load rather than flag everything
+        if known_tables and all(schemas[t] for t in known_tables):
+            columns = set().union(*(schemas[t] for t in known_tables))
+            allowed = columns | defined | set(known_tables) | DATE_PART_NAMES
+            unknown_columns = []
+            for qualifier, name in column_references(sql):
+                lowered = name.lower()
+                if "." in name or "-" in name:
+                    # A back-quoted table path such as `project.dataset.table`
+                    continue
+                if qualifier is not None:
+                    table = aliases.get(qualifier.lower(), qualifier.lower())
+                    if table in schemas and lowered not in schemas[table]:
+                        unknown_columns.append(f"{qualifier}.{name}")
+                    continue
+                if lowered not in allowed and name not in unknown_columns:
+                    unknown_columns.append(name)
+            if unknown_columns:
+                return False, f"Unknown column(s): {', '.join(unknown_columns)}", sql
+
+    if not _has_top_level_limit(tokens):
+        sql = f"{sql}\nLIMIT {max_results or Config.MAX_QUERY_RESULTS}"
+        return True, "Query passed local checks (LIMIT added)", sql
+    return True, "Query passed local checks", sql
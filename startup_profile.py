@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Startup profile for the Marketing KPIs Analytics Dashboard.
+
+Imports each application module in a fresh interpreter with
+``python -X importtime`` and breaks the import cost down per module and per
+third-party package, so regressions in startup time are easy to spot.
+
+Usage:
+    python startup_profile.py [module ...] [--top N]
+"""
+
+import os
+import sys
+import subprocess
+from collections import defaultdict
+
+APP_MODULES = ["config", "sql_utils", "bigquery_client", "text2sql", "rollups", "local_answer", "app"]
+
+def profile_import(module):
+    """Import a module in a fresh interpreter and return its import-time records.
+
+    Each record is (package, self_us, cumulative_us, depth).
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    records = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3:
+            continue
+        self_us, cumulative_us, name = fields
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        records.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return _module_subtree(records, module), result.returncode
+
+def _module_subtree(records, module):
+    """Keep only the records imported on behalf of `module`, not interpreter startup.
+
+    importtime prints children before their parent, so the module's subtree is
+    the run of nested records right before its own top-level record.
+    """
+    for end in range(len(records) - 1, -1, -1):
+        if records[end][0] == module and records[end][3] == 0:
+            start = end
+            while start > 0 and records[start - 1][3] > 0:
+                start -= 1
+            return records[start:end + 1]
+    return records
+
+def summarize_by_package(records):
+    """Total self time per top-level package"""
+    totals = defaultdict(int)
+    for name, self_us, _, _ in records:
+        totals[name.split(".")[0]] += self_us
+    return sorted(totals.items(), key=lambda item: item[1], reverse=True)
+
+def print_report(modules, top=15):
+    """Print the per-module and per-package startup cost"""
+    print("=" * 60)
+    print("⏱️  Startup import profile")
+    print("=" * 60)
+    for module in modules:
+        records, returncode = profile_import(module)
+        total_us = sum(self_us for _, self_us, _, _ in records)
+        status = "" if returncode == 0 else "  (import failed)"
+        print(f"\n📦 {module}: {total_us / 1000:.1f} ms{status}")
+        for package, self_us in summarize_by_package(records)[:top]:
+            print(f"   {package:<30} {self_us / 1000:>9.1f} ms")
+    print()
+
+def main():
+    """Parse arguments and print the report"""
+    args = sys.argv[1:]
+    top = 15
+    if "--top" in args:
+        index = args.index("--top")
+        top = int(args[index + 1])
+        del args[index:index + 2]
+    print_report(args or APP_MODULES, top=top)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+"""
+Parameterized query templates learned from answered questions.
+
+Questions such as "top campaigns by ROAS since 2024-01-01" and "... since
+2024-06-01" differ only in their literal values. Once a question's SQL has
+run, the dates, numbers and quoted strings of the question are looked up
+among the SQL's literals and replaced by BigQuery named parameters (@p1,
+@p2, ...). The template is stored under the question's shape (the question
+with its literals masked). A later question of the same shape fills in its
+own values instead of calling the LLM, and the query runs with
+QueryJobConfig.query_parameters.
+
+Literals are only replaced when the match is unambiguous: every value of the
+question must occur in the SQL, and a number exactly once. A template is
+stored only after a dry run with the original values accepts it.
+"""
+
+import re
+from datetime import date, datetime, timedelta
+from sqlparse import tokens as T
+from cache_backend import MemoryBackend, make_backend
+from config import Config
+from sql_utils import tokens_with_offsets
+
+# Quoted values, ISO dates and plain numbers; quotes inside words ("campaign's") are apostrophes
+_LITERAL_RE = re.compile(
+    r"""(?<!\w)'(?P<single>[^']+)'(?!\w)"""
+    r"""|(?<!\w)"(?P<double>[^"]+)"(?!\w)"""
+    r"""|(?<![\w.-])(?P<date>\d{4}-\d{2}-\d{2})(?![\w.-])"""
+    r"""|(?<![\w.-])(?P<number>\d+(?:\.\d+)?)(?![\w.-])"""
+)
+_PARAMETER_RE = re.compile(r"@(p\d+)(?!\w)")
+_TYPED_LITERALS = {"DATE", "DATETIME", "TIMESTAMP"}
+
+def question_literals(question):
+    """The question's values in order, as (kind, value) with kind 'text', 'date' or 'number'"""
+    literals = []
+    for match in _LITERAL_RE.finditer(question or ""):
+        if match.group("date"):
+            literals.append(("date", match.group("date")))
+        elif match.group("number"):
+            literals.append(("number", match.group("number")))
+        else:
+            literals.append(("text", match.group("single") or match.group("double")))
+    return literals
+
+def question_shape(question):
+    """The question with its values masked by kind, so questions differing only in values share a shape"""
+    def mask(match):
+        kind = "date" if match.group("date") else "number" if match.group("number") else "text"
+        return "{" + kind + "}"
+    return " ".join(_LITERAL_RE.sub(mask, (question or "").lower()).split())
+
+def parameter_value(parameter):
+    """Python value of a parameter ({'name', 'type', 'value'}); raises ValueError if it does not fit the type"""
+    kind, value = parameter['type'], parameter['value']
+    if kind == "INT64":
+        return int(value)
+    if kind == "FLOAT64":
+        return float(value)
+    if kind == "DATE":
+        return date.fromisoformat(value)
+    if kind in ("DATETIME", "TIMESTAMP"):
+        return datetime.fromisoformat(value)
+    return value
+
+def _literal_spans(tokens, kind, value):
+    """(start, end, parameter type) of every SQL literal equal to a question value"""
+    spans = []
+    previous = None
+    for offset, tok in tokens:
+        if tok.is_whitespace or tok.ttype in T.Comment:
+            continue
+        end = offset + len(tok.value)
+        if kind == "number" and tok.ttype in T.Literal.Number:
+            if float(tok.value) == float(value):
+                spans.append((offset, end, "INT64" if tok.ttype in T.Literal.Number.Integer else "FLOAT64"))
+        elif kind != "number" and tok.ttype in T.Literal.String and tok.value[1:-1] == value:
+            # DATE '2024-01-01' becomes one DATE parameter; a bare string stays a STRING
+            if previous is not None and previous[1].value.upper() in _TYPED_LITERALS:
+                spans.append((previous[0], end, previous[1].value.upper()))
+            else:
+                spans.append((offset, end, "STRING"))
+        previous = (offset, tok)
+    return spans
+
+def parameterize(sql, literals):
+    """Replace the SQL literals holding the question's values by @p1, @p2, ...
+
+    Returns (template_sql, parameters) with parameters as {'name', 'type',
+    'value'} in the order of literals, or None when a value is missing from the
+    SQL or cannot be told apart from another literal.
+    """
+    values = [value for _, value in literals]
+    if not literals or len(set(values)) != len(values):
+        return None
+    tokens = tokens_with_offsets(sql)
+    spans, parameters = [], []
+    for number, (kind, value) in enumerate(literals, 1):
+        found = _literal_spans(tokens, kind, value)
+        # The same number may be a LIMIT here and a ROUND() precision there
+        if not found or (kind == "number" and len(found) > 1):
+            return None
+        types = {type_ for _, _, type_ in found}
+        if len(types) > 1:
+            return None
+        name = f"p{number}"
+        parameters.append({'name': name, 'type': types.pop(), 'value': value})
+        spans.extend((start, end, name) for start, end, _ in found)
+    for start, end, name in sorted(spans, reverse=True):
+        sql = sql[:start] + f"@{name}" + sql[end:]
+    return sql, parameters
+
+def render(template_sql, parameters):
+    """The template with its parameters written back as literals, for display and the local checks"""
+    by_name = {parameter['name']: parameter for parameter in parameters}
+
+    def literal(match):
+        parameter = by_name.get(match.group(1))
+        if parameter is None:
+            return match.group(0)
+        if parameter['type'] in ("INT64", "FLOAT64"):
+            return parameter['value']
+        quoted = "'" + parameter['value'].replace("\\", "\\\\").replace("'", "\\'") + "'"
+        return quoted if parameter['type'] == "STRING" else f"{parameter['type']} {quoted}"
+
+    return _PARAMETER_RE.sub(literal, template_sql)
+
+def fill(template, question):
+    """The template's parameters with the values of a question of the same shape, or None if they do not fit"""
+    literals = question_literals(question)
+    if len(literals) != len(template['parameters']):
+        return None
+    parameters = []
+    for (_, value), parameter in zip(literals, template['parameters']):
+        parameter = dict(parameter, value=value)
+        try:
+            parameter_value(parameter)
+        except ValueError:
+            return None
+        parameters.append(parameter)
+    return parameters
+
+class TemplateStore:
+    """Bounded cache of query templates keyed by question shape and schema, with a TTL"""
+
+    def __init__(self, max_entries=None, ttl_hours=None, backend=None):
+        self.max_entries = max_entries or Config.QUERY_TEMPLATE_CACHE_SIZE
+        self.ttl = timedelta(hours=ttl_hours if ttl_hours is not None else Config.QUERY_TEMPLATE_TTL_HOURS)
+        self.backend = backend if backend is not None else MemoryBackend(self.max_entries)
+
+    @staticmethod
+    def _key(question, schema_key):
+        return (question_shape(question), schema_key)
+
+    def _get(self, key):
+        entry = self.backend.get(key)
+        if entry is None or datetime.now() - entry['timestamp'] > self.ttl:
+            return None
+        return entry
+
+    def learn(self, question, sql, schema_key, check=None):
+        """Store the template of SQL that answered question; returns it, or None if SQL cannot be templated.
+
+        check(template_sql, parameters) must return True for the template to be
+        stored (normally a dry run with the original values).
+        """
+        parameterized = parameterize(sql, question_literals(question))
+        if parameterized is None:
+            return None
+        template_sql, parameters = parameterized
+        key = self._key(question, schema_key)
+        existing = self._get(key)
+        if existing is not None and existing['sql'] == template_sql:
+            return existing
+        if check is not None and not check(template_sql, parameters):
+            return None
+        template = {
+            'question': question,
+            'sql': template_sql,
+            'parameters': [{'name': p['name'], 'type': p['type']} for p in parameters],
+            'timestamp': datetime.now()
+        }
+        self.backend.set(key, template, ttl=self.ttl.total_seconds())
+        return template
+
+    def match(self, question, schema_key):
+        """A stored template filled in for a question of the same shape, or None.
+
+        The result has the concrete 'sql', the 'template_sql', its 'parameters'
+        and the 'question' the template was learned from.
+        """
+        if not question_literals(question):
+            return None
+        template = self._get(self._key(question, schema_key))
+        if template is None:
+            return None
+        parameters = fill(template, question)
+        if parameters is None:
+            return None
+        return {
+            'sql': render(template['sql'], parameters),
+            'template_sql': template['sql'],
+            'parameters': parameters,
+            'question': template['question']
+        }
+
+    def clear(self):
+        self.backend.clear()
+
+    def __len__(self):
+        return len(self.backend)
+
+# Shared by every session (and, with CACHE_BACKEND=disk or redis, by other processes)
+TEMPLATE_STORE = TemplateStore(backend=make_backend("templates", Config.QUERY_TEMPLATE_CACHE_SIZE))
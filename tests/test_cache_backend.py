@@ -0,0 +1,198 @@
+"""
+Tests for the shared cache backends.
+
+RedisBackend runs against a minimal in-memory stand-in for a redis-py client,
+so no Redis server is needed; DiskBackend uses a temporary directory.
+"""
+
+import fnmatch
+import sys
+from datetime import date, datetime
+
+import pandas as pd
+import pytest
+
+import cache_backend
+from cache_backend import DiskBackend, MemoryBackend, RedisBackend, deserialize, make_backend, serialize
+from config import Config
+
+
+class FakeClock:
+    """Stands in for time.time() in cache_backend so TTLs can expire without sleeping"""
+
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class StubRedis:
+    """The part of the redis-py client API RedisBackend uses, kept in a dict"""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.data = {}
+
+    def _live(self, key):
+        value, expires_at = self.data.get(key, (None, None))
+        if expires_at is not None and self.clock() >= expires_at:
+            del self.data[key]
+            return None
+        return value
+
+    def get(self, key):
+        return self._live(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = (value, self.clock() + ex if ex else None)
+        return True
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    def scan_iter(self, match="*"):
+        return [key for key in list(self.data) if self._live(key) is not None and fnmatch.fnmatchcase(key, match)]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(cache_backend.time, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def redis_client(clock):
+    return StubRedis(clock)
+
+
+@pytest.fixture(params=["redis", "disk"])
+def backend(request, redis_client, tmp_path):
+    if request.param == "redis":
+        return RedisBackend("results", client=redis_client)
+    return DiskBackend("results", directory=str(tmp_path))
+
+
+def sample_entry():
+    return {
+        'sql': "SELECT campaign_name, SUM(spend) AS spend FROM marketing_campaigns GROUP BY 1",
+        'df': pd.DataFrame({'campaign_name': ["a", "b"], 'spend': [1.5, 2.0]}),
+        'timestamp': datetime(2024, 5, 1, 9, 30),
+        'day': date(2024, 5, 1),
+        'changes': ["Added LIMIT 1000"]
+    }
+
+
+def test_serialize_round_trip():
+    entry = sample_entry()
+    decoded = deserialize(serialize(entry))
+    pd.testing.assert_frame_equal(decoded['df'], entry['df'])
+    assert decoded['timestamp'] == entry['timestamp']
+    assert decoded['day'] == entry['day']
+    assert decoded['changes'] == entry['changes']
+
+
+def test_round_trip(backend):
+    entry = sample_entry()
+    assert backend.set(("question", "fingerprint"), entry)
+    stored = backend.get(("question", "fingerprint"))
+    pd.testing.assert_frame_equal(stored['df'], entry['df'])
+    assert stored['timestamp'] == entry['timestamp']
+    assert backend.get(("other question", "fingerprint")) is None
+    assert len(backend) == 1
+
+
+def test_ttl_expires(backend, clock):
+    backend.set("short", {'sql': "SELECT 1"}, ttl=60)
+    backend.set("forever", {'sql': "SELECT 2"})
+    clock.now += 59
+    assert backend.get("short") == {'sql': "SELECT 1"}
+    clock.now += 2
+    assert backend.get("short") is None
+    assert backend.get("forever") == {'sql': "SELECT 2"}
+    assert backend.values() == [{'sql': "SELECT 2"}]
+
+
+def test_delete_and_clear(backend):
+    backend.set("a", 1)
+    backend.set("b", 2)
+    backend.delete("a")
+    assert backend.get("a") is None
+    backend.clear()
+    assert backend.get("b") is None
+    assert len(backend) == 0
+
+
+def test_unserializable_value_is_not_stored(backend):
+    assert backend.set("bad", {'value': object()}) is False
+    assert backend.get("bad") is None
+
+
+def test_redis_namespaces_are_isolated(redis_client):
+    results = RedisBackend("results", client=redis_client)
+    schemas = RedisBackend("schemas", client=redis_client)
+    results.set("key", "result")
+    schemas.set("key", "schema")
+    assert results.get("key") == "result"
+    assert schemas.get("key") == "schema"
+    results.clear()
+    assert schemas.get("key") == "schema"
+    assert len(results) == 0 and len(schemas) == 1
+
+
+def test_redis_key_prefix_isolates_deployments(redis_client, monkeypatch):
+    monkeypatch.setattr(Config, "CACHE_KEY_PREFIX", "staging:")
+    staging = RedisBackend("results", client=redis_client)
+    monkeypatch.setattr(Config, "CACHE_KEY_PREFIX", "prod:")
+    prod = RedisBackend("results", client=redis_client)
+    staging.set("key", "staging value")
+    assert prod.get("key") is None
+    assert all(key.startswith("staging:") for key in redis_client.data)
+    prod.clear()
+    assert staging.get("key") == "staging value"
+
+
+def test_redis_unreachable_is_a_miss():
+    class DownRedis:
+        def __getattr__(self, name):
+            def fail(*args, **kwargs):
+                raise ConnectionError("connection refused")
+            return fail
+
+    backend = RedisBackend("results", client=DownRedis())
+    assert backend.set("key", "value") is False
+    assert backend.get("key") is None
+    assert backend.values() == []
+    assert len(backend) == 0
+
+
+def test_disk_evicts_least_recently_used(tmp_path, clock):
+    backend = DiskBackend("results", directory=str(tmp_path), max_entries=2)
+    for key in ("a", "b", "c"):
+        backend.set(key, key)
+    assert len(backend) == 2
+
+
+def test_disk_unreadable_file_is_a_miss(tmp_path):
+    backend = DiskBackend("results", directory=str(tmp_path))
+    backend.set("key", "value")
+    with open(backend._path("key"), "wb") as f:
+        f.write(b"not an entry")
+    assert backend.get("key") is None
+
+
+def test_falls_back_to_memory_without_redis(monkeypatch):
+    # A None entry in sys.modules makes "import redis" raise ImportError
+    monkeypatch.setitem(sys.modules, "redis", None)
+    with pytest.warns(UserWarning, match="redis package is not installed"):
+        backend = make_backend("results", max_entries=5, backend="redis")
+    assert isinstance(backend, MemoryBackend)
+    assert backend.max_entries == 5
+
+
+def test_make_backend_choices(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "CACHE_DIR", str(tmp_path))
+    assert isinstance(make_backend("results", backend="disk"), DiskBackend)
+    assert isinstance(make_backend("results", backend="memory"), MemoryBackend)
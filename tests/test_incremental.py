@@ -0,0 +1,127 @@
+"""
+Tests for the incremental refresh of saved queries grouped by a date dimension.
+"""
+
+from datetime import date
+
+import pandas as pd
+import pytest
+
+from incremental import delta_sql, high_water_mark, merge_delta, plan_incremental, refresh_saved_query
+
+SCHEMAS = {
+    'orders': {'columns': {'order_date': "DATE", 'revenue': "FLOAT64", 'channel': "STRING"}}
+}
+MONTHLY_SQL = (
+    "SELECT DATE_TRUNC(order_date, MONTH) AS month, SUM(revenue) AS revenue "
+    "FROM orders GROUP BY month ORDER BY month"
+)
+
+
+class FakeBigQuery:
+    """Returns the queued results in order and records the SQL it was asked to run"""
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.executed = []
+
+    def estimate_query_bytes(self, sql, parameters=None):
+        return 1000
+
+    def execute_query(self, sql, max_results=None, **kwargs):
+        self.executed.append(sql)
+        return self.results.pop(0)
+
+
+def monthly(*rows):
+    return pd.DataFrame({
+        'month': [date.fromisoformat(month) for month, _ in rows],
+        'revenue': [revenue for _, revenue in rows]
+    })
+
+
+def test_plan_finds_the_date_bucket():
+    plan = plan_incremental(MONTHLY_SQL, SCHEMAS)
+    assert plan['date_output'] == "month"
+    assert plan['date_column'] == "order_date"
+    assert plan['column_type'] == "DATE"
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT channel, SUM(revenue) AS revenue FROM orders GROUP BY channel",
+    "SELECT order_date, revenue FROM orders",
+    "SELECT order_date, SUM(revenue) OVER (ORDER BY order_date) AS running FROM orders GROUP BY order_date",
+    "SELECT order_date, SUM(revenue) AS revenue FROM orders GROUP BY order_date LIMIT 10 OFFSET 5",
+])
+def test_plan_rejects_unsupported_queries(sql):
+    assert plan_incremental(sql, SCHEMAS) is None
+
+
+@pytest.mark.parametrize("window", [
+    "DATE_SUB(CURRENT_DATE(), INTERVAL 3 MONTH)",
+    "DATE(TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL 90 DAY))",
+    "DATE(current_datetime())",
+])
+def test_plan_rejects_windows_relative_to_now(window):
+    sql = (
+        "SELECT DATE_TRUNC(order_date, MONTH) AS month, SUM(revenue) AS revenue "
+        f"FROM orders WHERE order_date >= {window} GROUP BY DATE_TRUNC(order_date, MONTH)"
+    )
+    assert plan_incremental(sql, SCHEMAS) is None
+
+
+def test_fixed_window_is_planned():
+    sql = (
+        "SELECT DATE_TRUNC(order_date, MONTH) AS month, SUM(revenue) AS revenue "
+        "FROM orders WHERE order_date >= DATE '2024-01-01' GROUP BY DATE_TRUNC(order_date, MONTH)"
+    )
+    assert plan_incremental(sql, SCHEMAS) is not None
+
+
+def test_delta_sql_starts_at_the_high_water_mark():
+    plan = plan_incremental(MONTHLY_SQL, SCHEMAS)
+    stored = monthly(("2024-01-01", 10.0), ("2024-02-01", 20.0))
+    hwm = high_water_mark(plan, stored)
+    assert hwm == date(2024, 2, 1)
+    sql = delta_sql(plan, hwm)
+    assert "order_date >= DATE '2024-02-01'" in sql
+    assert "GROUP BY month" in sql
+
+
+def test_merge_replaces_buckets_from_the_high_water_mark():
+    plan = plan_incremental(MONTHLY_SQL, SCHEMAS)
+    stored = monthly(("2024-01-01", 10.0), ("2024-02-01", 20.0))
+    delta = monthly(("2024-02-01", 25.0), ("2024-03-01", 5.0))
+    merged = merge_delta(plan, stored, delta, date(2024, 2, 1))
+    assert merged['revenue'].tolist() == [10.0, 25.0, 5.0]
+
+
+def test_merge_gives_up_when_limit_cuts_rows():
+    plan = plan_incremental(f"{MONTHLY_SQL} LIMIT 2", SCHEMAS)
+    stored = monthly(("2024-01-01", 10.0), ("2024-02-01", 20.0))
+    delta = monthly(("2024-02-01", 25.0), ("2024-03-01", 5.0))
+    assert merge_delta(plan, stored, delta, date(2024, 2, 1)) is None
+
+
+def test_refresh_is_incremental_with_a_stored_result():
+    delta = monthly(("2024-02-01", 25.0), ("2024-03-01", 5.0))
+    bq = FakeBigQuery(delta)
+    saved = {'sql': MONTHLY_SQL, 'result': monthly(("2024-01-01", 10.0), ("2024-02-01", 20.0))}
+    info = refresh_saved_query(saved, bq, SCHEMAS)
+    assert info['mode'] == "incremental" and info['delta_rows'] == 2
+    assert len(bq.executed) == 1 and "DATE '2024-02-01'" in bq.executed[0]
+    assert saved['result']['revenue'].tolist() == [10.0, 25.0, 5.0]
+
+
+def test_refresh_of_a_relative_window_runs_in_full():
+    sql = (
+        "SELECT DATE_TRUNC(order_date, MONTH) AS month, SUM(revenue) AS revenue "
+        "FROM orders WHERE order_date >= DATE_SUB(CURRENT_DATE(), INTERVAL 3 MONTH) GROUP BY month"
+    )
+    full = monthly(("2024-02-01", 20.0), ("2024-03-01", 5.0))
+    bq = FakeBigQuery(full)
+    saved = {'sql': sql, 'result': monthly(("2024-01-01", 10.0), ("2024-02-01", 20.0))}
+    info = refresh_saved_query(saved, bq, SCHEMAS)
+    assert info['mode'] == "full"
+    assert bq.executed == [sql]
+    assert saved['result'] is full
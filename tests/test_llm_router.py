@@ -0,0 +1,101 @@
+"""
+Tests for LLM provider routing: failover, hedging and the per-provider worker pools.
+
+Providers are plain callables; stats are process-wide, so every test uses
+provider names of its own.
+"""
+
+import threading
+import uuid
+
+import pytest
+
+from config import Config
+from llm_router import LLMRouter, LLMUnavailableError, provider_stats
+
+
+@pytest.fixture(autouse=True)
+def fast_router(monkeypatch):
+    monkeypatch.setattr(Config, "LLM_TIMEOUT", 0.2)
+    monkeypatch.setattr(Config, "LLM_DEADLINE", 2.0)
+    monkeypatch.setattr(Config, "LLM_MAX_RETRIES", 0)
+    monkeypatch.setattr(Config, "LLM_FAILOVER", True)
+    monkeypatch.setattr(Config, "LLM_HEDGE", False)
+    monkeypatch.setattr(Config, "LLM_HEDGE_DELAY", 0.05)
+    monkeypatch.setattr(Config, "LLM_PROVIDER_WORKERS", 2)
+
+
+@pytest.fixture
+def names():
+    suffix = uuid.uuid4().hex[:8]
+    return f"primary-{suffix}", f"secondary-{suffix}"
+
+
+def answer(text):
+    return lambda inputs: text
+
+
+def fail(inputs):
+    raise RuntimeError("provider down")
+
+
+def blocked(release):
+    def call(inputs):
+        release.wait(5)
+        return "late answer"
+    return call
+
+
+def test_primary_answers(names):
+    primary, secondary = names
+    router = LLMRouter({primary: answer("SELECT 1"), secondary: answer("SELECT 2")}, primary=primary)
+    assert router.invoke({}) == ("SELECT 1", primary)
+
+
+def test_failover_reports_the_provider_that_answered(names):
+    primary, secondary = names
+    router = LLMRouter({primary: fail, secondary: answer("SELECT 2")}, primary=primary)
+    assert router.invoke({}) == ("SELECT 2", secondary)
+    assert provider_stats()[primary]['failures'] == 1
+
+
+def test_no_provider_answers(names):
+    primary, secondary = names
+    router = LLMRouter({primary: fail, secondary: fail}, primary=primary)
+    with pytest.raises(LLMUnavailableError):
+        router.invoke({})
+
+
+def test_hedge_won_after_the_delay(names, monkeypatch):
+    monkeypatch.setattr(Config, "LLM_HEDGE", True)
+    primary, secondary = names
+    release = threading.Event()
+    router = LLMRouter({primary: blocked(release), secondary: answer("SELECT 2")}, primary=primary)
+    try:
+        assert router.invoke({}) == ("SELECT 2", secondary)
+    finally:
+        release.set()
+    assert provider_stats()[secondary]['hedges_won'] == 1
+
+
+def test_failover_in_hedged_mode_is_not_a_hedge_won(names, monkeypatch):
+    monkeypatch.setattr(Config, "LLM_HEDGE", True)
+    monkeypatch.setattr(Config, "LLM_HEDGE_DELAY", 1.0)
+    primary, secondary = names
+    router = LLMRouter({primary: fail, secondary: answer("SELECT 2")}, primary=primary)
+    assert router.invoke({}) == ("SELECT 2", secondary)
+    assert provider_stats()[secondary]['hedges_won'] == 0
+
+
+def test_abandoned_calls_do_not_block_the_other_provider(names):
+    primary, secondary = names
+    release = threading.Event()
+    router = LLMRouter({primary: blocked(release), secondary: answer("SELECT 2")}, primary=primary)
+    try:
+        # Each call times out on the primary and leaves it running; once its two
+        # workers are taken the primary is skipped rather than queued behind them
+        for _ in range(4):
+            assert router.invoke({}) == ("SELECT 2", secondary)
+        assert provider_stats()[primary]['timeouts'] == 2
+    finally:
+        release.set()
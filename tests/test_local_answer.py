@@ -0,0 +1,171 @@
+"""
+Tests for answering follow-up queries from a cached result.
+
+Each local answer is compared with the result BigQuery would return for the
+same query, worked out by hand, including SQL's NULL semantics.
+"""
+
+import math
+
+import pandas as pd
+import pytest
+
+from local_answer import answer_from_cache
+from result_cache import ResultCache
+
+ROWS_SQL = "SELECT campaign_name, channel, spend FROM marketing_campaigns"
+BY_CHANNEL_SQL = (
+    "SELECT channel, region, SUM(spend) AS spend, COUNT(*) AS campaigns "
+    "FROM marketing_campaigns GROUP BY channel, region"
+)
+
+
+def campaign_rows():
+    return pd.DataFrame({
+        'campaign_name': ["spring", "summer", "autumn", "winter", "launch"],
+        'channel': ["email", "social", None, "search", "social"],
+        'spend': [100.0, 250.0, 80.0, None, 40.0]
+    })
+
+
+def channel_totals():
+    return pd.DataFrame({
+        'channel': ["email", "email", "social", "search"],
+        'region': ["eu", "us", "eu", "us"],
+        'spend': [100.0, 60.0, 290.0, None],
+        'campaigns': [2, 1, 3, 1]
+    })
+
+
+@pytest.fixture
+def cache():
+    cache = ResultCache(max_entries=10)
+    cache.put(ROWS_SQL, campaign_rows())
+    cache.put(BY_CHANNEL_SQL, channel_totals())
+    return cache
+
+
+def answer(sql, cache):
+    answered = answer_from_cache(sql, cache)
+    assert answered is not None, f"not answered locally: {sql}"
+    return answered[0]
+
+
+def names(df):
+    return df['campaign_name'].tolist()
+
+
+@pytest.mark.parametrize("where, expected", [
+    ("channel = 'social'", ["summer", "launch"]),
+    ("channel != 'social'", ["spring", "winter"]),
+    ("spend > 50", ["spring", "summer", "autumn"]),
+    ("spend <= 80", ["autumn", "launch"]),
+    ("channel IN ('email', 'search')", ["spring", "winter"]),
+    ("channel LIKE 's%'", ["summer", "winter", "launch"]),
+    ("spend BETWEEN 40 AND 100", ["spring", "autumn", "launch"]),
+    ("channel IS NULL", ["autumn"]),
+    ("spend IS NOT NULL", ["spring", "summer", "autumn", "launch"]),
+    ("channel = 'social' AND spend > 100", ["summer"]),
+])
+def test_predicates(cache, where, expected):
+    assert names(answer(f"{ROWS_SQL} WHERE {where}", cache)) == expected
+
+
+@pytest.mark.parametrize("where, expected", [
+    # A NULL channel or spend makes the negated predicate NULL, so those rows are filtered out
+    ("channel NOT IN ('email')", ["summer", "winter", "launch"]),
+    ("channel NOT LIKE 'e%'", ["summer", "winter", "launch"]),
+    ("spend NOT BETWEEN 50 AND 100", ["summer", "launch"]),
+])
+def test_negated_predicates_drop_nulls(cache, where, expected):
+    assert names(answer(f"{ROWS_SQL} WHERE {where}", cache)) == expected
+
+
+def test_or_is_not_treated_as_and(cache):
+    result = answer_from_cache(f"{ROWS_SQL} WHERE channel = 'email' OR spend > 200", cache)
+    # Not a simple predicate, so BigQuery answers it (never as channel = 'email' AND spend > 200)
+    assert result is None
+
+
+def test_aggregate_rows(cache):
+    result = answer(
+        "SELECT channel, SUM(spend) AS spend, COUNT(*) AS campaigns, COUNT(spend) AS priced "
+        "FROM marketing_campaigns GROUP BY channel ORDER BY channel", cache
+    )
+    assert result['channel'].tolist()[1:] == ["email", "search", "social"]
+    # NULL sorts first ascending
+    assert pd.isna(result['channel'].iloc[0])
+    assert result['spend'].iloc[1] == 100.0
+    # SUM of only NULLs is NULL, not 0
+    assert math.isnan(result['spend'].iloc[2])
+    assert result['spend'].iloc[3] == 290.0
+    assert result['campaigns'].tolist() == [1, 1, 1, 2]
+    assert result['priced'].tolist() == [1, 1, 0, 2]
+
+
+def test_sum_over_no_rows_is_null(cache):
+    result = answer(
+        "SELECT SUM(spend) AS spend, COUNT(*) AS campaigns FROM marketing_campaigns WHERE spend > 1000", cache
+    )
+    assert len(result) == 1
+    assert math.isnan(result['spend'].iloc[0])
+    assert result['campaigns'].iloc[0] == 0
+
+
+def test_regroup_to_coarser_grain(cache):
+    result = answer(
+        "SELECT channel, SUM(spend) AS spend, COUNT(*) AS campaigns "
+        "FROM marketing_campaigns GROUP BY channel ORDER BY spend DESC", cache
+    )
+    assert result['channel'].tolist() == ["social", "email", "search"]
+    assert result['spend'].tolist()[:2] == [290.0, 160.0]
+    # NULL sorts last descending, and stays NULL after re-aggregation
+    assert math.isnan(result['spend'].iloc[2])
+
+
+def test_regrouped_totals_over_no_rows():
+    cache = ResultCache(max_entries=10)
+    cache.put(BY_CHANNEL_SQL, channel_totals())
+    result = answer(
+        "SELECT SUM(spend) AS spend, COUNT(*) AS campaigns FROM marketing_campaigns WHERE channel = 'display'", cache
+    )
+    assert len(result) == 1
+    assert math.isnan(result['spend'].iloc[0])
+    assert result['campaigns'].iloc[0] == 0
+
+
+def test_having_filters_groups(cache):
+    result = answer(f"{BY_CHANNEL_SQL} HAVING SUM(spend) > 80", cache)
+    assert result['channel'].tolist() == ["email", "social"]
+    assert result['spend'].tolist() == [100.0, 290.0]
+
+
+def test_having_on_a_null_total_drops_the_group(cache):
+    result = answer(f"{BY_CHANNEL_SQL} HAVING SUM(spend) < 1000", cache)
+    assert result['channel'].tolist() == ["email", "email", "social"]
+
+
+@pytest.mark.parametrize("order_by, expected", [
+    ("spend DESC", ["summer", "spring", "autumn", "launch", "winter"]),
+    ("spend", ["winter", "launch", "autumn", "spring", "summer"]),
+    ("3 DESC", ["summer", "spring", "autumn", "launch", "winter"]),
+    ("campaign_name", ["autumn", "launch", "spring", "summer", "winter"]),
+])
+def test_order_by(cache, order_by, expected):
+    assert names(answer(f"{ROWS_SQL} ORDER BY {order_by}", cache)) == expected
+
+
+def test_order_by_with_limit(cache):
+    assert names(answer(f"{ROWS_SQL} ORDER BY spend DESC LIMIT 2", cache)) == ["summer", "spring"]
+
+
+def test_narrower_cached_filter_is_not_used():
+    cache = ResultCache(max_entries=10)
+    cache.put(f"{ROWS_SQL} WHERE spend > 50", campaign_rows().iloc[:3])
+    assert answer_from_cache(ROWS_SQL, cache) is None
+
+
+def test_truncated_cached_result_is_not_filtered():
+    cache = ResultCache(max_entries=10)
+    cache.put(f"{ROWS_SQL} ORDER BY spend DESC LIMIT 3", campaign_rows().iloc[:3])
+    assert answer_from_cache(f"{ROWS_SQL} WHERE channel = 'email' ORDER BY spend DESC LIMIT 1", cache) is None
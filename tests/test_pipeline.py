@@ -0,0 +1,114 @@
+"""
+Tests for the query pipeline's execute stage.
+
+BigQuery is replaced by a stand-in that records what would have been run, so
+the tests check which SQL is allowed to reach it.
+"""
+
+import pandas as pd
+import pytest
+
+import pipeline
+from config import Config
+from pipeline import FAILED, RESULT, VALIDATED, QueryPipeline
+
+SCHEMAS = {
+    'marketing_campaigns': {
+        'columns': {'campaign_name': "STRING", 'spend': "FLOAT64", 'start_date': "DATE"}
+    }
+}
+
+
+class FakeBigQuery:
+    """The part of BigQueryClient the pipeline uses; every query "succeeds" unless dry_run_error is set"""
+
+    def __init__(self, dry_run_error=None):
+        self.dry_run_error = dry_run_error
+        self.executed = []
+        self.estimated = []
+        self.last_error = None
+        self.last_job = None
+        self.quota_exceeded = False
+
+    def validate_query(self, sql, parameters=None):
+        if self.dry_run_error:
+            return False, self.dry_run_error
+        return True, "Query is valid"
+
+    def estimate_query_bytes(self, sql, parameters=None):
+        self.estimated.append(sql)
+        return 1000
+
+    def execute_query(self, sql, max_results=None, **kwargs):
+        self.executed.append(sql)
+        return pd.DataFrame({'campaign_name': ["a"], 'spend': [1.0]})
+
+
+@pytest.fixture(autouse=True)
+def offline(monkeypatch):
+    added = []
+    monkeypatch.setattr(Config, "TRACE_ENABLED", False)
+    monkeypatch.setattr(Config, "QUERY_TEMPLATES", False)
+    monkeypatch.setattr(Config, "ENABLE_ROLLUP_ROUTING", False)
+    monkeypatch.setattr(pipeline.EXAMPLE_STORE, "add", lambda *args, **kwargs: added.append(args))
+    monkeypatch.setattr(pipeline.SHARED_RESULT_CACHE, "get", lambda *args, **kwargs: None)
+    monkeypatch.setattr(pipeline.SHARED_RESULT_CACHE, "put", lambda *args, **kwargs: None)
+    return added
+
+
+def make_pipeline(sql):
+    pipe = QueryPipeline()
+    pipe.set_question("How much did each campaign spend?")
+    pipe.set_sql(sql)
+    return pipe
+
+
+def test_dml_rejected_by_validate_is_never_executed(offline):
+    bq = FakeBigQuery()
+    pipe = make_pipeline("DELETE FROM marketing_campaigns WHERE TRUE")
+    is_valid, message = pipe.validate(bq, SCHEMAS)
+    assert not is_valid and "DELETE" in message
+
+    assert pipe.execute(bq, table_schemas=SCHEMAS) is False
+    assert bq.executed == []
+    assert offline == []
+    assert pipe.stage == FAILED and pipe.failed_stage == VALIDATED
+
+
+def test_dml_is_checked_when_validate_was_skipped(offline):
+    bq = FakeBigQuery()
+    pipe = make_pipeline("DELETE FROM marketing_campaigns WHERE TRUE")
+    assert pipe.execute(bq, table_schemas=SCHEMAS) is False
+    assert bq.executed == []
+    assert offline == []
+
+
+def test_sql_rejected_by_dry_run_is_never_executed(offline):
+    bq = FakeBigQuery(dry_run_error="Unrecognized name: budget")
+    pipe = make_pipeline("SELECT campaign_name, spend FROM marketing_campaigns")
+    assert pipe.validate(bq, SCHEMAS) == (False, "Unrecognized name: budget")
+    assert pipe.execute(bq, table_schemas=SCHEMAS) is False
+    assert bq.executed == []
+    assert pipe.error == "Unrecognized name: budget"
+
+
+def test_validated_select_runs(offline):
+    bq = FakeBigQuery()
+    pipe = make_pipeline("SELECT campaign_name, spend FROM marketing_campaigns")
+    assert pipe.validate(bq, SCHEMAS)[0]
+    assert pipe.execute(bq, table_schemas=SCHEMAS) is True
+    assert len(bq.executed) == 1 and "LIMIT" in bq.executed[0]
+    assert pipe.stage == RESULT
+    assert len(offline) == 1
+
+
+def test_limit_only_rewrite_skips_the_byte_comparison(monkeypatch):
+    monkeypatch.setattr(Config, "ENABLE_COST_REWRITE", True)
+    monkeypatch.setattr(Config, "MAX_QUERY_RESULTS", 1000)
+    bq = FakeBigQuery()
+    pipe = make_pipeline("SELECT campaign_name, spend FROM marketing_campaigns LIMIT 50000")
+    assert pipe.validate(bq, SCHEMAS)[0]
+    assert pipe.execute(bq, table_schemas=SCHEMAS) is True
+    assert pipe.execution_info['rewrite']['changes'] == ["Lowered LIMIT 50000 to 1000"]
+    assert 'original_bytes' not in pipe.execution_info['rewrite']
+    assert bq.estimated == []
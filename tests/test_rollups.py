@@ -0,0 +1,110 @@
+"""
+Tests for routing aggregate queries to daily rollups, and for only using a
+rollup that is current with its base table.
+"""
+
+from datetime import datetime
+
+import pytest
+
+from config import Config
+from rollups import RollupRouter, RollupStore
+
+SCHEMAS = {
+    'marketing_campaigns': {'columns': {
+        'start_date': "DATE", 'channel': "STRING", 'campaign_name': "STRING", 'spend': "FLOAT64"
+    }}
+}
+BASE = "proj.kpi.marketing_campaigns"
+ROLLUP = "proj.kpi.rollup_daily_marketing_campaigns"
+QUERY = "SELECT channel, SUM(spend) AS spend FROM marketing_campaigns GROUP BY channel"
+
+
+class FakeBigQuery:
+    """Tables are {table_id: modified time}; a statement that refreshes the rollup touches it"""
+
+    project_id = "proj"
+    dataset_id = "kpi"
+
+    def __init__(self, tables):
+        self.tables = dict(tables)
+        self.statements = []
+        self.reports = []
+
+    def _report(self, level, message):
+        self.reports.append((level, message))
+
+    def table_modified(self, table_id):
+        return self.tables.get(table_id)
+
+    def table_exists(self, table_id):
+        return table_id in self.tables
+
+    def run_statement(self, statement):
+        self.statements.append(statement)
+        self.tables[ROLLUP] = datetime(2024, 6, 3)
+        return True
+
+    def estimate_query_bytes(self, sql, parameters=None):
+        return 100 if ROLLUP in sql else 10_000
+
+
+@pytest.fixture(autouse=True)
+def rollup_config(monkeypatch):
+    monkeypatch.setattr(Config, "ROLLUP_DATASET", None)
+    monkeypatch.setattr(Config, "ROLLUP_TABLE_PREFIX", "rollup_daily_")
+    monkeypatch.setattr(Config, "ROLLUP_AUTO_REFRESH", True)
+
+
+def make_router(tables):
+    bq = FakeBigQuery(tables)
+    return RollupRouter(RollupStore(bq, SCHEMAS)), bq
+
+
+def test_current_rollup_is_used():
+    router, bq = make_router({BASE: datetime(2024, 6, 1), ROLLUP: datetime(2024, 6, 2)})
+    routing = router.route(QUERY)
+    assert routing['routed']
+    assert f"`{ROLLUP}`" in routing['sql']
+    assert routing['bytes_saved'] == 9_900
+    assert bq.statements == []
+
+
+def test_stale_rollup_is_refreshed_before_routing():
+    router, bq = make_router({BASE: datetime(2024, 6, 2), ROLLUP: datetime(2024, 6, 1)})
+    routing = router.route(QUERY)
+    assert routing['routed']
+    assert len(bq.statements) == 1 and "DELETE FROM" in bq.statements[0]
+    assert "BEGIN TRANSACTION" in bq.statements[0]
+
+
+def test_stale_rollup_is_skipped_without_auto_refresh(monkeypatch):
+    monkeypatch.setattr(Config, "ROLLUP_AUTO_REFRESH", False)
+    router, bq = make_router({BASE: datetime(2024, 6, 2), ROLLUP: datetime(2024, 6, 1)})
+    assert router.route(QUERY) == {'sql': QUERY, 'routed': False}
+    assert bq.statements == []
+
+
+def test_missing_rollup_is_not_built_by_a_query():
+    router, bq = make_router({BASE: datetime(2024, 6, 2)})
+    assert router.route(QUERY) == {'sql': QUERY, 'routed': False}
+    assert bq.statements == []
+
+
+def test_rollup_created_later_is_picked_up():
+    router, bq = make_router({BASE: datetime(2024, 6, 1)})
+    assert not router.route(QUERY)['routed']
+    bq.tables[ROLLUP] = datetime(2024, 6, 2)
+    assert router.route(QUERY)['routed']
+
+
+def test_row_level_query_is_not_routed():
+    router, _ = make_router({BASE: datetime(2024, 6, 1), ROLLUP: datetime(2024, 6, 2)})
+    sql = "SELECT campaign_name, spend FROM marketing_campaigns"
+    assert router.route(sql) == {'sql': sql, 'routed': False}
+
+
+def test_unknown_table_is_reported_without_streamlit():
+    store = RollupStore(FakeBigQuery({}), SCHEMAS)
+    assert store.build("orders") is False
+    assert store.bq_client.reports == [("error", "No usable rollup definition for 'orders'")]
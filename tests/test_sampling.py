@@ -0,0 +1,102 @@
+"""
+Tests for sampled previews: where TABLESAMPLE goes and how aggregates are scaled up.
+"""
+
+import pytest
+
+from config import Config
+from sampling import preview_query, sample_query, scale_aggregates
+
+
+def compact(sql):
+    return " ".join(sql.split())
+
+
+def test_sum_and_count_are_scaled():
+    sql, info = sample_query(
+        "SELECT channel, SUM(spend) AS spend, COUNT(*) AS campaigns FROM marketing_campaigns GROUP BY channel", 5
+    )
+    assert compact(sql) == (
+        "SELECT channel, (SUM(spend) * 20) AS spend, (COUNT(*) * 20) AS campaigns "
+        "FROM marketing_campaigns TABLESAMPLE SYSTEM (5 PERCENT) GROUP BY channel"
+    )
+    assert info['table'] == "marketing_campaigns"
+    assert info['factor'] == 20
+    assert info['scaled'] == ["spend", "campaigns"]
+    assert info['unscaled'] == []
+
+
+def test_non_additive_aggregates_are_left_alone():
+    sql, info = sample_query(
+        "SELECT AVG(spend) AS avg_spend, MAX(spend) AS top, COUNT(DISTINCT channel) AS channels "
+        "FROM marketing_campaigns", 10
+    )
+    assert "AVG(spend) AS avg_spend" in sql
+    assert "MAX(spend) AS top" in sql
+    assert "COUNT(DISTINCT channel) AS channels" in sql
+    assert info['scaled'] == []
+    assert info['unscaled'] == ["avg_spend", "top", "channels"]
+
+
+def test_ratio_of_sums_is_unchanged():
+    text, scaled, unscaled = scale_aggregates("SUM(revenue) / SUM(spend)", 10)
+    assert text == "(SUM(revenue) * 10) / (SUM(spend) * 10)"
+    assert (scaled, unscaled) == (2, 0)
+
+
+def test_counts_stay_integers_with_a_fractional_factor():
+    text, _, _ = scale_aggregates("COUNTIF(clicks > 0)", 3)
+    assert text == "CAST(COUNTIF(clicks > 0) * 33.33333333 AS INT64)"
+    text, _, _ = scale_aggregates("SUM(spend)", 3)
+    assert text == "(SUM(spend) * 33.33333333)"
+
+
+def test_window_aggregates_are_not_scaled():
+    text, scaled, _ = scale_aggregates("SUM(spend) OVER (PARTITION BY channel)", 5)
+    assert text == "SUM(spend) OVER (PARTITION BY channel)"
+    assert scaled == 0
+
+
+def test_having_is_scaled_too():
+    sql, _ = sample_query(
+        "SELECT channel, SUM(spend) AS spend FROM marketing_campaigns GROUP BY channel HAVING SUM(spend) > 1000", 5
+    )
+    assert "HAVING (SUM(spend) * 20) > 1000" in compact(sql)
+
+
+def test_only_the_first_joined_table_is_sampled():
+    sql, info = sample_query(
+        "SELECT c.channel, SUM(m.new_customers) AS customers FROM `proj.kpi.customer_metrics` m "
+        "JOIN marketing_campaigns c ON c.channel = m.channel GROUP BY c.channel", 5
+    )
+    assert "FROM `proj.kpi.customer_metrics` m TABLESAMPLE SYSTEM (5 PERCENT) JOIN marketing_campaigns c" in compact(sql)
+    assert info['table'] == "proj.kpi.customer_metrics"
+
+
+def test_dotted_table_path_with_alias():
+    sql, info = sample_query("SELECT SUM(spend) AS spend FROM my-project.kpi.marketing_campaigns AS m", 5)
+    assert "FROM my-project.kpi.marketing_campaigns AS m TABLESAMPLE SYSTEM (5 PERCENT)" in compact(sql)
+    assert info['table'] == "my-project.kpi.marketing_campaigns"
+
+
+@pytest.mark.parametrize("sql", [
+    "WITH t AS (SELECT * FROM marketing_campaigns) SELECT COUNT(*) FROM t",
+    "SELECT COUNT(*) FROM (SELECT channel FROM marketing_campaigns)",
+    "SELECT COUNT(*) FROM marketing_campaigns TABLESAMPLE SYSTEM (10 PERCENT)",
+    "SELECT COUNT(*) FROM UNNEST([1, 2, 3])",
+    "SELECT 1",
+])
+def test_unsupported_queries_are_not_sampled(sql):
+    assert sample_query(sql, 5) is None
+
+
+@pytest.mark.parametrize("percent", [0, 100, 150])
+def test_percent_must_be_a_fraction(percent):
+    assert sample_query("SELECT COUNT(*) FROM marketing_campaigns", percent) is None
+
+
+def test_preview_is_limited(monkeypatch):
+    monkeypatch.setattr(Config, "PROGRESSIVE_PREVIEW_ROWS", 50)
+    sql = preview_query("SELECT campaign_name, spend FROM marketing_campaigns", percent=1)
+    assert "TABLESAMPLE SYSTEM (1 PERCENT)" in sql
+    assert sql.endswith("LIMIT 50")
@@ -0,0 +1,123 @@
+"""
+Tests for the fair scheduler: fair ordering, queue cleanup and decaying per-user counts.
+"""
+
+import threading
+import time
+
+import pytest
+
+from scheduler import BATCH, INTERACTIVE, FairScheduler, QueueTimeoutError
+
+
+def make_scheduler(max_concurrency=1, per_user_concurrency=1, half_life=600):
+    return FairScheduler(
+        "test", max_concurrency=max_concurrency, per_user_concurrency=per_user_concurrency,
+        rate_per_minute=60_000, user_rate_per_minute=60_000, half_life=half_life
+    )
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not reached"
+        time.sleep(0.005)
+
+
+def queue_behind(scheduler, requests):
+    """Hold the only slot, queue (user_id, priority) requests in order, then release; returns the admission order"""
+    admitted = []
+    release = threading.Event()
+
+    def hold():
+        with scheduler.slot("holder"):
+            release.wait(2)
+
+    def request(user_id, priority):
+        with scheduler.slot(user_id, priority=priority, timeout=5):
+            admitted.append(user_id)
+
+    threads = [threading.Thread(target=hold)]
+    threads[0].start()
+    wait_until(lambda: scheduler.snapshot()['active'] == 1)
+    for user_id, priority in requests:
+        thread = threading.Thread(target=request, args=(user_id, priority))
+        thread.start()
+        threads.append(thread)
+        wait_until(lambda: scheduler.snapshot()['queued'] == len(threads) - 1)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    return admitted
+
+
+def test_user_with_fewer_requests_goes_first():
+    scheduler = make_scheduler()
+    for _ in range(3):
+        with scheduler.slot("power user"):
+            pass
+    assert queue_behind(scheduler, [("power user", INTERACTIVE), ("newcomer", INTERACTIVE)]) == [
+        "newcomer", "power user"
+    ]
+
+
+def test_interactive_goes_before_batch():
+    scheduler = make_scheduler()
+    assert queue_behind(scheduler, [("prewarm", BATCH), ("analyst", INTERACTIVE)]) == ["analyst", "prewarm"]
+
+
+def test_timeout_leaves_no_ticket_behind():
+    scheduler = make_scheduler()
+    with scheduler.slot("holder"):
+        with pytest.raises(QueueTimeoutError):
+            with scheduler.slot("late", timeout=0.05):
+                pass
+        assert scheduler.snapshot()['queued'] == 0
+    assert scheduler.snapshot()['rejected'] == 1
+
+
+def test_on_wait_raising_leaves_no_ticket_behind():
+    scheduler = make_scheduler()
+
+    def stop(position):
+        raise KeyboardInterrupt("script rerun")
+
+    with scheduler.slot("holder"):
+        with pytest.raises(KeyboardInterrupt):
+            with scheduler.slot("viewer", on_wait=stop):
+                pass
+        assert scheduler.snapshot()['queued'] == 0
+    with scheduler.slot("next", timeout=0.5):
+        pass
+
+
+def test_served_count_decays():
+    scheduler = make_scheduler(half_life=10)
+    for _ in range(4):
+        with scheduler.slot("analyst"):
+            pass
+    now = scheduler._served["analyst"][1]
+    assert scheduler._served_count("analyst", now) == pytest.approx(4, rel=0.01)
+    assert scheduler._served_count("analyst", now + 10) == pytest.approx(2, rel=0.01)
+    assert scheduler._served_count("analyst", now + 20) == pytest.approx(1, rel=0.01)
+    assert scheduler._served_count("someone else", now) == 0
+
+
+def test_idle_users_are_forgotten():
+    scheduler = make_scheduler(max_concurrency=5, per_user_concurrency=5, half_life=10)
+    for user_id in ("a", "b", "c"):
+        with scheduler.slot(user_id):
+            pass
+    now = time.monotonic()
+    scheduler._prune(now + 3600)
+    assert scheduler._served == {}
+    assert scheduler._user_buckets == {}
+
+
+def test_active_users_are_kept():
+    scheduler = make_scheduler(max_concurrency=5, per_user_concurrency=5, half_life=10)
+    with scheduler.slot("idle"):
+        pass
+    with scheduler.slot("busy"):
+        scheduler._prune(time.monotonic() + 3600)
+        assert set(scheduler._served) == {"busy"}
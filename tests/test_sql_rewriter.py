@@ -0,0 +1,98 @@
+"""
+Tests for the cost-reducing SQL rewrites.
+"""
+
+import pytest
+
+from config import Config
+from sql_rewriter import limits_rows, reduces_scan, rewrite_for_cost
+
+SCHEMAS = {
+    'orders': {
+        'columns': {'order_id': "STRING", 'order_date': "DATE", 'channel': "STRING", 'revenue': "FLOAT64"},
+        'partitioning': {'type': "DAY", 'field': "order_date"}
+    },
+    'page_views': {
+        'columns': {'event_id': "STRING", 'name': "STRING"},
+        'partitioning': {'type': "DAY"}
+    },
+    'campaigns': {'columns': {'campaign_name': "STRING", 'spend': "FLOAT64"}}
+}
+
+
+@pytest.fixture(autouse=True)
+def rewrite_config(monkeypatch):
+    monkeypatch.setattr(Config, "MAX_QUERY_RESULTS", 1000)
+    monkeypatch.setattr(Config, "PARTITION_FILTER_DAYS", 0)
+
+
+def test_adds_a_missing_limit():
+    sql, changes = rewrite_for_cost("SELECT campaign_name FROM campaigns", SCHEMAS)
+    assert sql.endswith("LIMIT 1000")
+    assert changes == ["Added LIMIT 1000"]
+    assert not reduces_scan(changes)
+
+
+def test_lowers_a_large_limit_and_keeps_a_small_one():
+    sql, changes = rewrite_for_cost("SELECT campaign_name FROM campaigns LIMIT 50000", SCHEMAS)
+    assert sql.endswith("LIMIT 1000") and changes == ["Lowered LIMIT 50000 to 1000"]
+    sql, changes = rewrite_for_cost("SELECT campaign_name FROM campaigns LIMIT 10", SCHEMAS)
+    assert sql == "SELECT campaign_name FROM campaigns LIMIT 10" and changes == []
+
+
+def test_extract_year_gains_a_partition_range():
+    sql, changes = rewrite_for_cost(
+        "SELECT channel, SUM(revenue) AS revenue FROM orders WHERE EXTRACT(YEAR FROM order_date) = 2024 "
+        "GROUP BY channel", SCHEMAS
+    )
+    assert "order_date BETWEEN DATE '2024-01-01' AND DATE '2024-12-31'" in sql
+    assert "EXTRACT(YEAR FROM order_date) = 2024" in sql
+    assert reduces_scan(changes)
+    assert not limits_rows(changes)
+
+
+def test_existing_partition_filter_is_left_alone():
+    sql, changes = rewrite_for_cost(
+        "SELECT channel FROM orders WHERE order_date >= DATE '2024-01-01' LIMIT 10", SCHEMAS
+    )
+    assert changes == []
+
+
+def test_unfiltered_query_reads_everything_by_default():
+    sql, changes = rewrite_for_cost("SELECT channel, SUM(revenue) AS revenue FROM orders GROUP BY channel", SCHEMAS)
+    assert "CURRENT_DATE" not in sql
+    assert not limits_rows(changes)
+
+
+def test_recent_partitions_window_is_opt_in_and_reported(monkeypatch):
+    monkeypatch.setattr(Config, "PARTITION_FILTER_DAYS", 90)
+    sql, changes = rewrite_for_cost("SELECT channel, SUM(revenue) AS revenue FROM orders GROUP BY channel", SCHEMAS)
+    assert "order_date >= DATE_SUB(CURRENT_DATE(), INTERVAL 90 DAY)" in sql
+    assert limits_rows(changes)
+    assert reduces_scan(changes)
+
+
+def test_ingestion_time_partitioning_uses_the_pseudo_column(monkeypatch):
+    monkeypatch.setattr(Config, "PARTITION_FILTER_DAYS", 7)
+    sql, _ = rewrite_for_cost("SELECT name FROM page_views", SCHEMAS)
+    assert "_PARTITIONTIME >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL 7 DAY)" in sql
+
+
+def test_select_star_subquery_is_narrowed():
+    sql, changes = rewrite_for_cost(
+        "SELECT channel, SUM(revenue) AS revenue FROM (SELECT * FROM campaigns, orders) GROUP BY channel",
+        SCHEMAS
+    )
+    # Not a single-table SELECT: left as it is
+    assert "SELECT *" in sql
+    sql, changes = rewrite_for_cost(
+        "SELECT o.channel, SUM(o.revenue) AS revenue FROM (SELECT * FROM orders) o GROUP BY o.channel", SCHEMAS
+    )
+    assert "(SELECT channel, revenue FROM orders)" in " ".join(sql.split())
+    assert any(change.startswith("Narrowed SELECT *") for change in changes)
+    assert reduces_scan(changes)
+
+
+def test_top_level_select_star_is_kept():
+    sql, changes = rewrite_for_cost("SELECT * FROM campaigns LIMIT 5", SCHEMAS)
+    assert sql == "SELECT * FROM campaigns LIMIT 5" and changes == []
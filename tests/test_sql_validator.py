@@ -0,0 +1,115 @@
+"""
+Tests for the local static checks run before a BigQuery dry run.
+"""
+
+import pytest
+
+from config import Config
+from sql_validator import validate_sql
+
+SCHEMAS = {
+    'marketing_campaigns': {'columns': {
+        'campaign_id': "STRING", 'campaign_name': "STRING", 'channel': "STRING",
+        'start_date': "DATE", 'spend': "FLOAT64", 'revenue': "FLOAT64"
+    }},
+    'customer_metrics': {'columns': {'date': "DATE", 'channel': "STRING", 'new_customers': "INT64"}}
+}
+
+
+@pytest.fixture(autouse=True)
+def limit(monkeypatch):
+    monkeypatch.setattr(Config, "MAX_QUERY_RESULTS", 1000)
+
+
+def test_select_passes_and_gets_a_limit():
+    is_valid, message, sql = validate_sql("SELECT campaign_name, spend FROM marketing_campaigns;", SCHEMAS)
+    assert is_valid
+    assert message == "Query passed local checks (LIMIT added)"
+    assert sql == "SELECT campaign_name, spend FROM marketing_campaigns\nLIMIT 1000"
+
+
+def test_existing_limit_is_kept():
+    is_valid, message, sql = validate_sql("SELECT campaign_name FROM marketing_campaigns LIMIT 5", SCHEMAS)
+    assert is_valid and message == "Query passed local checks"
+    assert sql.endswith("LIMIT 5")
+
+
+@pytest.mark.parametrize("sql, keyword", [
+    ("DELETE FROM marketing_campaigns WHERE TRUE", "DELETE"),
+    ("UPDATE marketing_campaigns SET spend = 0 WHERE TRUE", "UPDATE"),
+    ("INSERT INTO marketing_campaigns (campaign_id) VALUES ('x')", "INSERT"),
+    ("DROP TABLE marketing_campaigns", "DROP"),
+    ("CREATE TABLE copy AS SELECT * FROM marketing_campaigns", "CREATE"),
+    ("MERGE marketing_campaigns t USING customer_metrics s ON FALSE WHEN MATCHED THEN DELETE", "MERGE"),
+])
+def test_writes_are_rejected(sql, keyword):
+    is_valid, message, _ = validate_sql(sql, SCHEMAS)
+    assert not is_valid
+    assert f"found {keyword}" in message
+
+
+def test_replace_function_is_allowed():
+    is_valid, _, _ = validate_sql("SELECT REPLACE(campaign_name, 'a', 'b') AS name FROM marketing_campaigns", SCHEMAS)
+    assert is_valid
+
+
+@pytest.mark.parametrize("sql, message", [
+    ("", "Query is empty"),
+    ("SELECT 1; SELECT 2", "Only a single statement can be run"),
+    ("SELECT campaign_name FROM marketing_campaigns WHERE channel = 'email", "unterminated"),
+    ("SELECT SUM(spend FROM marketing_campaigns", "unbalanced parentheses"),
+    ("SHOW TABLES", "must start with SELECT or WITH"),
+])
+def test_malformed_sql_is_rejected(sql, message):
+    is_valid, text, _ = validate_sql(sql, SCHEMAS)
+    assert not is_valid
+    assert message in text
+
+
+def test_unknown_table_is_rejected():
+    is_valid, message, _ = validate_sql("SELECT * FROM campaign_results", SCHEMAS)
+    assert not is_valid and message == "Unknown table(s): campaign_results"
+
+
+def test_unknown_columns_are_rejected():
+    is_valid, message, _ = validate_sql("SELECT budget, m.clicks FROM marketing_campaigns m", SCHEMAS)
+    assert not is_valid
+    assert message == "Unknown column(s): budget, m.clicks"
+
+
+def test_aliases_and_ctes_are_known():
+    sql = """
+        WITH totals AS (
+            SELECT channel, SUM(spend) AS total_spend FROM marketing_campaigns GROUP BY channel
+        )
+        SELECT t.channel, total_spend, c.new_customers
+        FROM totals t JOIN customer_metrics c ON c.channel = t.channel
+        ORDER BY total_spend DESC
+    """
+    is_valid, message, _ = validate_sql(sql, SCHEMAS)
+    assert is_valid, message
+
+
+@pytest.mark.parametrize("date_part", [
+    "DAY", "WEEK", "WEEK(MONDAY)", "WEEK(SUNDAY)", "ISOWEEK", "MONTH", "QUARTER", "YEAR", "ISOYEAR",
+])
+def test_date_parts_are_not_columns(date_part):
+    sql = (
+        f"SELECT DATE_TRUNC(date, {date_part}) AS period, SUM(new_customers) AS new_customers "
+        "FROM customer_metrics GROUP BY period"
+    )
+    is_valid, message, _ = validate_sql(sql, SCHEMAS)
+    assert is_valid, message
+
+
+@pytest.mark.parametrize("date_part", ["DAYOFWEEK", "DAYOFYEAR", "ISOWEEK", "MICROSECOND"])
+def test_extract_date_parts_are_not_columns(date_part):
+    is_valid, message, _ = validate_sql(
+        f"SELECT EXTRACT({date_part} FROM start_date) AS part, spend FROM marketing_campaigns", SCHEMAS
+    )
+    assert is_valid, message
+
+
+def test_columns_are_not_checked_without_schemas():
+    is_valid, _, _ = validate_sql("SELECT anything FROM anywhere")
+    assert is_valid
@@ -0,0 +1,118 @@
+"""
+Tests for query templates learned from answered questions.
+"""
+
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from cache_backend import MemoryBackend
+from templates import (
+    TemplateStore, fill, parameter_value, parameterize, question_literals, question_shape, render
+)
+
+SQL = (
+    "SELECT campaign_name, SUM(revenue) / SUM(spend) AS roas FROM marketing_campaigns "
+    "WHERE start_date >= DATE '2024-01-01' AND channel = 'email' "
+    "GROUP BY campaign_name ORDER BY roas DESC LIMIT 5"
+)
+QUESTION = "top 5 campaigns by ROAS on 'email' since 2024-01-01"
+
+
+def test_question_literals_and_shape():
+    assert question_literals(QUESTION) == [("number", "5"), ("text", "email"), ("date", "2024-01-01")]
+    assert question_shape(QUESTION) == "top {number} campaigns by roas on {text} since {date}"
+    assert question_shape("Top 10 campaigns by ROAS on 'social' since 2023-06-01") == question_shape(QUESTION)
+
+
+def test_apostrophes_are_not_quoted_values():
+    assert question_literals("what is each campaign's spend in 2024") == [("number", "2024")]
+
+
+def test_parameterize_replaces_every_value():
+    template_sql, parameters = parameterize(SQL, question_literals(QUESTION))
+    assert template_sql == (
+        "SELECT campaign_name, SUM(revenue) / SUM(spend) AS roas FROM marketing_campaigns "
+        "WHERE start_date >= @p3 AND channel = @p2 "
+        "GROUP BY campaign_name ORDER BY roas DESC LIMIT @p1"
+    )
+    assert parameters == [
+        {'name': "p1", 'type': "INT64", 'value': "5"},
+        {'name': "p2", 'type': "STRING", 'value': "email"},
+        {'name': "p3", 'type': "DATE", 'value': "2024-01-01"}
+    ]
+
+
+@pytest.mark.parametrize("question, sql", [
+    # The value is not in the SQL
+    ("spend since 2024-01-01", "SELECT SUM(spend) FROM marketing_campaigns"),
+    # The number appears twice, so which one is the question's cannot be told
+    ("top 2 campaigns", "SELECT ROUND(spend, 2) AS spend FROM marketing_campaigns LIMIT 2"),
+    # The same value twice in the question
+    ("campaigns between 5 and 5", "SELECT * FROM marketing_campaigns WHERE spend BETWEEN 5 AND 5"),
+    # No values at all
+    ("total spend", "SELECT SUM(spend) FROM marketing_campaigns"),
+])
+def test_ambiguous_questions_are_not_templated(question, sql):
+    assert parameterize(sql, question_literals(question)) is None
+
+
+def test_render_writes_values_back():
+    template_sql, parameters = parameterize(SQL, question_literals(QUESTION))
+    assert render(template_sql, parameters) == SQL
+    escaped = render("SELECT * FROM t WHERE name = @p1", [{'name': "p1", 'type': "STRING", 'value': "o'brien"}])
+    assert escaped == "SELECT * FROM t WHERE name = 'o\\'brien'"
+
+
+def test_parameter_values():
+    assert parameter_value({'type': "INT64", 'value': "5"}) == 5
+    assert parameter_value({'type': "FLOAT64", 'value': "2.5"}) == 2.5
+    assert parameter_value({'type': "DATE", 'value': "2024-01-01"}) == date(2024, 1, 1)
+    assert parameter_value({'type': "TIMESTAMP", 'value': "2024-01-01 10:00:00"}) == datetime(2024, 1, 1, 10)
+    with pytest.raises(ValueError):
+        parameter_value({'type': "INT64", 'value': "2.5"})
+
+
+def test_fill_rejects_values_of_the_wrong_type():
+    template = {'parameters': [{'name': "p1", 'type': "DATE"}]}
+    assert fill(template, "spend since 2024-13-45") is None
+    assert fill(template, "spend since 2024-02-01") == [{'name': "p1", 'type': "DATE", 'value': "2024-02-01"}]
+
+
+@pytest.fixture
+def store():
+    return TemplateStore(max_entries=10, ttl_hours=1, backend=MemoryBackend(10))
+
+
+def test_learned_template_answers_a_question_of_the_same_shape(store):
+    assert store.learn(QUESTION, SQL, "schema-1") is not None
+    match = store.match("top 10 campaigns by ROAS on 'social' since 2023-06-01", "schema-1")
+    assert match['sql'] == SQL.replace("2024-01-01", "2023-06-01").replace("'email'", "'social'") \
+        .replace("LIMIT 5", "LIMIT 10")
+    assert match['template_sql'].endswith("LIMIT @p1")
+    assert [p['value'] for p in match['parameters']] == ["10", "social", "2023-06-01"]
+    assert match['question'] == QUESTION
+
+
+def test_templates_are_per_schema(store):
+    store.learn(QUESTION, SQL, "schema-1")
+    assert store.match(QUESTION, "schema-2") is None
+
+
+def test_template_is_stored_only_if_the_check_accepts_it(store):
+    checked = []
+
+    def reject(template_sql, parameters):
+        checked.append((template_sql, parameters))
+        return False
+
+    assert store.learn(QUESTION, SQL, "schema-1", check=reject) is None
+    assert len(checked) == 1
+    assert store.match(QUESTION, "schema-1") is None
+
+
+def test_expired_template_is_not_used(store):
+    template = store.learn(QUESTION, SQL, "schema-1")
+    template['timestamp'] = datetime.now() - timedelta(hours=2)
+    store.backend.set(store._key(QUESTION, "schema-1"), template)
+    assert store.match(QUESTION, "schema-1") is None
@@ -1,59 +1,22 @@
 import os
-import openai
-from langchain_community.llms import OpenAI
-from vertexai import init as vertexai_init
-from langchain_google_vertexai import VertexAI
-from langchain.prompts import PromptTemplate
-from langchain.chains import LLMChain
+import hashlib
+import threading
+import time
 import streamlit as st
 from config import Config
+from example_store import EXAMPLE_STORE, SEED_EXAMPLES, format_examples
+from llm_router import LLMRouter
+from result_cache import GENERATION_CACHE
+from scheduler import LLM_SCHEDULER, INTERACTIVE, scheduled
+from schema_catalog import schema_fingerprint, encode_schemas, format_schemas_verbose
+from singleflight import LLM_FLIGHTS
+from sql_utils import normalize_sql
+from tokens import count_tokens
+from tracing import record_llm_call
+from usage import USAGE
 
-class Text2SQLGenerator:
-    def __init__(self, use_vertex_ai=True):
-        self.use_vertex_ai = use_vertex_ai
-        self.llm = None
-        self.chain = None
-        self._initialize_llm()
-    
-    def _initialize_llm(self):
-        """Initialize the language model"""
-        try:
-            if self.use_vertex_ai:
-                # Use Google Vertex AI
-                # Ensure Vertex AI is initialized with project/region
-                if not Config.GOOGLE_CLOUD_PROJECT:
-                    raise ValueError("GOOGLE_CLOUD_PROJECT is not set. Set env var or Config.GOOGLE_CLOUD_PROJECT.")
-                # Default region can be customized if your resources live elsewhere
-                vertexai_init(project=Config.GOOGLE_CLOUD_PROJECT, location=os.getenv("VERTEX_AI_LOCATION", "us-central1"))
-                self.llm = VertexAI(
-                    model_name="text-bison@001",
-                    temperature=0.1,
-                    max_output_tokens=1024
-                )
-            else:
-                # Use OpenAI
-                if not Config.OPENAI_API_KEY:
-                    st.error("OpenAI API key not found. Please set OPENAI_API_KEY in your environment.")
-                    return
-                
-                openai.api_key = Config.OPENAI_API_KEY
-                self.llm = OpenAI(
-                    model_name="gpt-3.5-turbo",
-                    temperature=0.1,
-                    max_tokens=1024
-                )
-            
-            self._create_chain()
-            st.success("✅ Text-to-SQL model initialized successfully!")
-            
-        except Exception as e:
-            st.error(f"❌ Failed to initialize text-to-SQL model: {str(e)}")
-    
-    def _create_chain(self):
-        """Create the LLM chain for text-to-SQL conversion"""
-        prompt_template = PromptTemplate(
-            input_variables=["question", "table_schemas", "sample_queries"],
-            template="""
+# Prompt templates (also formatted directly to account and trace each call)
+GENERATE_PROMPT = """
 You are an expert SQL analyst specializing in BigQuery. Convert the user's natural language question into a BigQuery SQL query.
 
 Available tables and their schemas:
@@ -74,98 +37,321 @@ Instructions:
 
 SQL Query:
 """
+
+REPAIR_PROMPT = """
+You are an expert SQL analyst specializing in BigQuery. The SQL query below was written to answer the user's question, but it failed.
+
+Available tables and their schemas:
+{table_schemas}
+
+User Question: {question}
+
+Failed SQL Query:
+{sql}
+
+Error:
+{error}
+
+Instructions:
+1. Fix the query so that it runs on BigQuery and still answers the user's question
+2. Only use the tables and columns listed above
+3. Keep the LIMIT clause (max 1000 rows)
+4. Only return the corrected SQL query, no explanations
+
+Corrected SQL Query:
+"""
+
+class RepairStats:
+    """Outcome and added latency of the automatic repair loop"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.loops = 0
+        self.repaired = 0
+        self.attempts = 0
+        self.added_latency = 0.0
+    
+    def record(self, repaired, attempts, latency):
+        with self._lock:
+            self.loops += 1
+            self.repaired += int(repaired)
+            self.attempts += attempts
+            self.added_latency += latency
+    
+    def snapshot(self):
+        with self._lock:
+            return {
+                'loops': self.loops,
+                'repaired': self.repaired,
+                'success_rate': self.repaired / self.loops if self.loops else 0.0,
+                'avg_attempts': self.attempts / self.loops if self.loops else 0.0,
+                'avg_added_latency': self.added_latency / self.loops if self.loops else 0.0
+            }
+
+# Shared by every session
+REPAIR_STATS = RepairStats()
+
+class Text2SQLGenerator:
+    def __init__(self, use_vertex_ai=True, quiet=False):
+        self.use_vertex_ai = use_vertex_ai
+        # Quiet generators (background threads without a page) keep messages instead of rendering them
+        self.quiet = quiet
+        self.last_message = None
+        self.llm = None
+        self.chain = None
+        self.chains = {}
+        self.repair_chains = {}
+        self.router = None
+        self.repair_router = None
+        self._chain_lock = threading.Lock()
+        self._initialized = False
+    
+    def _report(self, level, message):
+        """Show a status message on the page, or only keep it when quiet"""
+        self.last_message = message
+        if not self.quiet:
+            getattr(st, level)(message)
+    
+    def _ensure_initialized(self):
+        """Initialize the language model on first use rather than at construction"""
+        if not self._initialized:
+            self._initialized = True
+            self._initialize_llm()
+    
+    @property
+    def provider(self):
+        """Name of the primary LLM provider"""
+        return "vertex" if self.use_vertex_ai else "openai"
+    
+    def _available_providers(self):
+        """Providers with enough configuration to be used, primary first"""
+        configured = {
+            "vertex": bool(Config.GOOGLE_CLOUD_PROJECT),
+            "openai": bool(Config.OPENAI_API_KEY)
+        }
+        return [self.provider] + [name for name, ok in configured.items() if ok and name != self.provider]
+    
+    def _initialize_llm(self):
+        """Initialize the language model"""
+        try:
+            if not self.use_vertex_ai and not Config.OPENAI_API_KEY:
+                self._report("error", "OpenAI API key not found. Please set OPENAI_API_KEY in your environment.")
+                return
+            
+            self.llm = self._build_llm(self.provider)
+            self.chain = self._create_chain(self.llm)
+            self.chains[self.provider] = self.chain
+            
+            # The fallback provider's chain is only built if a call is routed to it
+            self.router = LLMRouter(
+                {name: self._provider_call(name) for name in self._available_providers()},
+                primary=self.provider
+            )
+            self.repair_router = LLMRouter(
+                {name: self._provider_call(name, "repair") for name in self._available_providers()},
+                primary=self.provider
+            )
+            self._report("success", "✅ Text-to-SQL model initialized successfully!")
+            
+        except Exception as e:
+            self._report("error", f"❌ Failed to initialize text-to-SQL model: {str(e)}")
+    
+    def _build_llm(self, provider):
+        """Create the LangChain LLM for a provider"""
+        # Provider SDKs are imported here so the unused one is never loaded
+        if provider == "vertex":
+            from vertexai import init as vertexai_init
+            from langchain_google_vertexai import VertexAI
+            
+            # Use Google Vertex AI
+            # Ensure Vertex AI is initialized with project/region
+            if not Config.GOOGLE_CLOUD_PROJECT:
+                raise ValueError("GOOGLE_CLOUD_PROJECT is not set. Set env var or Config.GOOGLE_CLOUD_PROJECT.")
+            # Default region can be customized if your resources live elsewhere
+            vertexai_init(project=Config.GOOGLE_CLOUD_PROJECT, location=os.getenv("VERTEX_AI_LOCATION", "us-central1"))
+            return VertexAI(
+                model_name="text-bison@001",
+                temperature=0.1,
+                max_output_tokens=1024
+            )
+        
+        # Use OpenAI
+        import openai
+        from langchain_community.llms import OpenAI
+        
+        openai.api_key = Config.OPENAI_API_KEY
+        return OpenAI(
+            model_name="gpt-3.5-turbo",
+            temperature=0.1,
+            max_tokens=1024
+        )
+    
+    def _provider_call(self, provider, kind="generate"):
+        """Callable the router uses to run the prompt on one provider"""
+        chains = self.chains if kind == "generate" else self.repair_chains
+        create = self._create_chain if kind == "generate" else self._create_repair_chain
+        
+        def call(inputs):
+            with self._chain_lock:
+                if provider not in chains:
+                    chains[provider] = create(self._build_llm(provider))
+                chain = chains[provider]
+            return chain.run(**inputs)
+        return call
+    
+    def _create_chain(self, llm):
+        """Create the LLM chain for text-to-SQL conversion"""
+        from langchain.prompts import PromptTemplate
+        from langchain.chains import LLMChain
+        
+        prompt_template = PromptTemplate(
+            input_variables=["question", "table_schemas", "sample_queries"],
+            template=GENERATE_PROMPT
         )
         
-        self.chain = LLMChain(llm=self.llm, prompt=prompt_template)
+        return LLMChain(llm=llm, prompt=prompt_template)
     
-    def generate_sql(self, question, table_schemas, sample_queries=""):
+    def _create_repair_chain(self, llm):
+        """Create the LLM chain that fixes a query BigQuery rejected"""
+        from langchain.prompts import PromptTemplate
+        from langchain.chains import LLMChain
+        
+        prompt_template = PromptTemplate(
+            input_variables=["question", "table_schemas", "sql", "error"],
+            template=REPAIR_PROMPT
+        )
+        
+        return LLMChain(llm=llm, prompt=prompt_template)
+    
+    def generate_sql(self, question, table_schemas, sample_queries="", priority=INTERACTIVE, use_cache=True):
         """Generate SQL query from natural language question"""
         try:
+            # SQL generated earlier (or pre-warmed) for the same question and schema
+            fingerprint = schema_fingerprint(table_schemas)
+            if use_cache:
+                cached = GENERATION_CACHE.get(question, fingerprint)
+                if cached is not None:
+                    return cached['sql']
+            
+            self._ensure_initialized()
             if not self.chain:
-                st.error("Text-to-SQL model not initialized")
+                self._report("error", "Text-to-SQL model not initialized")
                 return None
+            USAGE.check_quota('llm')
             
-            # Format table schemas for the prompt
-            schemas_text = self._format_table_schemas(table_schemas)
-            
-            # Generate SQL query
-            result = self.chain.run(
-                question=question,
-                table_schemas=schemas_text,
-                sample_queries=sample_queries
+            # Identical concurrent requests from other sessions share one LLM call
+            key = (
+                self.provider,
+                question.strip(),
+                fingerprint,
+                hashlib.sha256(sample_queries.encode("utf-8")).hexdigest()
             )
-            
-            # Clean up the result (remove any extra text)
-            sql_query = result.strip()
-            if sql_query.startswith("```sql"):
-                sql_query = sql_query[6:]
-            if sql_query.endswith("```"):
-                sql_query = sql_query[:-3]
-            
-            return sql_query.strip()
+            sql = LLM_FLIGHTS.do(key, lambda: self._scheduled_chain(question, table_schemas, sample_queries, priority))
+            if sql:
+                GENERATION_CACHE.put(question, fingerprint, sql)
+            return sql
             
         except Exception as e:
-            st.error(f"❌ Failed to generate SQL query: {str(e)}")
+            self._report("error", f"❌ Failed to generate SQL query: {str(e)}")
             return None
     
-    def _format_table_schemas(self, table_schemas):
-        """Format table schemas for the prompt"""
-        schemas_text = ""
-        for table_name, schema_info in table_schemas.items():
-            schemas_text += f"\nTable: {table_name}\n"
-            schemas_text += f"Description: {schema_info.get('description', 'No description')}\n"
-            schemas_text += "Columns:\n"
+    def _scheduled_chain(self, question, table_schemas, sample_queries, priority):
+        """Run the chain once admitted by the process-wide LLM scheduler"""
+        with scheduled(LLM_SCHEDULER, priority=priority):
+            return self._run_chain(question, table_schemas, sample_queries)
+    
+    def _run_chain(self, question, table_schemas, sample_queries):
+        """Call the LLM and clean up the generated SQL"""
+        # Format table schemas for the prompt
+        schemas_text = self._format_table_schemas(table_schemas)
+        
+        # Generate SQL query (with retries, deadlines and failover)
+        inputs = {
+            'question': question,
+            'table_schemas': schemas_text,
+            'sample_queries': sample_queries
+        }
+        started = time.perf_counter()
+        result, provider = self.router.invoke(inputs)
+        self._record_call("generate", provider, inputs, result, time.perf_counter() - started)
+        
+        return self._clean_sql(result)
+    
+    def _record_call(self, kind, provider, inputs, result, seconds):
+        """Account the tokens of one call to the provider that answered it and add it to the active trace"""
+        prompt = (GENERATE_PROMPT if kind == "generate" else REPAIR_PROMPT).format(**inputs)
+        USAGE.record_llm(provider, count_tokens(prompt), count_tokens(result))
+        record_llm_call(kind, provider, prompt, result, seconds)
+    
+    @staticmethod
+    def _clean_sql(result):
+        """Clean up the model output (remove any extra text)"""
+        sql_query = result.strip()
+        if sql_query.startswith("```sql"):
+            sql_query = sql_query[6:]
+        if sql_query.endswith("```"):
+            sql_query = sql_query[:-3]
+        
+        return sql_query.strip()
+    
+    def repair_sql(self, question, failed_sql, error, table_schemas, check, priority=INTERACTIVE):
+        """Ask the LLM to fix SQL that failed, until check() accepts it.
+
+        check(sql) returns (is_valid, message, sql). At most SQL_REPAIR_MAX_ATTEMPTS
+        repairs are tried within SQL_REPAIR_DEADLINE seconds. Returns the repaired
+        SQL or None.
+        """
+        started = time.monotonic()
+        deadline = started + Config.SQL_REPAIR_DEADLINE
+        attempts = 0
+        sql = failed_sql
+        try:
+            self._ensure_initialized()
+            if not self.repair_router:
+                return None
             
-            for col_name, col_type in schema_info.get('columns', {}).items():
-                schemas_text += f"  - {col_name}: {col_type}\n"
+            while attempts < Config.SQL_REPAIR_MAX_ATTEMPTS and time.monotonic() < deadline:
+                USAGE.check_quota('llm')
+                attempts += 1
+                inputs = {
+                    'question': question,
+                    'table_schemas': self._format_table_schemas(table_schemas or {}),
+                    'sql': sql,
+                    'error': error
+                }
+                with scheduled(LLM_SCHEDULER, priority=priority):
+                    call_started = time.perf_counter()
+                    result, provider = self.repair_router.invoke(inputs, deadline=deadline)
+                self._record_call("repair", provider, inputs, result, time.perf_counter() - call_started)
+                candidate = self._clean_sql(result)
+                # The same query again will fail the same way
+                if not candidate or normalize_sql(candidate) == normalize_sql(sql):
+                    break
+                
+                is_valid, error, candidate = check(candidate)
+                if is_valid:
+                    REPAIR_STATS.record(True, attempts, time.monotonic() - started)
+                    return candidate
+                sql = candidate
             
-            schemas_text += "\n"
+        except Exception as e:
+            self._report("warning", f"⚠️ Automatic query repair failed: {str(e)}")
         
-        return schemas_text
-    
-    def get_sample_queries(self):
-        """Return sample queries for common marketing KPI questions"""
-        return """
--- Sample Marketing KPI Queries:
-
--- 1. Campaign Performance Analysis
-SELECT 
-    campaign_name,
-    SUM(spend) as total_spend,
-    SUM(impressions) as total_impressions,
-    SUM(clicks) as total_clicks,
-    SUM(conversions) as total_conversions,
-    ROUND(SUM(clicks) / SUM(impressions) * 100, 2) as ctr_percentage,
-    ROUND(SUM(conversions) / SUM(clicks) * 100, 2) as conversion_rate,
-    ROUND(SUM(revenue) / SUM(spend), 2) as roas
-FROM marketing_campaigns 
-WHERE start_date >= '2024-01-01'
-GROUP BY campaign_name
-ORDER BY total_revenue DESC;
-
--- 2. Monthly Customer Metrics
-SELECT 
-    DATE_TRUNC(date, MONTH) as month,
-    SUM(new_customers) as new_customers,
-    SUM(returning_customers) as returning_customers,
-    AVG(churn_rate) as avg_churn_rate,
-    AVG(lifetime_value) as avg_ltv,
-    AVG(acquisition_cost) as avg_cac
-FROM customer_metrics 
-WHERE date >= '2024-01-01'
-GROUP BY month
-ORDER BY month;
-
--- 3. Top Performing Campaigns by ROAS
-SELECT 
-    campaign_name,
-    SUM(revenue) as total_revenue,
-    SUM(spend) as total_spend,
-    ROUND(SUM(revenue) / SUM(spend), 2) as roas
-FROM marketing_campaigns 
-WHERE start_date >= '2024-01-01'
-GROUP BY campaign_name
-HAVING SUM(spend) > 1000
-ORDER BY roas DESC
-LIMIT 10;
-"""
+        REPAIR_STATS.record(False, attempts, time.monotonic() - started)
+        return None
+    
+    def _format_table_schemas(self, table_schemas):
+        """Format table schemas for the prompt"""
+        if Config.SCHEMA_FORMAT == 'verbose':
+            return format_schemas_verbose(table_schemas)
+        return encode_schemas(
+            table_schemas,
+            include_descriptions=Config.SCHEMA_INCLUDE_DESCRIPTIONS,
+            token_budget=Config.SCHEMA_TOKEN_BUDGET
+        )
+    
+    def get_sample_queries(self, question=None):
+        """Return example queries for the prompt: the closest past queries for a question, else the built-in samples"""
+        if question:
+            return format_examples(EXAMPLE_STORE.search(question))
+        return format_examples(SEED_EXAMPLES)
@@ -0,0 +1,42 @@
+import math
+import re
+
+_WORD_RE = re.compile(r"[A-Za-z]+|\d+|\n+| {2,}|[^\sA-Za-z\d]")
+_encoder = None
+_encoder_loaded = False
+
+def _get_encoder():
+    """tiktoken's cl100k encoder if the optional package is installed"""
+    global _encoder, _encoder_loaded
+    if not _encoder_loaded:
+        _encoder_loaded = True
+        try:
+            import tiktoken
+            _encoder = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoder = None
+    return _encoder
+
+def count_tokens(text):
+    """Number of LLM tokens in text.
+
+    Uses tiktoken's cl100k encoding (pinned in requirements.txt). That is
+    exact for OpenAI models and an estimate for Vertex models, which use their
+    own tokenizer. If tiktoken is missing or cannot load its encoding (it is
+    downloaded on first use), the count falls back to an approximation:
+    punctuation, newlines and indentation count as one token each and words
+    as one token per 4 characters. tokenizer_name() says which is in use.
+    """
+    if not text:
+        return 0
+    encoder = _get_encoder()
+    if encoder is not None:
+        return len(encoder.encode(text))
+    total = 0
+    for piece in _WORD_RE.findall(text):
+        total += max(1, math.ceil(len(piece) / 4)) if piece[0].isalnum() else 1
+    return total
+
+def tokenizer_name():
+    """Which tokenizer count_tokens is using"""
+    return "tiktoken/cl100k_base" if _get_encoder() is not None else "approximate"
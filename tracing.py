@@ -0,0 +1,161 @@
+"""
+Opt-in recording of pipeline runs for replay.
+
+With TRACE_ENABLED, each run of a question through the pipeline is appended
+to TRACE_PATH as one JSON line. A trace holds:
+
+- the question and the sample queries it was prompted with,
+- every LLM call (formatted prompt, output, latency),
+- every dry run and query job (SQL, verdict, bytes, result shape, latency),
+- the generated and final SQL, and the final stage, source and error,
+- the time spent in each pipeline stage.
+
+The table schemas a trace was generated against are written once per
+fingerprint on a line of their own, so traces stay small. replay.py feeds the
+recorded traces back through the current code.
+"""
+
+import contextvars
+import json
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from config import Config
+from schema_catalog import schema_fingerprint
+
+TRACE_VERSION = 1
+
+_active_trace = contextvars.ContextVar("active_trace", default=None)
+
+class Trace:
+    """One pipeline run being recorded"""
+
+    def __init__(self, question, table_schemas=None):
+        self.table_schemas = table_schemas
+        self.data = {
+            'type': 'trace',
+            'version': TRACE_VERSION,
+            'trace_id': uuid.uuid4().hex,
+            'recorded_at': datetime.now().isoformat(timespec="seconds"),
+            'question': question,
+            'llm_calls': [],
+            'dry_runs': [],
+            'queries': [],
+            'stages': {}
+        }
+
+    @contextmanager
+    def stage(self, name):
+        """Charge the block's wall time to a stage; LLM calls and jobs inside it are recorded here"""
+        token = _active_trace.set(self)
+        started = time.perf_counter()
+        try:
+            yield self
+        finally:
+            stages = self.data['stages']
+            stages[name] = stages.get(name, 0.0) + time.perf_counter() - started
+            _active_trace.reset(token)
+
+    def update(self, **fields):
+        self.data.update(fields)
+
+def current_trace():
+    """Trace the calling code is running under, or None"""
+    return _active_trace.get()
+
+def record_llm_call(kind, provider, prompt, output, seconds):
+    """Add an LLM call ('generate' or 'repair') to the active trace, if any"""
+    trace = _active_trace.get()
+    if trace is not None:
+        trace.data['llm_calls'].append({
+            'kind': kind, 'provider': provider, 'prompt': prompt, 'output': output, 'seconds': seconds
+        })
+
+def record_dry_run(sql, valid, message, bytes_processed, seconds):
+    """Add a dry run to the active trace, if any"""
+    trace = _active_trace.get()
+    if trace is not None:
+        trace.data['dry_runs'].append({
+            'sql': sql, 'valid': valid, 'message': message,
+            'bytes_processed': bytes_processed, 'seconds': seconds
+        })
+
+def record_query(sql, df, job, error, seconds):
+    """Add a query job (its result's shape, not its rows) to the active trace, if any"""
+    trace = _active_trace.get()
+    if trace is not None:
+        job = job or {}
+        trace.data['queries'].append({
+            'sql': sql,
+            'error': error,
+            'rows': len(df) if df is not None else None,
+            'column_names': [str(column) for column in df.columns] if df is not None else None,
+            'bytes_processed': job.get('bytes_processed'),
+            'bytes_billed': job.get('bytes_billed'),
+            'slot_ms': job.get('slot_ms'),
+            'seconds': seconds
+        })
+
+def pipeline_outcome(pipeline):
+    """What a pipeline run produced, in the form stored in traces and compared on replay"""
+    info = pipeline.execution_info or {}
+    result = pipeline.result
+    return {
+        'stage': pipeline.stage,
+        'failed_stage': pipeline.failed_stage,
+        'error': pipeline.error,
+        'sql': pipeline.sql,
+        'run_sql': info.get('rewrite', {}).get('sql', pipeline.sql),
+        'validation': list(pipeline.validation) if pipeline.validation else None,
+        'repaired': pipeline.repair_info is not None,
+        'source': info.get('source'),
+        'rows': len(result) if result is not None else None,
+        'columns': len(result.columns) if result is not None else None,
+        'column_names': [str(column) for column in result.columns] if result is not None else None
+    }
+
+class TraceWriter:
+    """Appends traces to a JSONL file; each schema is written once per fingerprint"""
+
+    def __init__(self, path=None):
+        self.path = path or Config.TRACE_PATH
+        self._lock = threading.Lock()
+        self._schemas_written = set()
+
+    def write(self, trace):
+        fingerprint = schema_fingerprint(trace.table_schemas) if trace.table_schemas else None
+        trace.data['schema_fingerprint'] = fingerprint
+        lines = []
+        with self._lock:
+            if fingerprint is not None and fingerprint not in self._schemas_written:
+                lines.append({'type': 'schemas', 'fingerprint': fingerprint, 'table_schemas': trace.table_schemas})
+            lines.append(trace.data)
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    for line in lines:
+                        f.write(json.dumps(line, default=str) + "\n")
+            except OSError:
+                # Recording must never break a query
+                return
+            if fingerprint is not None:
+                self._schemas_written.add(fingerprint)
+
+def read_traces(path):
+    """(traces, {fingerprint: table_schemas}) from a trace file; unreadable lines are skipped"""
+    traces, schemas = [], {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get('type') == 'schemas':
+                schemas[record['fingerprint']] = record['table_schemas']
+            elif record.get('type') == 'trace':
+                traces.append(record)
+    return traces, schemas
+
+# Shared by every session
+TRACE_WRITER = TraceWriter()
@@ -0,0 +1,200 @@
+"""
+Token and BigQuery usage accounting.
+
+Every LLM call records its prompt and completion tokens and every BigQuery job
+its bytes processed, bytes billed and slot milliseconds. Each record carries
+the user, the Streamlit session and a normalized pattern of the question, and
+goes into a local SQLite database. From there the records can be summarized
+per user, session or question pattern, and exported. Daily per-user quotas are
+checked against the store before each LLM call or query job.
+"""
+
+import contextvars
+import csv
+import io
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from config import Config
+from scheduler import current_user_id
+
+_current_question = contextvars.ContextVar("usage_question", default=None)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage (
+    ts REAL NOT NULL,
+    user TEXT NOT NULL,
+    session TEXT NOT NULL,
+    pattern TEXT,
+    question TEXT,
+    kind TEXT NOT NULL,
+    provider TEXT,
+    prompt_tokens INTEGER DEFAULT 0,
+    completion_tokens INTEGER DEFAULT 0,
+    bytes_processed INTEGER DEFAULT 0,
+    bytes_billed INTEGER DEFAULT 0,
+    slot_ms INTEGER DEFAULT 0,
+    cache_hit INTEGER DEFAULT 0,
+    job_id TEXT
+);
+CREATE INDEX IF NOT EXISTS usage_user_ts ON usage (user, ts);
+"""
+
+GROUPINGS = {"user": "user", "session": "session", "pattern": "pattern"}
+
+class QuotaExceededError(Exception):
+    """Raised when a user has used up a daily quota"""
+
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_QUOTED_RE = re.compile(r"'[^']*'|\"[^\"]*\"")
+_PUNCTUATION_RE = re.compile(r"[^\w#?\s]")
+
+def question_pattern(question):
+    """Question with literals masked, so 'top 10 campaigns in 2024' and 'top 5 campaigns in 2023' group together"""
+    if not question:
+        return None
+    text = _QUOTED_RE.sub("?", question.lower())
+    text = _NUMBER_RE.sub("#", text)
+    text = _PUNCTUATION_RE.sub(" ", text)
+    return " ".join(text.split())
+
+def current_session_id():
+    """Streamlit session of the calling thread, or 'background'"""
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        ctx = get_script_run_ctx()
+        if ctx is not None:
+            return ctx.session_id
+    except Exception:
+        pass
+    return "background"
+
+@contextmanager
+def usage_context(question):
+    """Attribute the LLM calls and query jobs made inside the block to question"""
+    token = _current_question.set(question)
+    try:
+        yield
+    finally:
+        _current_question.reset(token)
+
+def _start_of_day():
+    return datetime.combine(datetime.now().date(), datetime.min.time()).timestamp()
+
+class UsageStore:
+    """SQLite-backed usage records"""
+
+    def __init__(self, path=None):
+        self.path = path or Config.USAGE_DB_PATH
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connection(self):
+        """Open the database on first use (caller holds the lock)"""
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.executescript(_SCHEMA)
+        return self._conn
+
+    def _record(self, kind, **values):
+        question = _current_question.get()
+        row = {
+            'ts': time.time(),
+            'user': current_user_id(),
+            'session': current_session_id(),
+            'pattern': question_pattern(question),
+            'question': question,
+            'kind': kind
+        }
+        row.update(values)
+        columns = ", ".join(row)
+        placeholders = ", ".join("?" for _ in row)
+        try:
+            with self._lock:
+                conn = self._connection()
+                conn.execute(f"INSERT INTO usage ({columns}) VALUES ({placeholders})", list(row.values()))
+                conn.commit()
+        except sqlite3.Error:
+            # Accounting must never break a query
+            pass
+
+    def record_llm(self, provider, prompt_tokens, completion_tokens):
+        self._record('llm', provider=provider, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+    def record_query(self, job_id, bytes_processed, bytes_billed, slot_ms, cache_hit=False):
+        self._record(
+            'bigquery', job_id=job_id, bytes_processed=bytes_processed or 0,
+            bytes_billed=bytes_billed or 0, slot_ms=slot_ms or 0, cache_hit=int(bool(cache_hit))
+        )
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            cursor = self._connection().execute(sql, params)
+            columns = [description[0] for description in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def summary(self, group_by="user", since=None):
+        """Totals per user, session or question pattern since a datetime, most tokens first"""
+        column = GROUPINGS[group_by]
+        return self._query(
+            f"""SELECT {column} AS "{group_by}",
+                       SUM(kind = 'llm') AS llm_calls,
+                       SUM(prompt_tokens) AS prompt_tokens,
+                       SUM(completion_tokens) AS completion_tokens,
+                       SUM(kind = 'bigquery') AS queries,
+                       SUM(bytes_processed) AS bytes_processed,
+                       SUM(bytes_billed) AS bytes_billed,
+                       SUM(slot_ms) AS slot_ms
+                FROM usage WHERE ts >= ?
+                GROUP BY {column}
+                ORDER BY SUM(prompt_tokens + completion_tokens) DESC, SUM(bytes_billed) DESC""",
+            (since.timestamp() if since else 0,)
+        )
+
+    def totals(self, user, since=None):
+        """Tokens and bytes billed for one user since a datetime (default: today)"""
+        since_ts = since.timestamp() if since else _start_of_day()
+        rows = self._query(
+            """SELECT COALESCE(SUM(prompt_tokens + completion_tokens), 0) AS tokens,
+                      COALESCE(SUM(bytes_billed), 0) AS bytes_billed
+               FROM usage WHERE user = ? AND ts >= ?""",
+            (user, since_ts)
+        )
+        return rows[0]
+
+    def export_csv(self, since=None):
+        """Every record since a datetime as CSV text"""
+        rows = self._query("SELECT * FROM usage WHERE ts >= ? ORDER BY ts", (since.timestamp() if since else 0,))
+        output = io.StringIO()
+        if rows:
+            writer = csv.DictWriter(output, fieldnames=list(rows[0]))
+            writer.writeheader()
+            for row in rows:
+                row['ts'] = datetime.fromtimestamp(row['ts']).isoformat(timespec="seconds")
+                writer.writerow(row)
+        return output.getvalue()
+
+    def check_quota(self, kind):
+        """Raise QuotaExceededError if the current user has used up today's quota for kind ('llm' or 'bigquery').
+
+        Returns what is left of the quota today, or None when there is no quota.
+        """
+        limit = Config.QUOTA_DAILY_TOKENS if kind == 'llm' else Config.QUOTA_DAILY_BYTES_BILLED
+        if not limit:
+            return None
+        user = current_user_id()
+        try:
+            totals = self.totals(user)
+        except sqlite3.Error:
+            return None
+        used = totals['tokens'] if kind == 'llm' else totals['bytes_billed']
+        if used >= limit:
+            what = "LLM token" if kind == 'llm' else "BigQuery bytes-billed"
+            raise QuotaExceededError(f"Daily {what} quota reached ({used:,} of {limit:,}); it resets at midnight")
+        return limit - used
+
+# Shared by every session
+USAGE = UsageStore()